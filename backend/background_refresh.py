@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Set
+
+# refreshes of stale cache rows run here so the request that found them doesn't wait
+refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+
+_pending: Set[Hashable] = set()
+_pending_lock = threading.Lock()
+_tasks: Set[asyncio.Task] = set()  # keeps a reference so tasks aren't garbage collected
+
+
+def _claim(key: Hashable) -> bool:
+    with _pending_lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+        return True
+
+
+def _release(key: Hashable) -> None:
+    with _pending_lock:
+        _pending.discard(key)
+
+
+def schedule_refresh(key: Hashable, fn: Callable[..., Any], *args) -> bool:
+    """
+    Runs fn(*args) on the refresh thread pool unless a refresh for key is already pending,
+    returns True if a refresh was scheduled
+    """
+    if not _claim(key):
+        return False
+
+    def run():
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"background refresh for {key} failed: {e}")
+        finally:
+            _release(key)
+
+    refresh_executor.submit(run)
+    return True
+
+
+def schedule_refresh_async(key: Hashable, fn: Callable[..., Any], *args) -> bool:
+    """Same as schedule_refresh but awaits fn(*args) as a task on the running loop"""
+    if not _claim(key):
+        return False
+
+    async def run():
+        try:
+            await fn(*args)
+        except Exception as e:
+            print(f"background refresh for {key} failed: {e}")
+        finally:
+            _release(key)
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return True
@@ -0,0 +1,447 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import text, bindparam
+from upstash_redis import Redis
+from upstash_redis.asyncio import Redis as AsyncRedis
+
+from db import engine
+from memory_cache import LRUCache
+from cache_tracking import record_cache, HIT, MISS
+
+current_directory = Path(__file__).parent
+
+# seconds between deletes of expired rows in the table backends, reads skip them anyway
+SWEEP_INTERVAL = 600
+
+
+class NamespaceConfig(BaseModel):
+    ttl: float  # seconds an entry lives in the backend
+    backend: str = "memory"  # memory, sqlite, postgres or redis
+    memory_size: int = 1000
+    # seconds decoded values are kept in process, defaults to ttl, capped at ttl
+    memory_ttl: Optional[float] = None
+    # False when the caller records hits itself, e.g. for a tier in front of a table
+    track_lookups: bool = True
+
+
+# every cached provider is tuned here
+NAMESPACES: Dict[str, NamespaceConfig] = {
+    # in-process tier in front of the minecraft_cache / hypixel_cache tables
+    "minecraft": NamespaceConfig(ttl=180, memory_size=5000, track_lookups=False),
+    "hypixel": NamespaceConfig(ttl=180, memory_size=5000, track_lookups=False),
+    "hypixel_guild": NamespaceConfig(
+        ttl=180, memory_size=1000, track_lookups=False
+    ),
+    "capes_catalog": NamespaceConfig(ttl=3600, backend="redis", memory_size=1),
+    "user_capes": NamespaceConfig(
+        ttl=900, backend="redis", memory_size=5000, memory_ttl=300
+    ),
+    # renders never change for a texture hash, so they are kept for a long time
+    # on local disk, which is shared by the workers and survives restarts
+    "texture_renders": NamespaceConfig(
+        ttl=30 * 86400, backend="sqlite", memory_size=5000, memory_ttl=3600
+    ),
+    # rendered PNGs by content hash for the /v1/images endpoints, issued urls are
+    # cached by clients for a year, so they live in postgres as long as that
+    "images": NamespaceConfig(
+        ttl=365 * 86400, backend="postgres", memory_size=5000, memory_ttl=3600
+    ),
+    "guild_atlases": NamespaceConfig(ttl=3600, memory_size=1000),
+    "wynncraft_player": NamespaceConfig(
+        ttl=300, backend="postgres", memory_size=2000, memory_ttl=60
+    ),
+    "wynncraft_guild": NamespaceConfig(
+        ttl=600, backend="postgres", memory_size=500, memory_ttl=120
+    ),
+    "wynncraft_guild_list": NamespaceConfig(ttl=3600, backend="sqlite", memory_size=1),
+    "mcci_player": NamespaceConfig(
+        ttl=300, backend="postgres", memory_size=2000, memory_ttl=60
+    ),
+    "donut_player": NamespaceConfig(
+        ttl=180, backend="postgres", memory_size=2000, memory_ttl=60
+    ),
+}
+
+
+# a stored json value and the seconds it has left in the backend
+StoredValue = Tuple[str, float]
+
+
+class CacheBackend:
+    """Stores json encoded values per namespace and key until they expire"""
+
+    def get_many(self, namespace: str, keys: List[str]) -> Dict[str, StoredValue]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    # blocking backends run their async versions on the threadpool
+    async def get_many_async(
+        self, namespace: str, keys: List[str]
+    ) -> Dict[str, StoredValue]:
+        return await run_in_threadpool(self.get_many, namespace, keys)
+
+    async def set_async(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        await run_in_threadpool(self.set, namespace, key, value, ttl)
+
+    async def delete_async(self, namespace: str, key: str) -> None:
+        await run_in_threadpool(self.delete, namespace, key)
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, path: Path = current_directory / "cache.db"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_entries_expires_at_idx ON cache_entries (expires_at)"
+            )
+            self.conn.commit()
+        self._next_sweep = 0.0
+
+    def get_many(self, namespace: str, keys: List[str]) -> Dict[str, StoredValue]:
+        placeholders = ", ".join("?" for _ in keys)
+        now = time.time()
+        with self._lock:
+            rows = self.conn.execute(
+                f"""
+                SELECT key, value, expires_at FROM cache_entries
+                WHERE namespace = ? AND key IN ({placeholders}) AND expires_at > ?
+                """,
+                (namespace, *keys, now),
+            ).fetchall()
+        return {row[0]: (row[1], row[2] - now) for row in rows}
+
+    def set(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, now + ttl),
+            )
+            # expired rows are only skipped on read, so the file is swept on writes
+            if now >= self._next_sweep:
+                self.conn.execute(
+                    "DELETE FROM cache_entries WHERE expires_at <= ?", (now,)
+                )
+                self._next_sweep = now + SWEEP_INTERVAL
+            self.conn.commit()
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+            self.conn.commit()
+
+
+def init_cache_tables() -> None:
+    """
+    Creates the table of the postgres backend, run on startup so the first
+    request using a postgres namespace doesn't block on DDL
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at TIMESTAMPTZ NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );"""
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS cache_entries_expires_at_idx ON cache_entries (expires_at);"
+            )
+        )
+
+
+class PostgresBackend(CacheBackend):
+    """Uses the cache_entries table created by init_cache_tables on startup"""
+
+    def __init__(self):
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def get_many(self, namespace: str, keys: List[str]) -> Dict[str, StoredValue]:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    """
+                    SELECT key, value, extract(epoch from expires_at - NOW()) AS ttl
+                    FROM cache_entries
+                    WHERE namespace = :namespace AND key IN :keys AND expires_at > NOW()
+                    """
+                ).bindparams(bindparam("keys", expanding=True)),
+                {"namespace": namespace, "keys": keys},
+            ).fetchall()
+        return {row.key: (row.value, float(row.ttl)) for row in rows}
+
+    def set(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    """
+                    INSERT INTO cache_entries (namespace, key, value, expires_at)
+                    VALUES (:namespace, :key, :value, NOW() + make_interval(secs => :ttl))
+                    ON CONFLICT (namespace, key)
+                    DO UPDATE SET
+                        value = EXCLUDED.value,
+                        expires_at = EXCLUDED.expires_at
+                    """
+                ),
+                {"namespace": namespace, "key": key, "value": value, "ttl": ttl},
+            )
+        if self._should_sweep():
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM cache_entries WHERE expires_at <= NOW()"))
+
+    def _should_sweep(self) -> bool:
+        """True for one caller every SWEEP_INTERVAL seconds"""
+        now = time.time()
+        with self._sweep_lock:
+            if now < self._next_sweep:
+                return False
+            self._next_sweep = now + SWEEP_INTERVAL
+            return True
+
+    def delete(self, namespace: str, key: str) -> None:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "DELETE FROM cache_entries WHERE namespace = :namespace AND key = :key"
+                ),
+                {"namespace": namespace, "key": key},
+            )
+
+
+class RedisBackend(CacheBackend):
+    def __init__(self):
+        self.redis = Redis.from_env()
+        self.async_redis = AsyncRedis.from_env()
+
+    def get_many(self, namespace: str, keys: List[str]) -> Dict[str, StoredValue]:
+        # values and their remaining ttls in one round trip
+        pipeline = self.redis.pipeline()
+        self._queue_get_many(pipeline, namespace, keys)
+        return self._stored_values(keys, pipeline.exec())
+
+    def set(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        self.redis.set(f"{namespace}:{key}", value, ex=max(int(ttl), 1))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.redis.delete(f"{namespace}:{key}")
+
+    async def get_many_async(
+        self, namespace: str, keys: List[str]
+    ) -> Dict[str, StoredValue]:
+        pipeline = self.async_redis.pipeline()
+        self._queue_get_many(pipeline, namespace, keys)
+        return self._stored_values(keys, await pipeline.exec())
+
+    async def set_async(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        await self.async_redis.set(f"{namespace}:{key}", value, ex=max(int(ttl), 1))
+
+    async def delete_async(self, namespace: str, key: str) -> None:
+        await self.async_redis.delete(f"{namespace}:{key}")
+
+    async def close(self) -> None:
+        await self.async_redis.close()
+
+    def _queue_get_many(self, pipeline, namespace: str, keys: List[str]) -> None:
+        pipeline.mget(*[f"{namespace}:{key}" for key in keys])
+        for key in keys:
+            pipeline.pttl(f"{namespace}:{key}")
+
+    def _stored_values(self, keys: List[str], results: list) -> Dict[str, StoredValue]:
+        values, ttls = results[0], results[1:]
+        stored = {}
+        for key, value, ttl_ms in zip(keys, values, ttls):
+            # pttl is -2 for a missing key and -1 for one without an expiry
+            if value is not None and ttl_ms != -2:
+                stored[key] = (value, ttl_ms / 1000 if ttl_ms >= 0 else float("inf"))
+        return stored
+
+
+BACKEND_TYPES = {
+    "sqlite": SQLiteBackend,
+    "postgres": PostgresBackend,
+    "redis": RedisBackend,
+}
+
+backends: Dict[str, CacheBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str) -> Optional[CacheBackend]:
+    """Returns the shared backend instance, None for memory only namespaces"""
+    if name == "memory":
+        return None
+    with _backends_lock:
+        if name not in backends:
+            backends[name] = BACKEND_TYPES[name]()
+        return backends[name]
+
+
+class CacheNamespace:
+    """
+    One cached provider, decoded values are kept in an in-process LRU and
+    misses fall through to the configured backend
+
+    value_type is used to encode and decode values for the backend, values in
+    memory are shared between callers so they must not be mutated.
+    """
+
+    def __init__(self, name: str, config: NamespaceConfig, value_type: Any = Any):
+        self.name = name
+        self.ttl = config.ttl
+        self.memory_ttl = min(config.memory_ttl or config.ttl, config.ttl)
+        self.memory = LRUCache(name, config.memory_size, self.memory_ttl)
+        self.backend_name = config.backend
+        self.track_lookups = config.track_lookups
+        self._adapter = TypeAdapter(value_type)
+
+    @property
+    def backend(self) -> Optional[CacheBackend]:
+        # resolved on first use so importing a module doesn't connect anywhere
+        return get_backend(self.backend_name)
+
+    def encode(self, value: Any) -> str:
+        return self._adapter.dump_json(value).decode()
+
+    def decode(self, raw: str) -> Any:
+        return self._adapter.validate_json(raw)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        found, missing = self._get_memory(keys)
+        if missing and self.backend is not None:
+            raw_values = self.backend.get_many(self.name, [str(key) for key in missing])
+            found.update(self._decode_many(missing, raw_values))
+        self._record_lookups(found, missing)
+        return found
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, min(ttl, self.memory_ttl))
+        if self.backend is not None and ttl > 0:
+            self.backend.set(self.name, str(key), self.encode(value), ttl)
+
+    def invalidate(self, key: Hashable) -> None:
+        self.memory.delete(key)
+        if self.backend is not None:
+            self.backend.delete(self.name, str(key))
+
+    async def get_async(self, key: Hashable) -> Optional[Any]:
+        return (await self.get_many_async([key])).get(key)
+
+    async def get_many_async(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        found, missing = self._get_memory(keys)
+        if missing and self.backend is not None:
+            raw_values = await self.backend.get_many_async(
+                self.name, [str(key) for key in missing]
+            )
+            found.update(self._decode_many(missing, raw_values))
+        self._record_lookups(found, missing)
+        return found
+
+    async def set_async(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, min(ttl, self.memory_ttl))
+        if self.backend is not None and ttl > 0:
+            await self.backend.set_async(self.name, str(key), self.encode(value), ttl)
+
+    async def invalidate_async(self, key: Hashable) -> None:
+        self.memory.delete(key)
+        if self.backend is not None:
+            await self.backend.delete_async(self.name, str(key))
+
+    def stats(self) -> dict:
+        return self.memory.stats()
+
+    def _get_memory(self, keys: Iterable[Hashable]):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.memory.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def _record_lookups(self, found: dict, missing: List[Hashable]) -> None:
+        if not self.track_lookups:
+            return
+        for _ in found:
+            record_cache(self.name, HIT)
+        for key in missing:
+            if key not in found:
+                record_cache(self.name, MISS)
+
+    def _decode_many(
+        self, keys: List[Hashable], raw_values: Dict[str, StoredValue]
+    ) -> dict:
+        decoded = {}
+        for key in keys:
+            stored = raw_values.get(str(key))
+            if stored is None:
+                continue
+            raw, remaining_ttl = stored
+            try:
+                value = self.decode(raw)
+            except Exception as e:
+                print(f"Couldn't decode {self.name} cache entry {key}: {e}")
+                continue
+            # an entry about to expire in the backend mustn't outlive it in memory
+            self.memory.set(key, value, min(remaining_ttl, self.memory_ttl))
+            decoded[key] = value
+        return decoded
+
+
+namespaces: Dict[str, CacheNamespace] = {}
+
+
+def get_cache(name: str, value_type: Any = Any) -> CacheNamespace:
+    """Returns the namespace configured in NAMESPACES, created on first use"""
+    if name not in namespaces:
+        namespaces[name] = CacheNamespace(name, NAMESPACES[name], value_type)
+    return namespaces[name]
+
+
+async def close_caches() -> None:
+    for backend in backends.values():
+        await backend.close()
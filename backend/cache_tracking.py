@@ -0,0 +1,70 @@
+import threading
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+from negative_cache import negative_cache
+
+HIT = "hit"  # answered from a fresh cache entry
+MISS = "miss"  # had to go to the upstream
+STALE = "stale"  # served an expired entry while it gets refreshed
+NEGATIVE = "negative"  # answered "not found" from the negative cache
+OUTCOMES = (HIT, MISS, STALE, NEGATIVE)
+
+# (namespace, outcome) pairs of the current request, None outside of requests.
+# The list is shared with the thread pool and child tasks since they copy the context.
+_lookups: ContextVar[Optional[List[Tuple[str, str]]]] = ContextVar(
+    "cache_lookups", default=None
+)
+
+# process wide totals for /metrics, including lookups made outside of requests
+outcome_counts: Dict[Tuple[str, str], int] = {}
+_counts_lock = threading.Lock()
+
+
+def start_request() -> Token:
+    return _lookups.set([])
+
+
+def end_request(token: Token) -> List[Tuple[str, str]]:
+    lookups = _lookups.get() or []
+    _lookups.reset(token)
+    return lookups
+
+
+def record_cache(namespace: str, outcome: str) -> None:
+    lookups = _lookups.get()
+    if lookups is not None:
+        lookups.append((namespace, outcome))
+    with _counts_lock:
+        outcome_counts[(namespace, outcome)] = (
+            outcome_counts.get((namespace, outcome), 0) + 1
+        )
+
+
+def source_outcome(source: str) -> str:
+    """Outcome of data read from a cache, by its source field"""
+    return STALE if source == "stale_cache" else HIT
+
+
+def miss_outcome(provider: str, key: str) -> str:
+    """Outcome of a lookup that found nothing cached and is about to fetch"""
+    return NEGATIVE if negative_cache.contains(provider, key) else MISS
+
+
+def summarize(lookups: List[Tuple[str, str]]) -> Tuple[Optional[bool], dict]:
+    """
+    Returns the cache_hit value of a request and outcome counts per namespace.
+    A request is a hit when none of its lookups went upstream, None without lookups
+    """
+    if not lookups:
+        return None, {}
+    summary: Dict[str, Dict[str, int]] = {}
+    for namespace, outcome in lookups:
+        counts = summary.setdefault(namespace, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+    cache_hit = all(outcome != MISS for _, outcome in lookups)
+    return cache_hit, summary
+
+
+def get_outcome_stats() -> Dict[Tuple[str, str], int]:
+    with _counts_lock:
+        return dict(sorted(outcome_counts.items()))
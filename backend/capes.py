@@ -1,17 +1,22 @@
-from upstash_redis import Redis
 from dotenv import load_dotenv
+import asyncio
 import requests
+import httpx
 import json
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from typing import Optional
 import exceptions
 import logging
-from PIL import Image
-import io
-from utils import pillow_to_b64
+from http_client import get_async_client, get_sync_session
+from rate_limiter import limiters
+from cache import get_cache
+from texture_cache import get_renders, get_renders_async, render_many, texture_hash
+from tracing import with_context
 
 load_dotenv()
 logger = logging.getLogger(__name__)
-redis = Redis.from_env()
 
 browser_headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
@@ -26,8 +31,14 @@ class GenericCapeData(BaseModel):
 
 
 class CapeImageData(BaseModel):
-    front_b64: str
-    back_b64: str
+    front_b64: Optional[str]
+    back_b64: Optional[str]
+    # set instead of the base64 fields when a response asks for image urls
+    front_url: Optional[str] = None
+    back_url: Optional[str] = None
+
+
+CAPE_IMAGE_FIELDS = {"front_b64": "front_url", "back_b64": "back_url"}
 
 
 class UserCapeData(BaseModel):
@@ -37,6 +48,19 @@ class UserCapeData(BaseModel):
     removed: bool
 
 
+capes_catalog_cache = get_cache("capes_catalog", list[GenericCapeData])
+user_capes_cache = get_cache("user_capes", list[UserCapeData])
+
+# cape images missing from the texture cache are downloaded this many at a time
+CAPE_DOWNLOAD_WORKERS = 8
+
+# the catalog list the index was built from and the index by cape type
+_cape_index: tuple[Optional[list[GenericCapeData]], dict[str, GenericCapeData]] = (
+    None,
+    {},
+)
+
+
 def proccess_generic_capes(cape_data) -> list[GenericCapeData]:
     capes: list[GenericCapeData] = []
     cape_data = json.loads(cape_data)
@@ -59,16 +83,34 @@ def get_cape_dictionary(cape_list: list[GenericCapeData]) -> dict[str, GenericCa
     return cape_dict
 
 
-def get_generic_cape_data() -> list[GenericCapeData]:
-    """Fetches data from capes.me about all known capes and caches it in Redis."""
-    cape_data_raw = redis.get("generic_capes_me_data")
-    if cape_data_raw:
-        return proccess_generic_capes(cape_data_raw)
-
+def get_cape_index(catalog: list[GenericCapeData]) -> dict[str, GenericCapeData]:
+    """
+    Catalog by cape type, kept between requests and only rebuilt when the cached
+    catalog is replaced
+    """
+    global _cape_index
+    indexed_catalog, index = _cape_index
+    if indexed_catalog is not catalog:
+        index = get_cape_dictionary(catalog)
+        _cape_index = (catalog, index)
+    return index
+
+
+def get_generic_cape_data(refresh: bool = False) -> list[GenericCapeData]:
+    """
+    Fetches data from capes.me about all known capes and caches it,
+    refresh skips the cache read so the cached catalog is replaced
+    """
+    generic_capes = None if refresh else capes_catalog_cache.get("all")
+    if generic_capes is not None:
+        return generic_capes
+
+    limiters["capes_me"].acquire()
     try:
-        response = requests.get(
+        response = get_sync_session().get(
             "https://capes.me/api/capes", timeout=10, headers=browser_headers
         )
+        limiters["capes_me"].update(response)
         response.raise_for_status()
     except requests.exceptions.HTTPError as e:
         logger.error(f"HTTP error occurred: {e}")
@@ -85,27 +127,59 @@ def get_generic_cape_data() -> list[GenericCapeData]:
 
     response_data = response.json()
 
-    redis.set(
-        "generic_capes_me_data", json.dumps(response_data), ex=3600
-    )  # cache for 1 hour
+    generic_capes = proccess_generic_capes(json.dumps(response_data))
+    capes_catalog_cache.set("all", generic_capes)
+
+    return generic_capes
+
 
-    return proccess_generic_capes(json.dumps(response_data))
+async def get_generic_cape_data_async() -> list[GenericCapeData]:
+    """Async version of get_generic_cape_data"""
+    generic_capes = await capes_catalog_cache.get_async("all")
+    if generic_capes is not None:
+        return generic_capes
+
+    await limiters["capes_me"].acquire_async()
+    try:
+        response = await get_async_client().get(
+            "https://capes.me/api/capes", headers=browser_headers
+        )
+        limiters["capes_me"].update(response)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error occurred: {e}")
+        raise exceptions.UpstreamError()
+    except httpx.TimeoutException as e:
+        logger.error(f"Request timed out: {e}")
+        raise exceptions.UpstreamTimeoutError()
+    except httpx.RequestError as e:
+        logger.error(f"Request exception occurred: {e}")
+        raise exceptions.UpstreamError()
+    except Exception as e:
+        logger.warning(f"something went wrong while getting capes from capes.me: {e}")
+        raise exceptions.ServiceError()
+
+    response_data = response.json()
+
+    generic_capes = proccess_generic_capes(json.dumps(response_data))
+    await capes_catalog_cache.set_async("all", generic_capes)
+
+    return generic_capes
 
 
 def get_capes_for_user(uuid: str):
     """Fetches capes for a specific user by UUID."""
 
-    user_cape_data_raw = redis.get(f"user_capes_me_data_{uuid}")
-    if user_cape_data_raw:
-        capes = []
-        for cape in json.loads(user_cape_data_raw):
-            capes.append(UserCapeData(**cape))
+    capes = user_capes_cache.get(uuid)
+    if capes is not None:
         return capes
 
+    limiters["capes_me"].acquire()
     try:
-        response = requests.get(
+        response = get_sync_session().get(
             f"https://capes.me/api/user/{uuid}", timeout=10, headers=browser_headers
         )
+        limiters["capes_me"].update(response)
         response.raise_for_status()
     except requests.exceptions.HTTPError as e:
         if response.status_code == 404:
@@ -126,38 +200,145 @@ def get_capes_for_user(uuid: str):
 
     user_cape_data = response_data.get("capes", [])
 
-    generic_cape_data = get_generic_cape_data()
-    cape_dictionary = get_cape_dictionary(
-        generic_cape_data
-    )  # this is to easily map cape type from capes.me to url
+    # maps the cape type from capes.me to its url
+    cape_index = get_cape_index(get_generic_cape_data())
+    images = get_cape_images_many(
+        [cape_index[cape.get("type")].url for cape in user_cape_data]
+    )
+    user_capes = _user_capes(user_cape_data, cape_index, images)
+
+    user_capes_cache.set(uuid, user_capes)
+
+    return user_capes
+
+
+async def get_capes_for_user_async(uuid: str):
+    """Async version of get_capes_for_user"""
+
+    capes = await user_capes_cache.get_async(uuid)
+    if capes is not None:
+        return capes
+
+    await limiters["capes_me"].acquire_async()
+    try:
+        response = await get_async_client().get(
+            f"https://capes.me/api/user/{uuid}", headers=browser_headers
+        )
+        limiters["capes_me"].update(response)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise exceptions.NotFound()
+        logger.error(f"HTTP error occurred: {e}")
+        raise exceptions.UpstreamError()
+    except httpx.TimeoutException as e:
+        logger.error(f"Request timed out: {e}")
+        raise exceptions.UpstreamTimeoutError()
+    except httpx.RequestError as e:
+        logger.error(f"Request exception occurred: {e}")
+        raise exceptions.UpstreamError()
+    except Exception as e:
+        logger.warning(f"something went wrong while getting capes from capes.me: {e}")
+        raise exceptions.ServiceError()
+
+    response_data = response.json()
+
+    user_cape_data = response_data.get("capes", [])
+
+    cape_index = get_cape_index(await get_generic_cape_data_async())
+    images = await get_cape_images_many_async(
+        [cape_index[cape.get("type")].url for cape in user_cape_data]
+    )
+    user_capes = _user_capes(user_cape_data, cape_index, images)
+
+    await user_capes_cache.set_async(uuid, user_capes)
+
+    return user_capes
+
 
+def _user_capes(
+    user_cape_data: list[dict],
+    cape_index: dict[str, GenericCapeData],
+    images: dict[str, CapeImageData],
+) -> list[UserCapeData]:
     user_capes: list[UserCapeData] = []
     for cape in user_cape_data:
-        image_data = get_cape_images(cape_dictionary[cape.get("type")].url)
+        generic_cape = cape_index[cape.get("type")]
         user_capes.append(
             UserCapeData(
-                name=cape_dictionary[cape.get("type")].name,
-                url=cape_dictionary[cape.get("type")].url,
-                images=image_data,
+                name=generic_cape.name,
+                url=generic_cape.url,
+                images=images[generic_cape.url],
                 removed=cape.get("removed", False),
             )
         )
-
-    redis.set(
-        f"user_capes_me_data_{uuid}", json.dumps([cape.model_dump() for cape in user_capes]), ex=900
-    )
-
     return user_capes
 
 
 def get_cape_images(cape_url: str) -> CapeImageData:
-    cape_data = redis.get(f"cape_image_data_{cape_url}")
-    if cape_data:
-        cape_data_json = json.loads(cape_data)
-        return CapeImageData(**cape_data_json)
+    """Cape renders are shared with the mojang profiles through the texture cache"""
+    return get_cape_images_many([cape_url])[cape_url]
+
+
+async def get_cape_images_async(cape_url: str) -> CapeImageData:
+    """Async version of get_cape_images"""
+    return (await get_cape_images_many_async([cape_url]))[cape_url]
+
+
+def get_cape_images_many(cape_urls: list[str]) -> dict[str, CapeImageData]:
+    """
+    Images of many capes by url. Cached renders are read in one lookup, the
+    missing capes are downloaded concurrently and rendered as one batch.
+    """
+    cape_urls = list(dict.fromkeys(cape_urls))
+    cached = get_renders(cape_urls)
+    missing = [url for url in cape_urls if texture_hash(url) not in cached]
+
+    rendered = {}
+    if missing:
+        workers = min(CAPE_DOWNLOAD_WORKERS, len(missing))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(with_context(_download_cape), url) for url in missing
+            ]
+            contents = [future.result() for future in futures]
+        rendered = render_many("cape", list(zip(missing, contents)))
+
+    return {
+        url: _cape_image_data(cached.get(texture_hash(url)) or rendered.get(url))
+        for url in cape_urls
+    }
+
+
+async def get_cape_images_many_async(cape_urls: list[str]) -> dict[str, CapeImageData]:
+    """Async version of get_cape_images_many"""
+    cape_urls = list(dict.fromkeys(cape_urls))
+    cached = await get_renders_async(cape_urls)
+    missing = [url for url in cape_urls if texture_hash(url) not in cached]
+
+    rendered = {}
+    if missing:
+        semaphore = asyncio.Semaphore(CAPE_DOWNLOAD_WORKERS)
+
+        async def download(url: str) -> bytes:
+            async with semaphore:
+                return await _download_cape_async(url)
+
+        contents = await asyncio.gather(*[download(url) for url in missing])
+        # big batches block on the render process pool
+        rendered = await run_in_threadpool(
+            render_many, "cape", list(zip(missing, contents))
+        )
 
+    return {
+        url: _cape_image_data(cached.get(texture_hash(url)) or rendered.get(url))
+        for url in cape_urls
+    }
+
+
+def _download_cape(cape_url: str) -> bytes:
     try:
-        response = requests.get(cape_url, timeout=10)
+        response = get_sync_session().get(cape_url, timeout=10)
         response.raise_for_status()
     except requests.exceptions.HTTPError as e:
         logger.error(f"HTTP error occurred: {e}")
@@ -173,29 +354,34 @@ def get_cape_images(cape_url: str) -> CapeImageData:
             f"something went wrong while getting cape image from mojang: {e}"
         )
         raise exceptions.ServiceError()
+    return response.content
 
-    cape_bytes = io.BytesIO(response.content)
-    full_cape_image = Image.open(cape_bytes)
-
-    crop_area = (1, 1, 11, 17)
-    cape_showcase = full_cape_image.crop(crop_area)
-
-    crop_area = (12, 1, 22, 17)
-    cape_back = full_cape_image.crop(crop_area)
-
-    cape_front_b64 = pillow_to_b64(cape_showcase)
-    cape_back_b64 = pillow_to_b64(cape_back)
 
-    full_cape_data = CapeImageData(
-        front_b64=cape_front_b64,
-        back_b64=cape_back_b64,
-    )
+async def _download_cape_async(cape_url: str) -> bytes:
+    try:
+        response = await get_async_client().get(cape_url)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error occurred: {e}")
+        raise exceptions.UpstreamError()
+    except httpx.TimeoutException as e:
+        logger.error(f"Request timed out: {e}")
+        raise exceptions.UpstreamTimeoutError()
+    except httpx.RequestError as e:
+        logger.error(f"Request exception occurred: {e}")
+        raise exceptions.UpstreamError()
+    except Exception as e:
+        logger.warning(
+            f"something went wrong while getting cape image from mojang: {e}"
+        )
+        raise exceptions.ServiceError()
+    return response.content
 
-    redis.set(
-        f"cape_image_data_{cape_url}", full_cape_data.model_dump_json(), ex=86400
-    )  # cache for 24 hours
 
-    return full_cape_data
+def _cape_image_data(rendered: Optional[dict]) -> CapeImageData:
+    if rendered is None:
+        raise exceptions.ServiceError()
+    return CapeImageData(front_b64=rendered["front"], back_b64=rendered["back"])
 
 
 if __name__ == "__main__":
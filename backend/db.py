@@ -1,22 +1,211 @@
 # db.py
 import os
 import re
-from sqlalchemy import create_engine
+import threading
+import time
+from typing import Dict
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    async_sessionmaker,
+    create_async_engine,
+)
+from tracing import record_span
+
+load_dotenv()
 
 db_url = os.getenv("DATABASE_URL").split("?")[0]
 db_url = re.sub(r"^postgresql\+asyncpg:", "postgresql+psycopg2:", db_url)
 db_url = re.sub(r"^postgresql:", "postgresql+psycopg2:", db_url)
-
-engine = create_engine(
-    db_url,
-    connect_args={"sslmode": "require"},
-    echo=False,
-    pool_pre_ping=True,
+# asyncpg prepares every statement, the dialect keeps this many per connection
+async_db_url = (
+    re.sub(r"^postgresql\+psycopg2:", "postgresql+asyncpg:", db_url)
+    + "?prepared_statement_cache_size="
+    + os.getenv("DB_STATEMENT_CACHE_SIZE", "500")
 )
 
+
+class PoolConfig(BaseModel):
+    pool_size: int = 10
+    max_overflow: int = 10
+    pool_recycle: int = 1800  # seconds before a connection is replaced
+    pool_timeout: int = 30  # seconds to wait for a free connection
+
+
+# every engine in the app, sized through the DB_POOL_* environment variables
+POOLS: Dict[str, PoolConfig] = {
+    "default": PoolConfig(
+        pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 30)),
+    ),
+}
+
+
+class PoolStats:
+    """Counts checkouts and how long callers waited for a connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def record(self, wait: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": (
+                    1000 * self.total_wait / self.checkouts if self.checkouts else 0.0
+                ),
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+
+class TimedPoolMixin:
+    """Records how long each checkout of a queue pool waited"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            # connect errors of new connections aren't waits, so they aren't counted
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _record_query_span(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    record_span("db " + statement.split(None, 1)[0].lower(), "db", started)
+
+
+def _drop_query_timer(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def trace_queries(sync_engine: Engine) -> None:
+    """Adds a db span for every statement run while a request is traced"""
+    event.listen(sync_engine, "before_cursor_execute", _start_query_timer)
+    event.listen(sync_engine, "after_cursor_execute", _record_query_span)
+    event.listen(sync_engine, "handle_error", _drop_query_timer)
+
+
+engines: Dict[str, Engine] = {}
+async_engines: Dict[str, AsyncEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name: str = "default") -> Engine:
+    """Returns the shared engine for a pool in POOLS, created on first use"""
+    with _engines_lock:
+        if name not in engines:
+            config = POOLS[name]
+            engines[name] = create_engine(
+                db_url,
+                connect_args={"sslmode": "require"},
+                echo=False,
+                pool_pre_ping=True,
+                poolclass=TimedQueuePool,
+                pool_size=config.pool_size,
+                max_overflow=config.max_overflow,
+                pool_recycle=config.pool_recycle,
+                pool_timeout=config.pool_timeout,
+            )
+            trace_queries(engines[name])
+        return engines[name]
+
+
+def get_async_engine(name: str = "default") -> AsyncEngine:
+    """Same as get_engine but for asyncpg, sized by the same PoolConfig"""
+    with _engines_lock:
+        if name not in async_engines:
+            config = POOLS[name]
+            async_engines[name] = create_async_engine(
+                async_db_url,
+                connect_args={"ssl": "require"},
+                echo=False,
+                pool_pre_ping=True,
+                poolclass=TimedAsyncQueuePool,
+                pool_size=config.pool_size,
+                max_overflow=config.max_overflow,
+                pool_recycle=config.pool_recycle,
+                pool_timeout=config.pool_timeout,
+            )
+            trace_queries(async_engines[name].sync_engine)
+        return async_engines[name]
+
+
+def get_pool_stats() -> Dict[str, dict]:
+    """Pool usage and checkout wait times for every engine"""
+    pool_stats = {}
+    all_engines = {
+        **engines,
+        **{f"{name}_async": pool_engine for name, pool_engine in async_engines.items()},
+    }
+    for name, pool_engine in all_engines.items():
+        pool = pool_engine.pool
+        pool_stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            **pool.wait_stats.stats(),
+        }
+    return pool_stats
+
+
+engine = get_engine()
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+async_engine = get_async_engine()
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -24,3 +213,13 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def close_async_engines() -> None:
+    for pool_engine in async_engines.values():
+        await pool_engine.dispose()
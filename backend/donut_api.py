@@ -1,10 +1,15 @@
-import requests
+import asyncio
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
 from fastapi import HTTPException
-from metrics_manager import add_value, get_engine
+from metric_writer import metric_writer
 from minecraft_manager import get_minecraft_data
+from http_client import get_async_client, get_sync_session
+from rate_limiter import limiters
+from negative_cache import negative_cache
+from cache_tracking import record_cache, NEGATIVE
+from cache import get_cache
 
 
 load_dotenv()
@@ -29,13 +34,29 @@ class DonutPlayerStats(BaseModel):
     online: bool
 
 
+player_cache = get_cache("donut_player", DonutPlayerStats)
+
+
 def get_donut_stats(username) -> DonutPlayerStats:
     """Returns a DonutPlayerStats object on success, 404 on fail"""
+    cache_key = username.lower()
+    if negative_cache.contains("donutsmp", cache_key):
+        record_cache(player_cache.name, NEGATIVE)
+        raise HTTPException(404, {"message": f"player {username} was not found"})
+
+    player_data = player_cache.get(cache_key)
+    if player_data is not None:
+        return player_data
+
+    limiters["donutsmp"].acquire()
     try:
-        donut_response_raw = requests.get(
+        donut_response_raw = get_sync_session().get(
             f"https://api.donutsmp.net/v1/stats/{username}",
             headers={"Authorization": donut_api_key},
         )
+        limiters["donutsmp"].update(donut_response_raw)
+        if donut_response_raw.status_code == 404:
+            negative_cache.add("donutsmp", cache_key)
         donut_response_raw.raise_for_status()
         donut_response = donut_response_raw.json()
 
@@ -45,6 +66,50 @@ def get_donut_stats(username) -> DonutPlayerStats:
         print(f"could not retrieve stats: {e}")
         raise HTTPException(404, {"message": f"player {username} was not found"})
 
+    player_data = parse_donut_stats(donut_response, online_status)
+    negative_cache.invalidate("donutsmp", cache_key)
+    player_cache.set(cache_key, player_data)
+    return player_data
+
+
+async def get_donut_stats_async(username) -> DonutPlayerStats:
+    """Async version of get_donut_stats, stats and status are fetched concurrently"""
+    cache_key = username.lower()
+    if negative_cache.contains("donutsmp", cache_key):
+        record_cache(player_cache.name, NEGATIVE)
+        raise HTTPException(404, {"message": f"player {username} was not found"})
+
+    player_data = await player_cache.get_async(cache_key)
+    if player_data is not None:
+        return player_data
+
+    await limiters["donutsmp"].acquire_async()
+    try:
+        donut_response_raw, online_status = await asyncio.gather(
+            get_async_client().get(
+                f"https://api.donutsmp.net/v1/stats/{username}",
+                headers={"Authorization": donut_api_key},
+            ),
+            get_donut_status_async(username),
+        )
+        limiters["donutsmp"].update(donut_response_raw)
+        if donut_response_raw.status_code == 404:
+            negative_cache.add("donutsmp", cache_key)
+        donut_response_raw.raise_for_status()
+        donut_response = donut_response_raw.json()
+
+    except Exception as e:
+        print(f"could not retrieve stats: {e}")
+        raise HTTPException(404, {"message": f"player {username} was not found"})
+
+    player_data = parse_donut_stats(donut_response, online_status)
+    negative_cache.invalidate("donutsmp", cache_key)
+    await player_cache.set_async(cache_key, player_data)
+    return player_data
+
+
+def parse_donut_stats(donut_response: dict, online_status: bool) -> DonutPlayerStats:
+    """Builds a DonutPlayerStats from the raw stats response"""
     stats_to_convert = {
         "money": "money",
         "shards": "shards",
@@ -99,25 +164,46 @@ def get_donut_status(username) -> bool:
     """Returns true if the player is online, false if offline"""
     # so the donutapi is really dumb it only shows rank if the player is online like who designed this 💀
     try:
-        donut_status_response = requests.get(
+        limiters["donutsmp"].acquire()
+        donut_status_response = get_sync_session().get(
             f"https://api.donutsmp.net/v1/lookup/{username}",
             headers={"Authorization": donut_api_key},
         )
+        limiters["donutsmp"].update(donut_status_response)
+        return parse_donut_status(donut_status_response)
+    except Exception as e:
+        print(f"could not retrieve status: {e}")
+        return False
 
-        if (
-            donut_status_response.status_code == 500
-        ):  # if the player is offline, the server returns a 500
-            return False
-
-        donut_status_response.raise_for_status()
 
-        if donut_status_response.json()["result"] is not None:
-            return True
+async def get_donut_status_async(username) -> bool:
+    """Async version of get_donut_status"""
+    try:
+        await limiters["donutsmp"].acquire_async()
+        donut_status_response = await get_async_client().get(
+            f"https://api.donutsmp.net/v1/lookup/{username}",
+            headers={"Authorization": donut_api_key},
+        )
+        limiters["donutsmp"].update(donut_status_response)
+        return parse_donut_status(donut_status_response)
     except Exception as e:
         print(f"could not retrieve status: {e}")
         return False
 
 
+def parse_donut_status(donut_status_response) -> bool:
+    if (
+        donut_status_response.status_code == 500
+    ):  # if the player is offline, the server returns a 500
+        return False
+
+    donut_status_response.raise_for_status()
+
+    if donut_status_response.json()["result"] is not None:
+        return True
+    return False
+
+
 def add_donut_stats_to_db(data: DonutPlayerStats, username, session) -> None:
     if not isinstance(data, DonutPlayerStats):
         print("Couldn't add donut data to db because it's not DonutPlayerStats")
@@ -150,11 +236,7 @@ def add_donut_stats_to_db(data: DonutPlayerStats, username, session) -> None:
         )
         return
 
-    engine = get_engine()
-    with engine.begin() as conn:
-        for stat in stats_to_add:
-            if stats_to_add.get(stat, None) is not None:
-                add_value(conn, uuid, stat, stats_to_add[stat])
+    metric_writer.add_many(uuid, stats_to_add)
 
 
 if __name__ == "__main__":
@@ -36,6 +36,16 @@ class UpstreamTimeoutError(HTTPException):
         )
 
 
+class UpstreamRateLimitError(HTTPException):
+    """Indicates that we ran out of quota for an Upstream provider"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=429,
+            detail="Upstream provider rate limit reached, try again later",
+        )
+
+
 class ServiceAPIKeyError(HTTPException):
     """Indicates an invalid API key, backend's fault"""
 
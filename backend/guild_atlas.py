@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import io
+from typing import List, Optional
+from PIL import Image
+from pydantic import BaseModel
+from cache import get_cache
+from hypixel_api import HypixelGuildMemberFull
+from image_store import store_image
+from tracing import traced
+from utils import pillow_to_b64
+
+TILE_SIZE = 8  # faces are rendered at 8x8
+ATLAS_COLUMNS = 10
+
+
+class AtlasMember(BaseModel):
+    uuid: str
+    username: str
+    rank: str
+    joined: str
+    x: int  # offset of the member's face in the atlas, in pixels
+    y: int
+
+
+class GuildAtlas(BaseModel):
+    image_url: str
+    tile_size: int
+    columns: int
+    width: int
+    height: int
+    members: List[AtlasMember]
+
+
+# keyed by guild, page and a digest of the page's faces, so a page is only
+# composed again when its members or one of their skins changed
+guild_atlas_cache = get_cache("guild_atlases", GuildAtlas)
+
+
+def faces_digest(members: List[HypixelGuildMemberFull]) -> str:
+    digest = hashlib.sha256()
+    for member in members:
+        digest.update(member.uuid.encode())
+        digest.update(hashlib.sha256((member.skin_showcase_b64 or "").encode()).digest())
+    return digest.hexdigest()
+
+
+def get_guild_atlas(
+    id: str, members: List[HypixelGuildMemberFull], offset: int, limit: int
+) -> GuildAtlas:
+    key = f"{id}:{offset}:{limit}:{faces_digest(members)}"
+    atlas = guild_atlas_cache.get(key)
+    if atlas is None:
+        atlas = build_guild_atlas(members)
+        guild_atlas_cache.set(key, atlas)
+    return atlas
+
+
+@traced("build guild atlas", kind="image")
+def build_guild_atlas(members: List[HypixelGuildMemberFull]) -> GuildAtlas:
+    """Packs the faces of members into one PNG, in order, ATLAS_COLUMNS per row"""
+    columns = max(1, min(ATLAS_COLUMNS, len(members)))
+    rows = max(1, -(-len(members) // columns))
+    atlas = Image.new("RGBA", (columns * TILE_SIZE, rows * TILE_SIZE), (0, 0, 0, 0))
+
+    atlas_members = []
+    for i, member in enumerate(members):
+        x = (i % columns) * TILE_SIZE
+        y = (i // columns) * TILE_SIZE
+        face = _load_face(member.skin_showcase_b64)
+        if face is not None:
+            atlas.paste(face, (x, y))
+        atlas_members.append(
+            AtlasMember(
+                uuid=member.uuid,
+                username=member.username,
+                rank=member.rank,
+                joined=member.joined,
+                x=x,
+                y=y,
+            )
+        )
+
+    return GuildAtlas(
+        image_url=store_image(pillow_to_b64(atlas)),
+        tile_size=TILE_SIZE,
+        columns=columns,
+        width=atlas.width,
+        height=atlas.height,
+        members=atlas_members,
+    )
+
+
+def _load_face(b64: Optional[str]) -> Optional[Image.Image]:
+    if b64 is None:
+        return None
+    try:
+        face = Image.open(io.BytesIO(base64.b64decode(b64))).convert("RGBA")
+    except Exception as e:
+        print(f"Couldn't load face for the guild atlas: {e}")
+        return None
+    if face.size != (TILE_SIZE, TILE_SIZE):
+        face = face.resize((TILE_SIZE, TILE_SIZE), Image.NEAREST)
+    return face
@@ -0,0 +1,122 @@
+import importlib.util
+import logging
+import time
+from urllib.parse import urlsplit
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from latency_metrics import upstream_latency
+from tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+# shared connection pools for every upstream provider, these live for the whole app lifetime
+# so repeated calls to the same host reuse keep-alive connections instead of doing a new TLS handshake
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 30  # in seconds
+DEFAULT_TIMEOUT = 10  # in seconds
+
+# http2 needs the optional h2 package, we fall back to http/1.1 without it
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# upstream hosts by the provider name used in rate_limiter and the latency metrics
+PROVIDER_HOSTS = {
+    "api.hypixel.net": "hypixel",
+    "api.wynncraft.com": "wynncraft",
+    "sessionserver.mojang.com": "mojang",
+    "api.minecraftservices.com": "mojang",
+    "api.mccisland.net": "mcci",
+    "api.donutsmp.net": "donutsmp",
+    "capes.me": "capes_me",
+    "textures.minecraft.net": "minecraft_textures",
+}
+
+
+def provider_for(url) -> str:
+    host = urlsplit(str(url)).hostname or ""
+    return PROVIDER_HOSTS.get(host, "other")
+
+
+async def _start_timer(request: httpx.Request) -> None:
+    request.extensions["started"] = time.perf_counter()
+
+
+async def _record_async_response(response: httpx.Response) -> None:
+    started = response.request.extensions.get("started")
+    if started is not None:
+        provider = provider_for(response.request.url)
+        upstream_latency.observe(
+            time.perf_counter() - started, provider=provider, status=response.status_code
+        )
+        record_span(
+            f"upstream {provider}", "upstream", started, status=response.status_code
+        )
+
+
+def _record_response(response: requests.Response, *args, **kwargs) -> None:
+    provider = provider_for(response.url)
+    elapsed = response.elapsed.total_seconds()
+    upstream_latency.observe(elapsed, provider=provider, status=response.status_code)
+    record_span(
+        f"upstream {provider}",
+        "upstream",
+        time.perf_counter() - elapsed,
+        status=response.status_code,
+    )
+
+
+_async_client: httpx.AsyncClient | None = None
+_sync_session: requests.Session | None = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the shared async client, creating it on first use"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={
+                "request": [_start_timer],
+                "response": [_record_async_response],
+            },
+        )
+        logger.info(f"created shared async http client (http2: {HTTP2_ENABLED})")
+    return _async_client
+
+
+def get_sync_session() -> requests.Session:
+    """
+    Returns the shared requests session used by the sync code paths
+    (thread pools, background tasks and scripts)
+    """
+    global _sync_session
+    if _sync_session is None:
+        adapter = HTTPAdapter(
+            pool_connections=16,  # amount of hosts to keep a pool for
+            pool_maxsize=MAX_KEEPALIVE_CONNECTIONS,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.hooks["response"].append(_record_response)
+        _sync_session = session
+    return _sync_session
+
+
+async def close_clients() -> None:
+    """Closes the shared clients, called on app shutdown"""
+    global _async_client, _sync_session
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_session is not None:
+        _sync_session.close()
+        _sync_session = None
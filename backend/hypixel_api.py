@@ -1,4 +1,5 @@
 import requests
+import httpx
 import datetime
 from dotenv import load_dotenv
 import os
@@ -7,6 +8,8 @@ import exceptions
 from pydantic import BaseModel
 from typing import Optional, List
 import math
+from http_client import get_async_client, get_sync_session
+from rate_limiter import limiters
 
 logger = logging.getLogger(__name__)
 
@@ -108,7 +111,8 @@ class HypixelGuildMemberFull(BaseModel):
     uuid: str
     rank: str
     joined: str
-    skin_showcase_b64: str
+    skin_showcase_b64: Optional[str]
+    skin_showcase_url: Optional[str] = None  # set instead of base64 in url mode
 
 class HypixelGuild(BaseModel):
     source: str
@@ -145,13 +149,15 @@ def get_core_hypixel_data(
         print(f"First 4 chars: {env_key[:4]}")
     print(f"Argument key matches Env key: {hypixel_api_key == env_key}")
     print("---------------------")
+    limiters["hypixel"].acquire()
     try:
-        player_data_raw = requests.get(
+        player_data_raw = get_sync_session().get(
             url="https://api.hypixel.net/v2/player",
             params=payload,
             headers={"API-Key": hypixel_api_key},
             timeout=10,
         )
+        limiters["hypixel"].update(player_data_raw)
 
         player_data_raw.raise_for_status()
 
@@ -174,6 +180,49 @@ def get_core_hypixel_data(
         logger.warning(f"something went wrong while getting Hypixel player data: {e}")
         raise exceptions.ServiceError()
 
+    return parse_hypixel_player(uuid, player_data)
+
+
+async def get_core_hypixel_data_async(uuid, hypixel_api_key=None) -> HypixelPlayer:
+    """Async version of get_core_hypixel_data using the shared client"""
+    if hypixel_api_key is None:
+        hypixel_api_key = os.getenv("hypixel_api_key")
+
+    await limiters["hypixel"].acquire_async()
+    try:
+        player_data_raw = await get_async_client().get(
+            url="https://api.hypixel.net/v2/player",
+            params={"uuid": uuid},
+            headers={"API-Key": hypixel_api_key},
+        )
+        limiters["hypixel"].update(player_data_raw)
+
+        player_data_raw.raise_for_status()
+
+        player_data: dict = player_data_raw.json()
+
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 403:
+            logger.error(f"Invalid API key: {e}")
+            raise exceptions.ServiceAPIKeyError()
+        else:
+            logger.error(f"HTTP error occurred: {e}")
+            raise exceptions.UpstreamError()
+    except httpx.TimeoutException as e:
+        logger.error(f"Request timed out: {e}")
+        raise exceptions.UpstreamTimeoutError()
+    except httpx.RequestError as e:
+        logger.error(f"Request exception occurred: {e}")
+        raise exceptions.UpstreamError()
+    except Exception as e:
+        logger.warning(f"something went wrong while getting Hypixel player data: {e}")
+        raise exceptions.ServiceError()
+
+    return parse_hypixel_player(uuid, player_data)
+
+
+def parse_hypixel_player(uuid, player_data: dict) -> HypixelPlayer:
+    """Builds a HypixelPlayer from the raw /v2/player response"""
     if player_data.get("player") is None:
         raise exceptions.NotFound()
 
@@ -295,6 +344,7 @@ def calculate_bedwars_level(experience) -> int:
 
 
 def get_guild_data(uuid: str = None, id: str = None) -> HypixelGuild:
+    limiters["hypixel"].acquire()
     try:
         if uuid is None and id is None:
             raise exceptions.InvalidUserUUID()
@@ -303,12 +353,13 @@ def get_guild_data(uuid: str = None, id: str = None) -> HypixelGuild:
         if id is not None:
             payload = {"id": id}
 
-        guild_data_raw = requests.get(
+        guild_data_raw = get_sync_session().get(
             url="https://api.hypixel.net/v2/guild",
             params=payload,
             headers={"API-Key": os.getenv("hypixel_api_key")},
             timeout=10,
         )
+        limiters["hypixel"].update(guild_data_raw)
 
         guild_data_raw.raise_for_status()
 
@@ -329,7 +380,54 @@ def get_guild_data(uuid: str = None, id: str = None) -> HypixelGuild:
         logger.warning(f"something went wrong while getting Hypixel guild data: {e}")
         raise exceptions.ServiceError()
 
-    guild_data: dict = guild_data_raw.json().get("guild")
+    return parse_guild_data(guild_data_raw.json())
+
+
+async def get_guild_data_async(uuid: str = None, id: str = None) -> HypixelGuild:
+    """Async version of get_guild_data using the shared client"""
+    await limiters["hypixel"].acquire_async()
+    try:
+        if uuid is None and id is None:
+            raise exceptions.InvalidUserUUID()
+        if uuid is not None:
+            payload = {"player": uuid}
+        if id is not None:
+            payload = {"id": id}
+
+        guild_data_raw = await get_async_client().get(
+            url="https://api.hypixel.net/v2/guild",
+            params=payload,
+            headers={"API-Key": os.getenv("hypixel_api_key")},
+        )
+        limiters["hypixel"].update(guild_data_raw)
+
+        guild_data_raw.raise_for_status()
+
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 403:
+            logger.error(f"Invalid API key: {e}")
+            raise exceptions.ServiceAPIKeyError()
+        else:
+            logger.error(f"HTTP error occurred: {e}")
+            raise exceptions.UpstreamError()
+    except httpx.TimeoutException as e:
+        logger.error(f"Request timed out: {e}")
+        raise exceptions.UpstreamTimeoutError()
+    except httpx.RequestError as e:
+        logger.error(f"Request exception occurred: {e}")
+        raise exceptions.UpstreamError()
+    except exceptions.InvalidUserUUID:
+        raise
+    except Exception as e:
+        logger.warning(f"something went wrong while getting Hypixel guild data: {e}")
+        raise exceptions.ServiceError()
+
+    return parse_guild_data(guild_data_raw.json())
+
+
+def parse_guild_data(guild_response: dict) -> HypixelGuild:
+    """Builds a HypixelGuild from the raw /v2/guild response"""
+    guild_data: dict = guild_response.get("guild")
 
     if guild_data is None:
         raise exceptions.NotFound()
@@ -2,28 +2,52 @@ from hypixel_api import (
     HypixelPlayer,
     HypixelGuild,
     HypixelFullData,
-    HypixelGuildMember,
     HypixelGuildMemberFull,
     get_core_hypixel_data,
+    get_core_hypixel_data_async,
     get_guild_data,
+    get_guild_data_async,
 )
 from utils import check_valid_uuid
 import exceptions
 from sqlalchemy import text
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import JSONB
+import asyncio
 import time
-from metrics_manager import get_engine
+from db import get_engine
 from typing import Tuple, Optional, List
-from minecraft_manager import bulk_get_usernames_cache, get_minecraft_data
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from db import SessionLocal
+from minecraft_manager import (
+    bulk_get_usernames_cache,
+    fetch_minecraft_data_many,
+    add_to_minecraft_cache,
+)
+from db import SessionLocal, AsyncSessionLocal
 from pydantic import BaseModel, Field
-from metrics_manager import add_value
-
-# in seconds
+from metric_writer import metric_writer
+from singleflight import flights, flight_key
+from background_refresh import schedule_refresh, schedule_refresh_async
+from negative_cache import negative_cache
+from cache import get_cache
+from image_store import ImageMode
+from tracing import traced
+from cache_tracking import record_cache, source_outcome, miss_outcome, MISS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# in seconds, rows younger than HYPIXEL_TTL are served as is, rows up to
+# HYPIXEL_HARD_TTL are served as stale_cache while they get refreshed in the background
 HYPIXEL_TTL = 180
+HYPIXEL_HARD_TTL = 1800
 
+# in-process copies of fresh rows, players map to (HypixelPlayer, guild_id)
+hypixel_memory_cache = get_cache("hypixel")
+hypixel_guild_memory_cache = get_cache("hypixel_guild", HypixelGuild)
 
+
+@traced()
 def get_hypixel_data(uuid, session: Session) -> HypixelFullData:
     if not check_valid_uuid(uuid):
         raise exceptions.InvalidUserUUID()
@@ -32,19 +56,26 @@ def get_hypixel_data(uuid, session: Session) -> HypixelFullData:
     guild_data = None
     guild_id = None
 
-    hypixel_cache_valid = check_hypixel_cache(uuid, session)
+    cache_source = check_hypixel_cache(uuid, session)
+    hypixel_cache_valid = cache_source is not None
     if hypixel_cache_valid:
         try:
-            player_data, guild_id = get_hypixel_cache(uuid, session)
+            player_data, guild_id = get_hypixel_cache(uuid, session, cache_source)
         except RuntimeError:
             print("Failed getting data from hypixel cache, getting live result")
 
     if player_data is None:
-        player_data = get_core_hypixel_data(uuid)
+        record_cache("hypixel", miss_outcome("hypixel", uuid))
+        player_data = flights.do(
+            flight_key("hypixel", uuid), fetch_hypixel_player, uuid
+        )
+    else:
+        record_cache("hypixel", source_outcome(player_data.source))
 
     if guild_id is not None:
         try:
             guild_data = get_hypixel_guild_cache(guild_id, session)
+            record_cache("hypixel_guild", source_outcome(guild_data.source))
         except exceptions.InvalidCache:
             guild_data = None
 
@@ -53,129 +84,412 @@ def get_hypixel_data(uuid, session: Session) -> HypixelFullData:
     ):  # handles if a cached player has no guild
         guild_data = None
     elif guild_data is None or guild_data == False:
+        record_cache("hypixel_guild", miss_outcome("hypixel_guild", uuid))
+        guild_data = flights.do(
+            flight_key("hypixel_guild", uuid), fetch_hypixel_player_guild, uuid
+        )
+
+    hypixel_data = HypixelFullData(player=player_data, guild=guild_data)
+    save_hypixel_data(uuid, hypixel_data, session)
+
+    if hypixel_data.player.source == "stale_cache":
+        schedule_refresh(flight_key("hypixel", uuid), refresh_hypixel_data, uuid)
+    elif hypixel_data.guild is not None and hypixel_data.guild.source == "stale_cache":
+        schedule_refresh(
+            flight_key("hypixel_guild", guild_id), refresh_hypixel_guild, guild_id
+        )
+
+    return hypixel_data
+
+
+@traced()
+async def get_hypixel_data_async(uuid, session: AsyncSession) -> HypixelFullData:
+    """
+    Async version of get_hypixel_data, player and guild are fetched concurrently
+    when neither is cached
+    """
+    if not check_valid_uuid(uuid):
+        raise exceptions.InvalidUserUUID()
+
+    player_data = None
+    guild_data = None
+    guild_id = None
+
+    cache_source = await check_hypixel_cache_async(uuid, session)
+    hypixel_cache_valid = cache_source is not None
+    if hypixel_cache_valid:
         try:
-            guild_data = get_guild_data(uuid)
-        except exceptions.NotFound:
+            player_data, guild_id = await get_hypixel_cache_async(
+                uuid, session, cache_source
+            )
+        except RuntimeError:
+            print("Failed getting data from hypixel cache, getting live result")
+
+    if player_data is not None:
+        record_cache("hypixel", source_outcome(player_data.source))
+
+    if guild_id is not None:
+        try:
+            guild_data = await get_hypixel_guild_cache_async(guild_id, session)
+            record_cache("hypixel_guild", source_outcome(guild_data.source))
+        except exceptions.InvalidCache:
             guild_data = None
 
+    def fetch_guild():
+        record_cache("hypixel_guild", miss_outcome("hypixel_guild", uuid))
+        return flights.do_async(
+            flight_key("hypixel_guild", uuid), fetch_hypixel_player_guild_async, uuid
+        )
+
+    def fetch_player():
+        record_cache("hypixel", miss_outcome("hypixel", uuid))
+        return flights.do_async(
+            flight_key("hypixel", uuid), fetch_hypixel_player_async, uuid
+        )
+
+    # a cached player without a guild doesn't need a guild lookup
+    needs_guild = guild_data is None and not (hypixel_cache_valid and guild_id is None)
+
+    if player_data is None and needs_guild:
+        player_data, guild_data = await asyncio.gather(fetch_player(), fetch_guild())
+    elif player_data is None:
+        player_data = await fetch_player()
+    elif needs_guild:
+        guild_data = await fetch_guild()
+
     hypixel_data = HypixelFullData(player=player_data, guild=guild_data)
-    # caching
-    if hypixel_data.player.source == "hypixel_api":
-        if hypixel_data.guild is not None:
-            add_to_hypixel_cache(
-                uuid, hypixel_data.player, hypixel_data.guild.id, session
-            )
-        else:
-            add_to_hypixel_cache(uuid, hypixel_data.player, None, session)
-    if hypixel_data.guild is not None:
-        if hypixel_data.guild.source == "hypixel_api" and hypixel_data.guild.id:
-            add_to_hypixel_guild_cache(
-                hypixel_data.guild.id, hypixel_data.guild, session
-            )
+    await save_hypixel_data_async(uuid, hypixel_data, session)
+
+    if hypixel_data.player.source == "stale_cache":
+        schedule_refresh_async(
+            flight_key("hypixel", uuid), refresh_hypixel_data_async, uuid
+        )
+    elif hypixel_data.guild is not None and hypixel_data.guild.source == "stale_cache":
+        schedule_refresh_async(
+            flight_key("hypixel_guild", guild_id), refresh_hypixel_guild_async, guild_id
+        )
 
     return hypixel_data
 
 
-def check_hypixel_cache(uuid, session: Session) -> bool:
-    current_time = time.time()
-    cache_time = session.execute(
-        text(
-            "SELECT extract(epoch from timestamp) as timestamp FROM hypixel_cache WHERE uuid = :uuid;"
+def refresh_hypixel_data(uuid) -> None:
+    """Fetches live player and guild data for a stale cache row and writes it back"""
+    player_data = flights.do(flight_key("hypixel", uuid), fetch_hypixel_player, uuid)
+    guild_data = flights.do(
+        flight_key("hypixel_guild", uuid), fetch_hypixel_player_guild, uuid
+    )
+
+    with SessionLocal() as session:
+        save_hypixel_data(
+            uuid, HypixelFullData(player=player_data, guild=guild_data), session
+        )
+
+
+async def refresh_hypixel_data_async(uuid) -> None:
+    player_data, guild_data = await asyncio.gather(
+        flights.do_async(flight_key("hypixel", uuid), fetch_hypixel_player_async, uuid),
+        flights.do_async(
+            flight_key("hypixel_guild", uuid), fetch_hypixel_player_guild_async, uuid
         ),
-        {"uuid": uuid},
-    ).fetchone()
+    )
+    async with AsyncSessionLocal() as session:
+        await save_hypixel_data_async(
+            uuid, HypixelFullData(player=player_data, guild=guild_data), session
+        )
+
+
+def refresh_hypixel_guild(id) -> None:
+    """Fetches a live guild for a stale guild cache row and writes it back"""
+    guild_data = flights.do(flight_key("hypixel_guild", id), get_guild_data, None, id)
+    with SessionLocal() as session:
+        add_to_hypixel_guild_cache(guild_data.id, guild_data, session)
+
+
+async def refresh_hypixel_guild_async(id) -> None:
+    guild_data = await flights.do_async(
+        flight_key("hypixel_guild", id), get_guild_data_async, None, id
+    )
+    async with AsyncSessionLocal() as session:
+        await add_to_hypixel_guild_cache_async(guild_data.id, guild_data, session)
+
+
+def fetch_hypixel_player(uuid) -> HypixelPlayer:
+    """Gets a live player, recently not found uuids are answered from the negative cache"""
+    if negative_cache.contains("hypixel", uuid):
+        raise exceptions.NotFound()
+    try:
+        return get_core_hypixel_data(uuid)
+    except exceptions.NotFound:
+        negative_cache.add("hypixel", uuid)
+        raise
+
+
+async def fetch_hypixel_player_async(uuid) -> HypixelPlayer:
+    if negative_cache.contains("hypixel", uuid):
+        raise exceptions.NotFound()
+    try:
+        return await get_core_hypixel_data_async(uuid)
+    except exceptions.NotFound:
+        negative_cache.add("hypixel", uuid)
+        raise
+
+
+def fetch_hypixel_player_guild(uuid) -> Optional[HypixelGuild]:
+    """Gets the live guild of a player, None if the player isn't in one"""
+    if negative_cache.contains("hypixel_guild", uuid):
+        return None
+    try:
+        return get_guild_data(uuid)
+    except exceptions.NotFound:
+        negative_cache.add("hypixel_guild", uuid)
+        return None
+
+
+async def fetch_hypixel_player_guild_async(uuid) -> Optional[HypixelGuild]:
+    if negative_cache.contains("hypixel_guild", uuid):
+        return None
+    try:
+        return await get_guild_data_async(uuid)
+    except exceptions.NotFound:
+        negative_cache.add("hypixel_guild", uuid)
+        return None
+
+
+def save_hypixel_data(uuid, hypixel_data: HypixelFullData, session: Session) -> None:
+    """Writes freshly fetched player and guild data to the cache"""
+    if hypixel_data.player.source == "hypixel_api":
+        _invalidate_negative(uuid, hypixel_data)
+        add_to_hypixel_cache(uuid, hypixel_data.player, _guild_id(hypixel_data), session)
+    if _is_live_guild(hypixel_data):
+        add_to_hypixel_guild_cache(hypixel_data.guild.id, hypixel_data.guild, session)
+
+
+async def save_hypixel_data_async(
+    uuid, hypixel_data: HypixelFullData, session: AsyncSession
+) -> None:
+    if hypixel_data.player.source == "hypixel_api":
+        _invalidate_negative(uuid, hypixel_data)
+        await add_to_hypixel_cache_async(
+            uuid, hypixel_data.player, _guild_id(hypixel_data), session
+        )
+    if _is_live_guild(hypixel_data):
+        await add_to_hypixel_guild_cache_async(
+            hypixel_data.guild.id, hypixel_data.guild, session
+        )
+
+
+def _invalidate_negative(uuid, hypixel_data: HypixelFullData) -> None:
+    negative_cache.invalidate("hypixel", uuid)
+    if hypixel_data.guild is not None:
+        negative_cache.invalidate("hypixel_guild", uuid)
+
+
+def _guild_id(hypixel_data: HypixelFullData) -> Optional[str]:
+    return hypixel_data.guild.id if hypixel_data.guild is not None else None
+
+
+def _is_live_guild(hypixel_data: HypixelFullData) -> bool:
+    return (
+        hypixel_data.guild is not None
+        and hypixel_data.guild.source == "hypixel_api"
+        and bool(hypixel_data.guild.id)
+    )
+
+
+# shared by the sync and async paths, typed so asyncpg decodes the JSONB columns
+CACHE_TIME_QUERY = text(
+    "SELECT extract(epoch from timestamp) as timestamp FROM hypixel_cache WHERE uuid = :uuid;"
+)
+CACHE_QUERY = text(
+    "SELECT data, guild_id, extract(epoch from timestamp) as timestamp FROM hypixel_cache WHERE uuid = :uuid;"
+).columns(data=JSONB)
+GUILD_CACHE_QUERY = text(
+    "SELECT data, extract(epoch from timestamp) as timestamp FROM hypixel_guild_cache WHERE id = :id"
+).columns(data=JSONB)
+UPSERT_QUERY = text(
+    """
+    INSERT INTO hypixel_cache (uuid, data, timestamp, guild_id) 
+    VALUES (:uuid, :data, NOW(), :guild_id)
+    ON CONFLICT (uuid)
+    DO UPDATE SET 
+        data = EXCLUDED.data,
+        timestamp = NOW(),
+        guild_id = EXCLUDED.guild_id
+    """
+)
+UPSERT_GUILD_QUERY = text(
+    """
+    INSERT INTO hypixel_guild_cache (id, data, timestamp) 
+    VALUES (:id, :data, NOW())
+    ON CONFLICT (id)
+    DO UPDATE SET 
+        data = EXCLUDED.data,
+        timestamp = NOW()
+    """
+)
+
+
+def check_hypixel_cache(uuid, session: Session) -> Optional[str]:
+    """
+    Returns "cache" if the cached row is fresh, "stale_cache" if it can still be served
+    while it gets refreshed, None if there is no usable row
+    """
+    if hypixel_memory_cache.get(uuid) is not None:
+        return "cache"
+
+    cache_time = session.execute(CACHE_TIME_QUERY, {"uuid": uuid}).fetchone()
+    return _cache_source(cache_time)
+
+
+async def check_hypixel_cache_async(uuid, session: AsyncSession) -> Optional[str]:
+    if hypixel_memory_cache.get(uuid) is not None:
+        return "cache"
+
+    cache_time = (await session.execute(CACHE_TIME_QUERY, {"uuid": uuid})).fetchone()
+    return _cache_source(cache_time)
+
+
+def _cache_source(cache_time) -> Optional[str]:
     if cache_time is None:
-        return False
+        return None
 
-    epoch_cache_time = int(cache_time.timestamp)
-    if current_time - epoch_cache_time < HYPIXEL_TTL:
-        return True
+    cache_age = time.time() - int(cache_time.timestamp)
+    if cache_age < HYPIXEL_TTL:
+        return "cache"
+    elif cache_age < HYPIXEL_HARD_TTL:
+        return "stale_cache"
     else:
-        return False
+        return None
+
 
+def get_hypixel_cache(
+    uuid, session: Session, source: str = "cache"
+) -> Tuple[HypixelPlayer, Optional[str]]:
+    if source == "cache":
+        memory_data = hypixel_memory_cache.get(uuid)
+        if memory_data is not None:
+            return memory_data
 
-def get_hypixel_cache(uuid, session: Session) -> Tuple[HypixelPlayer, Optional[str]]:
-    cache_data = session.execute(
-        text("SELECT data, guild_id FROM hypixel_cache WHERE uuid = :uuid;"),
-        {"uuid": uuid},
-    ).fetchone()
+    cache_data = session.execute(CACHE_QUERY, {"uuid": uuid}).fetchone()
+    return _parse_cache_row(uuid, cache_data, source)
 
+
+async def get_hypixel_cache_async(
+    uuid, session: AsyncSession, source: str = "cache"
+) -> Tuple[HypixelPlayer, Optional[str]]:
+    if source == "cache":
+        memory_data = hypixel_memory_cache.get(uuid)
+        if memory_data is not None:
+            return memory_data
+
+    cache_data = (await session.execute(CACHE_QUERY, {"uuid": uuid})).fetchone()
+    return _parse_cache_row(uuid, cache_data, source)
+
+
+def _parse_cache_row(uuid, cache_data, source: str) -> Tuple[HypixelPlayer, Optional[str]]:
     try:
-        hypixel_player = HypixelPlayer(source="cache", **cache_data.data)
+        hypixel_player = HypixelPlayer(source=source, **cache_data.data)
         guild_id: str = cache_data.guild_id
+        if source == "cache":
+            cache_age = time.time() - int(cache_data.timestamp)
+            hypixel_memory_cache.set(
+                uuid, (hypixel_player, guild_id), HYPIXEL_TTL - cache_age
+            )
         return hypixel_player, guild_id
     except Exception:
         raise RuntimeError()
 
 
 def get_hypixel_guild_cache(id, session: Session) -> HypixelGuild:
-    cache_data = session.execute(
-        text(
-            "SELECT data, extract(epoch from timestamp) as timestamp FROM hypixel_guild_cache WHERE id = :id"
-        ),
-        {"id": id},
-    ).fetchone()
+    memory_data = hypixel_guild_memory_cache.get(id)
+    if memory_data is not None:
+        return memory_data
+
+    cache_data = session.execute(GUILD_CACHE_QUERY, {"id": id}).fetchone()
+    return _parse_guild_cache_row(id, cache_data)
 
-    if cache_data.data is None:
+
+async def get_hypixel_guild_cache_async(id, session: AsyncSession) -> HypixelGuild:
+    memory_data = hypixel_guild_memory_cache.get(id)
+    if memory_data is not None:
+        return memory_data
+
+    cache_data = (await session.execute(GUILD_CACHE_QUERY, {"id": id})).fetchone()
+    return _parse_guild_cache_row(id, cache_data)
+
+
+def _parse_guild_cache_row(id, cache_data) -> HypixelGuild:
+    if cache_data is None or cache_data.data is None:
         print(f"no cache data found for guild {id}")
         raise exceptions.InvalidCache()
 
-    epoch_cache_time = int(cache_data.timestamp)
-    current_time = time.time()
-    if current_time - epoch_cache_time < HYPIXEL_TTL:
+    cache_age = time.time() - int(cache_data.timestamp)
+    if cache_age < HYPIXEL_HARD_TTL:
+        source = "cache" if cache_age < HYPIXEL_TTL else "stale_cache"
         try:
-            return HypixelGuild(source="cache", **cache_data.data)
+            guild_data = HypixelGuild(source=source, **cache_data.data)
+            if source == "cache":
+                hypixel_guild_memory_cache.set(id, guild_data, HYPIXEL_TTL - cache_age)
+            return guild_data
         except Exception as e:
             print(f"Coudn't validate HypixelGuild from cache: {e}")
 
     raise exceptions.InvalidCache()
 
 
+def _upsert_params(uuid: str, data: HypixelPlayer, guild_id: str) -> dict:
+    return {
+        "uuid": uuid,
+        "data": data.model_dump_json(exclude={"source"}),
+        "guild_id": guild_id,
+    }
+
+
 def add_to_hypixel_cache(
     uuid: str, data: HypixelPlayer, guild_id: str, session: Session
 ) -> None:
-    session.execute(
-        text(
-            """
-            INSERT INTO hypixel_cache (uuid, data, timestamp, guild_id) 
-            VALUES (:uuid, :data, NOW(), :guild_id)
-            ON CONFLICT (uuid)
-            DO UPDATE SET 
-                data = EXCLUDED.data,
-                timestamp = NOW(),
-                guild_id = EXCLUDED.guild_id
-            """
-        ),
-        {
-            "uuid": uuid,
-            "data": data.model_dump_json(exclude={"source"}),
-            "guild_id": guild_id,
-        },
-    )
+    session.execute(UPSERT_QUERY, _upsert_params(uuid, data, guild_id))
     session.commit()
+    # write through
+    hypixel_memory_cache.set(
+        uuid, (data.model_copy(update={"source": "cache"}), guild_id)
+    )
+
+
+async def add_to_hypixel_cache_async(
+    uuid: str, data: HypixelPlayer, guild_id: str, session: AsyncSession
+) -> None:
+    await session.execute(UPSERT_QUERY, _upsert_params(uuid, data, guild_id))
+    await session.commit()
+    hypixel_memory_cache.set(
+        uuid, (data.model_copy(update={"source": "cache"}), guild_id)
+    )
 
 
 def add_to_hypixel_guild_cache(id: str, data: HypixelGuild, session: Session) -> None:
     session.execute(
-        text(
-            """
-            INSERT INTO hypixel_guild_cache (id, data, timestamp) 
-            VALUES (:id, :data, NOW())
-            ON CONFLICT (id)
-            DO UPDATE SET 
-                data = EXCLUDED.data,
-                timestamp = NOW()
-            """
-        ),
-        {"id": id, "data": data.model_dump_json(exclude={"source"})},
+        UPSERT_GUILD_QUERY, {"id": id, "data": data.model_dump_json(exclude={"source"})}
     )
     session.commit()
+    hypixel_guild_memory_cache.set(id, data.model_copy(update={"source": "cache"}))
+
+
+async def add_to_hypixel_guild_cache_async(
+    id: str, data: HypixelGuild, session: AsyncSession
+) -> None:
+    await session.execute(
+        UPSERT_GUILD_QUERY, {"id": id, "data": data.model_dump_json(exclude={"source"})}
+    )
+    await session.commit()
+    hypixel_guild_memory_cache.set(id, data.model_copy(update={"source": "cache"}))
 
 # params for fastapi
 class HypixelGuildMemberParams(BaseModel):
     limit: int = Field(20, gt=0, le=50)
     offset: int = Field(0, ge=0)
+    images: ImageMode = "base64"
 
+@traced()
 def get_full_guild_members(
     id: str, session: Session, amount_to_load: int, offset: int = 0
 ) -> List[HypixelGuildMemberFull]:
@@ -184,67 +498,58 @@ def get_full_guild_members(
         guild_data = get_hypixel_guild_cache(
             id, session
         )  # TODO investigate why this isnt getting activated consistently
-        print("source: cache")
+        print(f"source: {guild_data.source}")
+        record_cache("hypixel_guild", source_outcome(guild_data.source))
+        if guild_data.source == "stale_cache":
+            schedule_refresh(flight_key("hypixel_guild", id), refresh_hypixel_guild, id)
     except exceptions.InvalidCache:
         print("source: hypixel api")
-        guild_data = get_guild_data(id=id)
+        record_cache("hypixel_guild", MISS)
+        guild_data = flights.do(
+            flight_key("hypixel_guild", id), get_guild_data, None, id
+        )
     if guild_data is None:
         raise exceptions.ServiceError()
 
-    resolved_uuids, unsolved_uuids = bulk_get_usernames_cache(
-        [member.uuid for member in guild_data.members], session
+    # only the requested page is looked up, so large guilds cost as much as small ones
+    page = guild_data.members[offset : offset + amount_to_load]
+    resolved, unsolved_uuids = bulk_get_usernames_cache(
+        [member.uuid for member in page], session
     )
-    print(f"found {len(resolved_uuids)} in cache, {len(unsolved_uuids)} left")
-
-    print(
-        f"fetching {len(guild_data.members[offset:offset + amount_to_load])} members out of {len(guild_data.members)}"
+    logger.debug(
+        f"fetching {len(page)} members out of {len(guild_data.members)}, "
+        f"found {len(resolved)} in cache, {len(unsolved_uuids)} left"
     )
 
-    final_members = []
+    # uncached members are fetched together so their faces render in one batch
+    fetched = fetch_minecraft_data_many(unsolved_uuids)
+    with SessionLocal() as write_session:
+        for data in fetched.values():
+            add_to_minecraft_cache(data.uuid, data, write_session)
 
-    with ThreadPoolExecutor(
-        max_workers=4
-    ) as executor:
-        futures = []
-        for member in guild_data.members[offset : offset + amount_to_load]:
-            futures.append(
-                executor.submit(
-                    get_member, member, unsolved_uuids, resolved_uuids
+    final_members = []
+    for member in page:
+        if member.uuid in fetched:
+            data = fetched[member.uuid]
+            final_members.append(
+                HypixelGuildMemberFull(
+                    username=data.username,
+                    uuid=data.uuid,
+                    skin_showcase_b64=data.skin_showcase_b64,
+                    rank=member.rank,
+                    joined=member.joined,
+                )
+            )
+        elif member.uuid in resolved:
+            final_members.append(
+                HypixelGuildMemberFull(
+                    rank=member.rank, joined=member.joined, **resolved[member.uuid]
                 )
             )
-
-        for future in as_completed(futures):
-            data = future.result()
-            if isinstance(data, HypixelGuildMemberFull):
-                final_members.append(data)
 
     return final_members
 
 
-def get_member(
-    member: HypixelGuildMember,
-    unsolved_uuids: list,
-    resolved_uuids: list,
-):
-    if member.uuid in unsolved_uuids:
-        with SessionLocal() as thread_session:
-            data = get_minecraft_data(
-                member.uuid, thread_session
-            )  # this fetches live data
-            return HypixelGuildMemberFull(
-                username=data.username,
-                uuid=data.uuid,
-                skin_showcase_b64=data.skin_showcase_b64,
-                rank=member.rank,
-                joined=member.joined,
-            )
-    else:
-        for resolved_member in resolved_uuids:
-            if resolved_member.get("uuid") == member.uuid:
-                return HypixelGuildMemberFull(
-                    rank=member.rank, joined=member.joined, **resolved_member
-                )
-
 def add_hypixel_stats_to_db(hypixel_data: HypixelFullData):
     if not isinstance(hypixel_data, HypixelFullData):
         print("Invalid data type passed to add_hypixel_stats_to_db")
@@ -256,11 +561,7 @@ def add_hypixel_stats_to_db(hypixel_data: HypixelFullData):
         23: hypixel_data.player.achievement_points,
     }
 
-    engine = get_engine()
-    with engine.begin() as conn:
-        for stat in stats_to_add:
-            if stats_to_add.get(stat, None) is not None:
-                add_value(conn, hypixel_data.player.uuid, stat, stats_to_add[stat])
+    metric_writer.add_many(hypixel_data.player.uuid, stats_to_add)
 
 if __name__ == "__main__":
     db_engine = get_engine()
@@ -0,0 +1,80 @@
+import base64
+import hashlib
+from typing import Literal, Optional
+from pydantic import BaseModel
+from cache import get_cache
+
+# how images are returned in JSON, url mode keeps base64 out of the response
+ImageMode = Literal["base64", "url"]
+
+IMAGE_URL = "/v1/images/{}.png"
+# image urls are content addressed, so their bytes can be cached forever
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# base64 PNGs keyed by the sha256 of their bytes
+image_store = get_cache("images", str)
+
+
+def image_hash(png: bytes) -> str:
+    return hashlib.sha256(png).hexdigest()
+
+
+def image_etag(digest: str) -> str:
+    return f'"{digest}"'
+
+
+def store_image(b64: Optional[str]) -> Optional[str]:
+    """Stores a base64 PNG under its content hash and returns its url path"""
+    if b64 is None:
+        return None
+    digest = image_hash(base64.b64decode(b64))
+    if image_store.memory.get(digest) is None:
+        image_store.set(digest, b64)
+    return IMAGE_URL.format(digest)
+
+
+async def store_image_async(b64: Optional[str]) -> Optional[str]:
+    if b64 is None:
+        return None
+    digest = image_hash(base64.b64decode(b64))
+    if image_store.memory.get(digest) is None:
+        await image_store.set_async(digest, b64)
+    return IMAGE_URL.format(digest)
+
+
+async def get_image_async(digest: str) -> Optional[bytes]:
+    b64 = await image_store.get_async(digest)
+    return base64.b64decode(b64) if b64 is not None else None
+
+
+def absolute_url(base_url: str, path: Optional[str]) -> Optional[str]:
+    """
+    Prefixes an image path with the API's base url (request.base_url), the
+    frontend runs on another origin so relative urls would resolve against it
+    """
+    if path is None:
+        return None
+    return base_url.rstrip("/") + path
+
+
+def with_image_urls(model: BaseModel, fields: dict, base_url: str) -> BaseModel:
+    """
+    Copy of model with each base64 field moved to its url field,
+    fields maps base64 field names to url field names
+    """
+    update = {}
+    for b64_field, url_field in fields.items():
+        update[url_field] = absolute_url(base_url, store_image(getattr(model, b64_field)))
+        update[b64_field] = None
+    return model.model_copy(update=update)
+
+
+async def with_image_urls_async(
+    model: BaseModel, fields: dict, base_url: str
+) -> BaseModel:
+    update = {}
+    for b64_field, url_field in fields.items():
+        path = await store_image_async(getattr(model, b64_field))
+        update[url_field] = absolute_url(base_url, path)
+        update[b64_field] = None
+    return model.model_copy(update=update)
@@ -0,0 +1,134 @@
+import math
+import threading
+import time
+from typing import Dict, List, Tuple
+from quantile_sketch import DDSketch
+
+QUANTILES = (0.5, 0.9, 0.99)
+WINDOW = 60  # seconds, quantiles cover between one and two windows of observations
+
+
+class LatencySummary:
+    """
+    Latency distribution of one label set
+
+    Count and sum are kept since startup like a Prometheus summary. Quantiles come
+    from two rotating sketches so they follow the last minute or two instead of the
+    whole uptime.
+    """
+
+    def __init__(self, window: float = WINDOW):
+        self.window = window
+        self.count = 0
+        self.sum = 0.0
+        self._current = DDSketch()
+        self._previous = DDSketch()
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rotate(self, now: float) -> None:
+        elapsed = now - self._rotated_at
+        if elapsed < self.window:
+            return
+        # after two idle windows the previous sketch is stale as well
+        self._previous = self._current if elapsed < 2 * self.window else DDSketch()
+        self._current = DDSketch()
+        self._rotated_at = now
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._rotate(time.monotonic())
+            self.count += 1
+            self.sum += seconds
+            self._current.add(max(seconds, 0.0))
+
+    def snapshot(self) -> Tuple[int, float, Dict[float, float]]:
+        with self._lock:
+            self._rotate(time.monotonic())
+            recent = DDSketch()
+            recent.merge(self._previous)
+            recent.merge(self._current)
+            quantiles = {q: recent.quantile(q) for q in QUANTILES}
+            return self.count, self.sum, quantiles
+
+
+class LatencyMetric:
+    """A summary metric with one LatencySummary per label combination"""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series: Dict[Tuple[str, ...], LatencySummary] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, **labels) -> None:
+        key = tuple(str(labels[label]) for label in self.labels)
+        series = self.series.get(key)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(key, LatencySummary())
+        series.observe(seconds)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} summary"]
+        with self._lock:
+            all_series = sorted(self.series.items())
+        for key, series in all_series:
+            count, total, quantiles = series.snapshot()
+            labels = dict(zip(self.labels, key))
+            for q, value in quantiles.items():
+                if value is not None:
+                    lines.append(
+                        f"{self.name}{_labels({**labels, 'quantile': q})} {_number(value)}"
+                    )
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return lines
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_stats(
+    name: str, description: str, values: dict, labels: Tuple[str, ...] = ("kind",)
+) -> List[str]:
+    """Renders a stats() dict kept elsewhere, keys are label values (tuples for several)"""
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    for key, value in values.items():
+        key = key if isinstance(key, tuple) else (key,)
+        lines.append(f"{name}{_labels(dict(zip(labels, key)))} {_number(value)}")
+    return lines
+
+
+request_latency = LatencyMetric(
+    "aspexis_http_request_duration_seconds",
+    "Time spent answering API requests",
+    ("route", "method", "status"),
+)
+upstream_latency = LatencyMetric(
+    "aspexis_upstream_request_duration_seconds",
+    "Time until upstream providers sent response headers",
+    ("provider", "status"),
+)
+
+
+def render_metrics(*extra: List[str]) -> str:
+    """Prometheus text format for every latency metric, plus already rendered extras"""
+    lines = request_latency.render() + upstream_latency.render()
+    for block in extra:
+        lines += block
+    return "\n".join(lines) + "\n"
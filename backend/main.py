@@ -1,7 +1,8 @@
 from fastapi import FastAPI, BackgroundTasks, Request, Depends, Query
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
+from contextlib import asynccontextmanager
 from wynncraft_api import (
     GetWynncraftData,
     PlayerSummary,
@@ -11,37 +12,86 @@ from wynncraft_api import (
 from online_status import get_online_status
 from dotenv import load_dotenv
 from wynn_data_manager import WynnDataManager
-from minecraft_api import MojangData
-from donut_api import get_donut_stats, DonutPlayerStats, add_donut_stats_to_db
-from mcci_api import MCCIPlayer, get_mcci_data
+from minecraft_api import MojangData, MOJANG_IMAGE_FIELDS
+from donut_api import get_donut_stats_async, DonutPlayerStats, add_donut_stats_to_db
+from mcci_api import MCCIPlayer, get_mcci_data_async
 import os
-from metrics_manager import get_stats, HistogramData
-from db import get_db
+from metrics_manager import get_stats_async, HistogramData, init_metrics_manager
+from db import get_db, get_async_db, close_async_engines, get_pool_stats
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import exceptions
 from player_tracker import subscribe, unsubscribe
 import asyncio
 from sqlalchemy.orm import Session
 from hypixel_manager import (
-    get_hypixel_data,
+    get_hypixel_data_async,
     HypixelFullData,
     HypixelGuildMemberFull,
     get_full_guild_members,
     HypixelGuildMemberParams,
     add_hypixel_stats_to_db,
 )
-from minecraft_manager import get_minecraft_data
+from minecraft_manager import get_minecraft_data_async, init_minecraft_cache
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Annotated
 import time
-from telemetry_manager import add_telemetry_event
-from capes import get_capes_for_user, UserCapeData
+from telemetry_manager import add_telemetry_event, telemetry_exporter
+from capes import get_capes_for_user_async, UserCapeData, CAPE_IMAGE_FIELDS
+from texture_cache import close_render_pool
+from guild_atlas import GuildAtlas, get_guild_atlas
+from warmup import warmup, stop_refreshing
+from image_store import (
+    ImageMode,
+    IMAGE_CACHE_CONTROL,
+    absolute_url,
+    image_etag,
+    get_image_async,
+    with_image_urls,
+    with_image_urls_async,
+)
+from http_client import close_clients
+from cache import close_caches, init_cache_tables
+from metric_writer import metric_writer
+from rate_limiter import get_limiter_stats
+from singleflight import flights
+from negative_cache import negative_cache
+from memory_cache import get_cache_stats
+from cache_tracking import start_request, end_request, summarize, get_outcome_stats
+from tracing import start_trace, end_trace, current_span
+from latency_metrics import request_latency, render_metrics, render_stats
 
 
 load_dotenv()
 
 hypixel_api_key = os.getenv("hypixel_api_key")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # username lookups need the username_lower column and the postgres cache
+    # namespaces their table, so startup fails without them
+    await run_in_threadpool(init_minecraft_cache)
+    await run_in_threadpool(init_cache_tables)
+    try:
+        await run_in_threadpool(init_metrics_manager)
+    except Exception as e:
+        print(f"Couldn't run init_metrics_manager: {e}")
+    # reference data is loaded before the first request is accepted
+    await warmup()
+    yield
+    stop_refreshing()
+    # queued metric values are written before the database pools close
+    await run_in_threadpool(metric_writer.close)
+    await run_in_threadpool(telemetry_exporter.close)
+    await run_in_threadpool(close_render_pool)
+    # shared upstream connection pools live for the whole app lifetime
+    await close_clients()
+    await close_caches()
+    await close_async_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -56,27 +106,45 @@ app.add_middleware(
 
 @app.middleware("http")
 async def telemetry_middleware(request: Request, call_next):
-    if request.url.path == "/healthz":
+    if request.url.path in ("/healthz", "/metrics"):
         # Just process the request and return, DON'T touch the DB
         return await call_next(request)
     start = time.time()
     status_code = 500
+    # managers append their cache outcomes to this request's list
+    cache_token = start_request()
+    trace_token = start_trace(f"{request.method} {request.url.path}")
     try:
         response = await call_next(request)
         status_code = response.status_code
+        response.headers["Server-Timing"] = current_span().trace.server_timing()
         return response
     except Exception:
         # Call_next didn't complete — still record telemetry
         raise
     finally:
-        latency_ms = int((time.time() - start) * 1000)
-        asyncio.create_task(
-            add_telemetry_event(
-                request.url.path,
-                request.url.path.split("/")[-1],
-                latency_ms,
-                status_code,
-            )
+        elapsed = time.time() - start
+        # the route template keeps the label count bounded, unknown paths share one label
+        route = request.scope.get("route")
+        request_latency.observe(
+            elapsed,
+            route=route.path if route is not None else "unmatched",
+            method=request.method,
+            status=status_code,
+        )
+        latency_ms = int(elapsed * 1000)
+        cache_hit, cache_summary = summarize(end_request(cache_token))
+        trace = end_trace(trace_token)
+        properties = {"trace_id": trace.trace_id}
+        if cache_summary:
+            properties["cache"] = cache_summary
+        add_telemetry_event(
+            request.url.path,
+            request.url.path.split("/")[-1],
+            latency_ms,
+            status_code,
+            cache_hit,
+            properties,
         )
 
 
@@ -91,11 +159,90 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_prometheus_metrics():
+    return render_metrics(
+        render_stats(
+            "aspexis_telemetry_exporter",
+            "Telemetry exporter buffer and event counts",
+            telemetry_exporter.stats(),
+        ),
+        render_stats(
+            "aspexis_cache_lookups",
+            "Cache lookups by namespace and outcome",
+            get_outcome_stats(),
+            labels=("namespace", "outcome"),
+        ),
+        render_stats(
+            "aspexis_memory_cache",
+            "In-process LRU tier size, hits, misses and evictions",
+            # the negative cache's LRU is rendered on its own below
+            _by_kind(
+                {
+                    name: stats
+                    for name, stats in get_cache_stats().items()
+                    if name != "negative"
+                }
+            ),
+            labels=("cache", "kind"),
+        ),
+        render_stats(
+            "aspexis_negative_cache",
+            "Remembered not found answers and lookups against them",
+            negative_cache.stats(),
+        ),
+        render_stats(
+            "aspexis_metric_writer",
+            "Metric writer queue and value counts",
+            metric_writer.stats(),
+        ),
+        render_stats(
+            "aspexis_db_pool",
+            "Database pool usage and connection checkout waits",
+            _by_kind(get_pool_stats()),
+            labels=("pool", "kind"),
+        ),
+        render_stats(
+            "aspexis_rate_limiter",
+            "Client side rate limiter tokens, paced and rejected upstream requests",
+            _by_kind(get_limiter_stats()),
+            labels=("provider", "kind"),
+        ),
+        render_stats(
+            "aspexis_single_flight",
+            "Upstream fetches by provider, leaders fetched and coalesced calls waited",
+            _by_kind(
+                {
+                    provider: {
+                        "leaders": counts["calls"] - counts["coalesced"],
+                        "coalesced": counts["coalesced"],
+                    }
+                    for provider, counts in flights.stats().items()
+                }
+            ),
+            labels=("provider", "kind"),
+        ),
+    )
+
+
+def _by_kind(stats: dict) -> dict:
+    """Flattens {name: {kind: value}} stats into render_stats keys"""
+    return {
+        (name, kind): value
+        for name, counts in stats.items()
+        for kind, value in counts.items()
+    }
+
+
 @app.get(
     "/v1/players/mojang/{username}",
     responses={
         400: {"model": exceptions.ErrorResponse, "description": "Bad Request"},
         404: {"model": exceptions.ErrorResponse, "description": "Not Found"},
+        429: {
+            "model": exceptions.ErrorResponse,
+            "description": "Upstream Rate Limit Reached",
+        },
         500: {
             "model": exceptions.ErrorResponse,
             "description": "Internal Server Error",
@@ -107,18 +254,67 @@ def health_check():
         },
     },
 )
-def get_profile(username, session: Session = Depends(get_db)) -> MojangData:
-    return get_minecraft_data(username, session)
+async def get_profile(
+    username,
+    request: Request,
+    images: ImageMode = "base64",
+    session: AsyncSession = Depends(get_async_db),
+) -> MojangData:
+    data = await get_minecraft_data_async(username, session)
+    if images == "url":
+        data = await with_image_urls_async(
+            data, MOJANG_IMAGE_FIELDS, str(request.base_url)
+        )
+    return data
 
 @app.get("/v1/players/capes/{uuid}")
-def get_capes(uuid: str) -> List[UserCapeData]:
-    return get_capes_for_user(uuid)
+async def get_capes(
+    uuid: str, request: Request, images: ImageMode = "base64"
+) -> List[UserCapeData]:
+    capes = await get_capes_for_user_async(uuid)
+    if images == "url":
+        capes = [
+            cape.model_copy(
+                update={
+                    "images": await with_image_urls_async(
+                        cape.images, CAPE_IMAGE_FIELDS, str(request.base_url)
+                    )
+                }
+            )
+            for cape in capes
+        ]
+    return capes
+
+
+@app.get(
+    "/v1/images/{image_hash}.png",
+    response_class=Response,
+    responses={
+        200: {"content": {"image/png": {}}},
+        304: {"description": "Not Modified"},
+        404: {"model": exceptions.ErrorResponse, "description": "Not Found"},
+    },
+)
+async def get_image(image_hash: str, request: Request):
+    headers = {"ETag": image_etag(image_hash), "Cache-Control": IMAGE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    png = await get_image_async(image_hash)
+    if png is None:
+        raise exceptions.NotFound()
+    return Response(png, media_type="image/png", headers=headers)
 
 @app.get(
     "/v1/players/hypixel/{uuid}",
     responses={
         400: {"model": exceptions.ErrorResponse, "description": "Bad Request"},
         404: {"model": exceptions.ErrorResponse, "description": "Not Found"},
+        429: {
+            "model": exceptions.ErrorResponse,
+            "description": "Upstream Rate Limit Reached",
+        },
         500: {
             "model": exceptions.ErrorResponse,
             "description": "Internal Server Error",
@@ -130,10 +326,10 @@ def get_capes(uuid: str) -> List[UserCapeData]:
         },
     },
 )
-def get_hypixel(
-    uuid, background_tasks: BackgroundTasks, session: Session = Depends(get_db)
+async def get_hypixel(
+    uuid, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_async_db)
 ) -> HypixelFullData:
-    data = get_hypixel_data(uuid, session)
+    data = await get_hypixel_data_async(uuid, session)
     background_tasks.add_task(add_hypixel_stats_to_db, data)
     return data
 
@@ -141,10 +337,41 @@ def get_hypixel(
 @app.get("/v1/hypixel/guilds/{id}")
 def get_guild(
     id,
+    request: Request,
     query_params: Annotated[HypixelGuildMemberParams, Query()],
     session: Session = Depends(get_db),
 ) -> List[HypixelGuildMemberFull]:
-    return get_full_guild_members(id, session, query_params.limit, query_params.offset)
+    members = get_full_guild_members(
+        id, session, query_params.limit, query_params.offset
+    )
+    if query_params.images == "url":
+        members = [
+            with_image_urls(
+                member,
+                {"skin_showcase_b64": "skin_showcase_url"},
+                str(request.base_url),
+            )
+            for member in members
+        ]
+    return members
+
+
+@app.get("/v1/hypixel/guilds/{id}/atlas")
+def get_guild_atlas_index(
+    id,
+    request: Request,
+    query_params: Annotated[HypixelGuildMemberParams, Query()],
+    session: Session = Depends(get_db),
+) -> GuildAtlas:
+    """Faces of a guild page packed into one PNG, with each member's offset in it"""
+    members = get_full_guild_members(
+        id, session, query_params.limit, query_params.offset
+    )
+    atlas = get_guild_atlas(id, members, query_params.offset, query_params.limit)
+    # cached atlases hold the url path, the host is the one this request came in on
+    return atlas.model_copy(
+        update={"image_url": absolute_url(str(request.base_url), atlas.image_url)}
+    )
 
 
 @app.get("/v1/players/status/{uuid}")
@@ -159,17 +386,17 @@ async def get_status(uuid):
     "/v1/players/wynncraft/{uuid}",
     responses={404: {"model": exceptions.ErrorResponse, "description": "Not found"}},
 )
-def get_wynncraft(uuid: str, background_tasks: BackgroundTasks) -> PlayerSummary:
+async def get_wynncraft(uuid: str, background_tasks: BackgroundTasks) -> PlayerSummary:
     data_instance = GetWynncraftData()
-    player_data = data_instance.get_player_data(uuid)
+    player_data = await data_instance.get_player_data_async(uuid)
     background_tasks.add_task(add_wynncraft_stats_to_db, player_data)
     return player_data
 
 
 @app.get("/v1/wynncraft/guilds/{prefix}")
-def get_wynncraft_guild(prefix) -> GuildInfo:
+async def get_wynncraft_guild(prefix) -> GuildInfo:
     data_instance = GetWynncraftData()
-    return data_instance.get_guild_data(prefix)
+    return await data_instance.get_guild_data_async(prefix)
 
 
 @app.get("/v1/wynncraft/guild-list")
@@ -181,24 +408,24 @@ def get_wynncraft_guild_list():
 
 # donutsmp endpoint
 @app.get("/v1/players/donutsmp/{username}")
-def get_donut(
+async def get_donut(
     username, background_tasks: BackgroundTasks, session: Session = Depends(get_db)
 ) -> DonutPlayerStats:
-    player_data = get_donut_stats(username)
+    player_data = await get_donut_stats_async(username)
     background_tasks.add_task(add_donut_stats_to_db, player_data, username, session)
     return player_data
 
 
 # mcci endpoint
 @app.get("/v1/players/mccisland/{uuid}")
-def get_mcc_island(uuid) -> MCCIPlayer:
-    return get_mcci_data(uuid)
+async def get_mcc_island(uuid) -> MCCIPlayer:
+    return await get_mcci_data_async(uuid)
 
 
 # metrics
 @app.get("/v1/metrics/{metric_key}/distribution/{player_uuid}")
-def get_metric(metric_key: str, player_uuid: str) -> HistogramData:
-    return get_stats(metric_key, player_uuid)
+async def get_metric(metric_key: str, player_uuid: str) -> HistogramData:
+    return await get_stats_async(metric_key, player_uuid)
 
 
 # player tracker
@@ -1,5 +1,11 @@
 import requests
+import httpx
 from utils import dashify_uuid
+from http_client import get_async_client, get_sync_session
+from rate_limiter import limiters
+from negative_cache import negative_cache
+from cache_tracking import record_cache, NEGATIVE
+from cache import get_cache
 from dotenv import load_dotenv
 import os
 from fastapi import HTTPException
@@ -110,13 +116,26 @@ def get_rank(ranks: list) -> str:
         except KeyError:
             return ranks[0]
 
+player_cache = get_cache("mcci_player", MCCIPlayer)
+
 def get_mcci_data(uuid):
+    cache_key = uuid.replace("-", "").lower()
+    if negative_cache.contains("mcci", cache_key):
+        record_cache(player_cache.name, NEGATIVE)
+        raise HTTPException(404, {"message": "player was not found"})
+
+    player_data = player_cache.get(cache_key)
+    if player_data is not None:
+        return player_data
+
     variables = {
     "uuid": dashify_uuid(uuid)
     }
 
+    limiters["mcci"].acquire()
     try:
-        mcci_response_raw = requests.post("https://api.mccisland.net/graphql", json={"query": query, "variables": variables}, headers={"X-API-Key": mcci_api_key})
+        mcci_response_raw = get_sync_session().post("https://api.mccisland.net/graphql", json={"query": query, "variables": variables}, headers={"X-API-Key": mcci_api_key})
+        limiters["mcci"].update(mcci_response_raw)
         mcci_response_raw.raise_for_status()
         mcci_response: dict = mcci_response_raw.json()
 
@@ -127,7 +146,55 @@ def get_mcci_data(uuid):
     except Exception as e:
         print(f"unknown error for mcci api: {e}")
         raise HTTPException(500, {"message": "something went wrong while proccessing MCC Island api data"})
-    
+
+    if mcci_response.get('data') == {}:
+        negative_cache.add("mcci", cache_key)
+
+    player_data = parse_mcci_response(mcci_response)
+    negative_cache.invalidate("mcci", cache_key)
+    player_cache.set(cache_key, player_data)
+    return player_data
+
+async def get_mcci_data_async(uuid):
+    """Async version of get_mcci_data using the shared client"""
+    cache_key = uuid.replace("-", "").lower()
+    if negative_cache.contains("mcci", cache_key):
+        record_cache(player_cache.name, NEGATIVE)
+        raise HTTPException(404, {"message": "player was not found"})
+
+    player_data = await player_cache.get_async(cache_key)
+    if player_data is not None:
+        return player_data
+
+    variables = {
+    "uuid": dashify_uuid(uuid)
+    }
+
+    await limiters["mcci"].acquire_async()
+    try:
+        mcci_response_raw = await get_async_client().post("https://api.mccisland.net/graphql", json={"query": query, "variables": variables}, headers={"X-API-Key": mcci_api_key})
+        limiters["mcci"].update(mcci_response_raw)
+        mcci_response_raw.raise_for_status()
+        mcci_response: dict = mcci_response_raw.json()
+
+    except httpx.HTTPStatusError as e:
+        print(f"http exception for mcci api: {e}")
+        raise HTTPException(502, {"message": "recieved HTTP error from MCC Island api"})
+
+    except Exception as e:
+        print(f"unknown error for mcci api: {e}")
+        raise HTTPException(500, {"message": "something went wrong while proccessing MCC Island api data"})
+
+    if mcci_response.get('data') == {}:
+        negative_cache.add("mcci", cache_key)
+
+    player_data = parse_mcci_response(mcci_response)
+    negative_cache.invalidate("mcci", cache_key)
+    await player_cache.set_async(cache_key, player_data)
+    return player_data
+
+def parse_mcci_response(mcci_response: dict) -> MCCIPlayer:
+    """Builds a MCCIPlayer from the raw graphql response"""
     if mcci_response['data'] == {}:
         raise HTTPException(404, {"message": "player was not found"})
 
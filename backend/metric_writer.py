@@ -0,0 +1,194 @@
+import threading
+from typing import Dict, List, Tuple
+from sqlalchemy import text
+from db import get_engine
+from memory_cache import LRUCache
+from metrics_manager import update_sketch, count_snapshot_write
+
+# a batch is written once FLUSH_ROWS values are pending or FLUSH_INTERVAL seconds passed
+FLUSH_ROWS = 500
+FLUSH_INTERVAL = 1.0
+MAX_PENDING = 20000
+
+
+def _normalize_uuid(uuid) -> str:
+    return str(uuid).replace("-", "").lower()
+
+
+class MetricWriter:
+    """
+    Write-behind buffer for metric_values
+
+    Values are queued per (uuid, metric_id), so a newer value replaces a pending one,
+    and values equal to the last one written are dropped. A background thread writes
+    the queue in one multi-row upsert per batch.
+    """
+
+    def __init__(
+        self,
+        flush_rows: int = FLUSH_ROWS,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # (normalized uuid, metric_id) -> (uuid as given, value)
+        self._pending: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self._last_written = LRUCache("metric_last_written", 100000, 3600)
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()  # one batch is written at a time
+        self._thread = None
+        self._closed = False
+        self.enqueued = 0
+        self.unchanged = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+
+    def add(self, uuid, metric_id: int, value) -> bool:
+        """Queues a value, returns False if it was dropped because the queue is full"""
+        if value is None:
+            return False
+        key = (_normalize_uuid(uuid), metric_id)
+        value = float(value)
+
+        with self._condition:
+            if self._last_written.get(key) == value and key not in self._pending:
+                self.unchanged += 1
+                return True
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending[key] = (uuid, value)
+            self.enqueued += 1
+            self._ensure_started()
+            if len(self._pending) >= self.flush_rows:
+                self._condition.notify()
+        return True
+
+    def add_many(self, uuid, stats: Dict[int, float]) -> None:
+        for metric_id, value in stats.items():
+            self.add(uuid, metric_id, value)
+
+    def flush(self) -> int:
+        """Writes everything pending, returns the number of changed rows"""
+        with self._flush_lock:
+            with self._condition:
+                batch = self._pending
+                self._pending = {}
+            keys = list(batch)
+            written = 0
+            for start in range(0, len(keys), self.flush_rows):
+                chunk = {key: batch[key] for key in keys[start : start + self.flush_rows]}
+                try:
+                    written += self._write(chunk)
+                except Exception as e:
+                    print(f"metric writer failed to flush {len(chunk)} values: {e}")
+                    self._requeue(chunk)
+            return written
+
+    def _requeue(self, chunk: dict) -> None:
+        with self._condition:
+            for key, entry in chunk.items():
+                if key in self._pending:
+                    continue  # a newer value was queued while this one was written
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    continue
+                self._pending[key] = entry
+
+    def close(self) -> None:
+        """Stops the background thread and writes what is still queued"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                "enqueued": self.enqueued,
+                "unchanged": self.unchanged,
+                "dropped": self.dropped,
+                "written": self.written,
+                "batches": self.batches,
+            }
+
+    def _ensure_started(self) -> None:
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(
+                target=self._run, name="metric-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._pending) < self.flush_rows:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _write(self, batch: Dict[Tuple[str, int], Tuple[str, float]]) -> int:
+        keys: List[Tuple[str, int]] = list(batch)
+        key_params = {}
+        key_rows = []
+        for i, key in enumerate(keys):
+            key_params[f"u{i}"] = batch[key][0]
+            key_params[f"m{i}"] = key[1]
+            key_rows.append(f"(:u{i}, :m{i})")
+
+        engine = get_engine()
+        with engine.begin() as conn:
+            old_rows = conn.execute(
+                text(
+                    f"""
+                    SELECT player_uuid, metric_id, value FROM metric_values
+                    WHERE (player_uuid, metric_id) IN ({", ".join(key_rows)})
+                    """
+                ),
+                key_params,
+            ).fetchall()
+            old_values = {
+                (_normalize_uuid(row.player_uuid), row.metric_id): float(row.value)
+                for row in old_rows
+            }
+
+            changed = [key for key in keys if old_values.get(key) != batch[key][1]]
+            if changed:
+                value_params = {}
+                value_rows = []
+                for i, key in enumerate(changed):
+                    value_params[f"u{i}"] = batch[key][0]
+                    value_params[f"m{i}"] = key[1]
+                    value_params[f"v{i}"] = batch[key][1]
+                    value_rows.append(f"(:u{i}, :m{i}, :v{i})")
+                conn.execute(
+                    text(
+                        f"""
+                        INSERT INTO metric_values (player_uuid, metric_id, value)
+                        VALUES {", ".join(value_rows)}
+                        ON CONFLICT (player_uuid, metric_id)
+                        DO UPDATE SET value = EXCLUDED.value
+                        """
+                    ),
+                    value_params,
+                )
+
+        for key in keys:
+            self._last_written.set(key, batch[key][1])
+        for key in changed:
+            update_sketch(key[1], old_values.get(key), batch[key][1])
+            count_snapshot_write(key[1])
+        with self._condition:
+            self.written += len(changed)
+            self.batches += 1
+        return len(changed)
+
+
+metric_writer = MetricWriter()
@@ -1,10 +1,16 @@
-import os
-import re
+import json
+import math
+import threading
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text, Engine
+from sqlalchemy import text
+from db import get_engine, AsyncSessionLocal
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from fastapi import HTTPException
+from background_refresh import schedule_refresh
+from quantile_sketch import DDSketch
 
 
 BUCKET_COUNT = 6
@@ -25,32 +31,16 @@ class HistogramData(BaseModel):
     percentile: float
 
 
-def get_engine() -> Engine:
-    # Use psycopg2 for sync PostgreSQL
-    db_url = os.getenv("DATABASE_URL").split("?")[0]
-    db_url = re.sub(r"^postgresql\+asyncpg:", "postgresql+psycopg2:", db_url)
-    db_url = re.sub(r"^postgresql:", "postgresql+psycopg2:", db_url)
-
-    engine = create_engine(
-        db_url,
-        connect_args={"sslmode": "require"},
-        echo=False,
-    )
-    return engine
-
-
-def add_value(conn, uuid, id, value) -> None:
-    conn.execute(
-        text(
-            """
-            INSERT INTO metric_values (player_uuid, metric_id, value)
-            VALUES(:player_uuid, :metric_id, :value)
-            ON CONFLICT (player_uuid, metric_id)
-            DO UPDATE SET value = EXCLUDED.value
-            """
-        ),
-        {"player_uuid": uuid, "metric_id": id, "value": value},
-    )
+def count_snapshot_write(metric_id) -> None:
+    """Rebuilds the metric's snapshot in the background once enough values were written"""
+    with _snapshot_lock:
+        metric_key = _snapshot_keys.get(metric_id)
+        if metric_key is None:
+            return
+        _snapshot_writes[metric_id] = _snapshot_writes.get(metric_id, 0) + 1
+        if _snapshot_writes[metric_id] < SNAPSHOT_REFRESH_WRITES:
+            return
+    schedule_refresh(("metric_snapshot", metric_key), build_snapshot, metric_key)
 
 
 def create_stat() -> None:
@@ -69,138 +59,342 @@ def create_stat() -> None:
         )
 
 
-def get_stats(metric_key, player_uuid) -> HistogramData:
+SNAPSHOT_QUERY = """
+WITH metric AS (
+    SELECT id, unit, higher_is_better
+    FROM metrics
+    WHERE key = :metric_key
+),
+bounds AS (
+    SELECT MIN(value) AS min_value,
+        MAX(value) AS max_value
+    FROM metric_values
+    WHERE metric_id = (SELECT id FROM metric)
+),
+hist AS (
+    SELECT LEAST(width_bucket(log10(v.value + 1), log10(b.min_value + 1), log10(b.max_value + 1) + 1e-9, :bucket_count), :bucket_count) AS bucket,
+        COUNT(*) AS c
+    FROM metric_values v
+    CROSS JOIN bounds b
+    WHERE v.metric_id = (SELECT id FROM metric)
+    GROUP BY bucket
+)
+SELECT m.id,
+    m.unit,
+    m.higher_is_better,
+    b.min_value,
+    b.max_value,
+    (SELECT COALESCE(SUM(c), 0) FROM hist) AS sample_size,
+    ARRAY(
+        SELECT COALESCE(h.c, 0)
+        FROM generate_series(1, :bucket_count) AS s(bucket)
+        LEFT JOIN hist h ON h.bucket = s.bucket
+        ORDER BY s.bucket
+    ) AS counts
+FROM metric m
+CROSS JOIN bounds b;
+"""
+
+# a snapshot is rebuilt after SNAPSHOT_TTL seconds or SNAPSHOT_REFRESH_WRITES written values
+SNAPSHOT_TTL = 300
+SNAPSHOT_REFRESH_WRITES = 500
+
+
+class DistributionSnapshot(BaseModel):
+    metric_id: int
+    metric_key: str
+    unit: Optional[str]
+    higher_is_better: bool
+    sample_size: int
+    min_value: float
+    max_value: float
+    buckets: List[float]
+    counts: List[int]
+    created_at: float
+
+
+snapshots: Dict[str, DistributionSnapshot] = {}
+_snapshot_writes: Dict[int, int] = {}  # values written per metric id since its last snapshot
+_snapshot_keys: Dict[int, str] = {}  # metric id -> metric key for snapshots we hold
+_snapshot_lock = threading.Lock()
+
+
+def init_metrics_manager() -> None:
     engine = get_engine()
     with engine.begin() as conn:
-        metric_row = conn.execute(
-            text(
-                """
-            SELECT id, unit, higher_is_better
-            FROM metrics
-            WHERE key = :metric_key;
-            """
-            ),
-            {"metric_key": metric_key},
-        ).fetchone()
-        metric_id = metric_row.id
-        unit = metric_row.unit
-        higher_is_better = metric_row.higher_is_better
-
-        try:
-            player_value = conn.execute(
-                text(
-                    """
-                    SELECT value
-                    FROM metric_values
-                    WHERE metric_id = :metric_id
-                    AND player_uuid = :player_uuid
-                    """
-                ),
-                {"metric_id": metric_id, "player_uuid": player_uuid},
-            ).fetchone()[0]
-            # print(player_value)
-        except TypeError:
-            raise HTTPException(404, "Player not found in database")
-
-        bounds = conn.execute(
+        # min/max become index probes and the histogram an index only scan
+        conn.execute(
             text(
                 """
-                SELECT MIN(value) AS min_value,
-                    MAX(value) AS max_value,
-                    COUNT(*) AS sample_size
-                FROM metric_values 
-                WHERE metric_id = :metric_id
+                CREATE INDEX IF NOT EXISTS metric_values_metric_id_value_idx
+                ON metric_values (metric_id, value);
                 """
-            ),
-            {"metric_id": metric_id},
-        ).fetchone()
-        # print(bounds)
+            )
+        )
+        conn.execute(text("ALTER TABLE metrics ADD COLUMN IF NOT EXISTS sketch JSONB;"))
+    print("Metrics manager initialized.")
 
-        min_value = bounds.min_value
-        max_value = bounds.max_value
-        sample_size = bounds.sample_size
 
-        buckets_row = conn.execute(
-            text(
-                """
-                WITH bounds AS (
-                SELECT MIN(log10(value + 1)) AS mn,
-                        MAX(log10(value + 1)) AS mx
-                FROM metric_values
-                WHERE metric_id = :metric_id
-                ),
-                hist AS (
-                SELECT LEAST(width_bucket(log10(value + 1), b.mn, b.mx + 1e-9, :bucket_count), :bucket_count) AS bucket,
-                        COUNT(*) AS c
-                FROM metric_values v
-                CROSS JOIN bounds b
-                WHERE v.metric_id = :metric_id
-                GROUP BY bucket
-                ),
-                series AS (
-                SELECT generate_series(1, :bucket_count) AS bucket
-                )
-                SELECT s.bucket, COALESCE(h.c, 0) AS count
-                FROM series s
-                LEFT JOIN hist h ON h.bucket = s.bucket
-                ORDER BY s.bucket;
-                """
-            ),
-            {"bucket_count": BUCKET_COUNT, "metric_id": metric_id},
-        ).fetchall()
+def log_bucket_edges(min_value: float, max_value: float) -> List[float]:
+    """Edges of BUCKET_COUNT buckets spaced evenly on log10(value + 1)"""
+    mn = math.log10(min_value + 1)
+    mx = math.log10(max_value + 1)
+    return [
+        10 ** (mn + (mx - mn) * (i / BUCKET_COUNT)) - 1 for i in range(BUCKET_COUNT + 1)
+    ]
 
-        buckets = [float(item[1]) for item in buckets_row]
 
-        # print(buckets)
-        bucket_edges_row = conn.execute(
-            text(
-                """
-                WITH bounds AS (
-                SELECT MIN(log10(value + 1)) AS mn,
-                        MAX(log10(value + 1)) AS mx
-                FROM metric_values
-                WHERE metric_id = :metric_id
-                )
-                SELECT power(10, mn + (mx - mn) * (i::float / :bucket_count)) - 1 AS bucket_edge
-                FROM bounds, generate_series(0, :bucket_count) AS i;
-                """
-            ),
-            {"bucket_count": BUCKET_COUNT, "metric_id": metric_id},
+SKETCH_QUERY = """
+SELECT SIGN(value) AS sign,
+    CASE WHEN value = 0 THEN 0 ELSE CEIL(LN(ABS(value)::double precision) / :ln_gamma) END AS key,
+    COUNT(*) AS c
+FROM metric_values
+WHERE metric_id = :metric_id
+GROUP BY 1, 2;
+"""
+
+# in memory sketches are persisted every SKETCH_PERSIST_WRITES updates, and rebuilt
+# from metric_values every SKETCH_RESYNC_INTERVAL seconds to pick up writes made
+# by other processes
+SKETCH_PERSIST_WRITES = 100
+SKETCH_RESYNC_INTERVAL = 3600
+
+sketches: Dict[int, DDSketch] = {}
+_sketch_synced_at: Dict[int, float] = {}
+_sketch_writes: Dict[int, int] = {}
+_sketch_lock = threading.Lock()
+
+
+def rebuild_sketch(metric_id: int) -> DDSketch:
+    """Builds a metric's quantile sketch from grouped bucket counts and persists it"""
+    sketch = DDSketch()
+    engine = get_engine()
+    with engine.begin() as conn:
+        bucket_rows = conn.execute(
+            text(SKETCH_QUERY), {"metric_id": metric_id, "ln_gamma": sketch.ln_gamma}
         ).fetchall()
-        bucket_edges = [float(item[0]) for item in bucket_edges_row]
-        # print(bucket_edges)
+    for row in bucket_rows:
+        if row.sign == 0:
+            sketch.add(0, int(row.c))
+        else:
+            sketch.add_bucket(int(row.key), int(row.c), positive=row.sign > 0)
 
-        percentile_row = conn.execute(
-            text(
-                """
-                SELECT
-                100.0 * COUNT(*) FILTER (WHERE value <= :pv) / COUNT(*) AS pct
-                FROM metric_values
-                WHERE metric_id = :metric_id
-            """
-            ),
-            {"pv": player_value, "metric_id": metric_id},
+    with _sketch_lock:
+        sketches[metric_id] = sketch
+        _sketch_synced_at[metric_id] = time.time()
+        _sketch_writes[metric_id] = 0
+    persist_sketch(metric_id)
+    return sketch
+
+
+def persist_sketch(metric_id: int) -> None:
+    with _sketch_lock:
+        sketch = sketches.get(metric_id)
+        if sketch is None:
+            return
+        sketch_data = {**sketch.to_dict(), "synced_at": _sketch_synced_at[metric_id]}
+        sketch_json = json.dumps(sketch_data)
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE metrics SET sketch = :sketch WHERE id = :metric_id"),
+            {"sketch": sketch_json, "metric_id": metric_id},
+        )
+
+
+def get_sketch(metric_id: int) -> DDSketch:
+    """Returns the metric's sketch, loading the persisted one or building it on first use"""
+    sketch = sketches.get(metric_id)
+    if sketch is None:
+        engine = get_engine()
+        with engine.begin() as conn:
+            sketch_row = conn.execute(
+                text("SELECT sketch FROM metrics WHERE id = :metric_id"),
+                {"metric_id": metric_id},
+            ).fetchone()
+        if sketch_row is None or sketch_row.sketch is None:
+            return rebuild_sketch(metric_id)
+
+        sketch = DDSketch.from_dict(sketch_row.sketch)
+        with _sketch_lock:
+            sketch = sketches.setdefault(metric_id, sketch)
+            _sketch_synced_at.setdefault(metric_id, sketch_row.sketch["synced_at"])
+
+    if time.time() - _sketch_synced_at[metric_id] > SKETCH_RESYNC_INTERVAL:
+        schedule_refresh(("metric_sketch", metric_id), rebuild_sketch, metric_id)
+    return sketch
+
+
+def update_sketch(metric_id, old_value, new_value) -> None:
+    """Replaces a player's previous value in the metric's sketch, if it is loaded"""
+    if metric_id not in sketches or new_value is None:
+        return
+    if old_value is not None and float(old_value) == float(new_value):
+        return
+
+    with _sketch_lock:
+        sketch = sketches[metric_id]
+        if old_value is not None:
+            sketch.remove(float(old_value))
+        sketch.add(float(new_value))
+        _sketch_writes[metric_id] = _sketch_writes.get(metric_id, 0) + 1
+        if _sketch_writes[metric_id] < SKETCH_PERSIST_WRITES:
+            return
+        _sketch_writes[metric_id] = 0
+    schedule_refresh(("metric_sketch_persist", metric_id), persist_sketch, metric_id)
+
+
+def sketch_percentile(metric_id: int, value: float) -> float:
+    sketch = get_sketch(metric_id)
+    with _sketch_lock:
+        return 100.0 * sketch.rank(value)
+
+
+def build_snapshot(metric_key: str) -> Optional[DistributionSnapshot]:
+    """Computes a distribution snapshot for a metric, None if the metric doesn't exist"""
+    engine = get_engine()
+    with engine.begin() as conn:
+        snapshot_row = conn.execute(
+            text(SNAPSHOT_QUERY),
+            {
+                "metric_key": metric_key,
+                "bucket_count": BUCKET_COUNT,
+            },
+        ).fetchone()
+
+    if snapshot_row is None:
+        return None
+
+    if snapshot_row.min_value is None:  # metric has no values yet
+        min_value = max_value = 0.0
+    else:
+        min_value = float(snapshot_row.min_value)
+        max_value = float(snapshot_row.max_value)
+
+    snapshot = DistributionSnapshot(
+        metric_id=snapshot_row.id,
+        metric_key=metric_key,
+        unit=snapshot_row.unit,
+        higher_is_better=snapshot_row.higher_is_better,
+        sample_size=int(snapshot_row.sample_size),
+        min_value=min_value,
+        max_value=max_value,
+        buckets=log_bucket_edges(min_value, max_value),
+        counts=[int(count) for count in snapshot_row.counts],
+        created_at=time.time(),
+    )
+    with _snapshot_lock:
+        snapshots[metric_key] = snapshot
+        _snapshot_keys[snapshot.metric_id] = metric_key
+        _snapshot_writes[snapshot.metric_id] = 0
+    return snapshot
+
+
+def get_snapshot(metric_key: str) -> Optional[DistributionSnapshot]:
+    """
+    Returns the current snapshot for a metric, building it on first use.
+    Snapshots past SNAPSHOT_TTL are served while a new one is built in the background
+    """
+    snapshot = snapshots.get(metric_key)
+    if snapshot is None:
+        return build_snapshot(metric_key)
+    if time.time() - snapshot.created_at > SNAPSHOT_TTL:
+        schedule_refresh(("metric_snapshot", metric_key), build_snapshot, metric_key)
+    return snapshot
+
+
+def warm_metrics() -> int:
+    """Builds the snapshot and loads the sketch of every metric, returns how many"""
+    engine = get_engine()
+    with engine.begin() as conn:
+        metric_rows = conn.execute(text("SELECT id, key FROM metrics")).fetchall()
+    for row in metric_rows:
+        build_snapshot(row.key)
+        get_sketch(row.id)
+    return len(metric_rows)
+
+
+PLAYER_VALUE_QUERY = text(
+    """
+    SELECT value
+    FROM metric_values
+    WHERE metric_id = :metric_id
+    AND player_uuid = :player_uuid
+    """
+)
+
+
+def get_stats(metric_key, player_uuid) -> HistogramData:
+    """
+    Places the player's value against the metric's distribution snapshot, the percentile
+    comes from the metric's quantile sketch
+    """
+    snapshot = get_snapshot(metric_key)
+    if snapshot is None:
+        raise HTTPException(404, "Metric not found")
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        player_row = conn.execute(
+            PLAYER_VALUE_QUERY,
+            {"metric_id": snapshot.metric_id, "player_uuid": player_uuid},
         ).fetchone()
+    if player_row is None:
+        raise HTTPException(404, "Player not found in database")
+
+    player_value = float(player_row.value)
+    percentile = sketch_percentile(snapshot.metric_id, player_value)
+    return _histogram_data(snapshot, player_value, percentile)
+
+
+async def get_stats_async(metric_key, player_uuid) -> HistogramData:
+    """
+    Async version of get_stats, only building a missing snapshot or sketch
+    is sent to the threadpool
+    """
+    if metric_key in snapshots:
+        snapshot = get_snapshot(metric_key)
+    else:
+        snapshot = await run_in_threadpool(get_snapshot, metric_key)
+    if snapshot is None:
+        raise HTTPException(404, "Metric not found")
 
-        percentile = percentile_row.pct
-
-        # print(percentile)
-        histogram_data = HistogramData(
-            metric_key=metric_key,
-            unit=unit,
-            higher_is_better=higher_is_better,
-            sample_size=sample_size,
-            min_value=float(min_value),
-            max_value=float(max_value),
-            buckets=bucket_edges,
-            counts=buckets,
-            percentile=float(percentile),
-            player_value=float(player_value),
+    async with AsyncSessionLocal() as session:
+        player_row = (
+            await session.execute(
+                PLAYER_VALUE_QUERY,
+                {"metric_id": snapshot.metric_id, "player_uuid": player_uuid},
+            )
+        ).fetchone()
+    if player_row is None:
+        raise HTTPException(404, "Player not found in database")
+
+    player_value = float(player_row.value)
+    if snapshot.metric_id in sketches:
+        percentile = sketch_percentile(snapshot.metric_id, player_value)
+    else:
+        percentile = await run_in_threadpool(
+            sketch_percentile, snapshot.metric_id, player_value
         )
-        # print(histogram_data)
-        return histogram_data
+    return _histogram_data(snapshot, player_value, percentile)
+
+
+def _histogram_data(
+    snapshot: DistributionSnapshot, player_value: float, percentile: float
+) -> HistogramData:
+    return HistogramData(
+        metric_key=snapshot.metric_key,
+        unit=snapshot.unit,
+        higher_is_better=snapshot.higher_is_better,
+        sample_size=snapshot.sample_size,
+        min_value=snapshot.min_value,
+        max_value=snapshot.max_value,
+        buckets=snapshot.buckets,
+        counts=snapshot.counts,
+        percentile=percentile,
+        player_value=player_value,
+    )
 
 
 if __name__ == "__main__":
     get_stats("wynncraft_hours_played", "1ed075fc5aa942e0a29f640326c1d80c")
-    # add_value("3ff2e63ad63045e0b96f57cd0eae708d", 7, 52)
@@ -1,10 +1,19 @@
-from utils import pillow_to_b64, check_valid_uuid
+from utils import check_valid_uuid
+from http_client import get_async_client, get_sync_session
+from rate_limiter import limiters
+from texture_cache import (
+    get_renders,
+    get_renders_async,
+    render_texture,
+    render_texture_async,
+    texture_hash,
+)
 import requests
+import httpx
 import json
 import base64
-import io
-from PIL import Image
 import logging
+import asyncio
 from pydantic import BaseModel
 from typing import Optional
 import exceptions
@@ -18,9 +27,21 @@ class MojangData(BaseModel):
     cape_name: Optional[str]
     skin_url: str
     cape_url: Optional[str]
-    skin_showcase_b64: str
+    skin_showcase_b64: Optional[str]
     cape_front_b64: Optional[str]
     cape_back_b64: Optional[str]
+    # set instead of the base64 fields when a response asks for image urls
+    skin_showcase_url: Optional[str] = None
+    cape_front_url: Optional[str] = None
+    cape_back_url: Optional[str] = None
+
+
+# base64 fields of MojangData and the url fields that replace them
+MOJANG_IMAGE_FIELDS = {
+    "skin_showcase_b64": "skin_showcase_url",
+    "cape_front_b64": "cape_front_url",
+    "cape_back_b64": "cape_back_url",
+}
 
 
 logger = logging.getLogger(__name__)
@@ -68,12 +89,11 @@ class GetMojangAPIData:
         self.has_cape = None
         self.skin_id = None
         self.cape_name = None
-        self.cape_back = None
-        self.cape_showcase = None
+        self.rendered = {}  # texture kind -> rendered images
         self.skin_showcase_b64 = None
         self.cape_back_b64 = None
         self.cape_showcase_b64 = None
-        self.session = requests.sessions.Session()
+        self.session = get_sync_session()
 
     def get_data(self) -> MojangData:
         """
@@ -90,6 +110,25 @@ class GetMojangAPIData:
         self.get_skin_data()
         self.get_skin_images()
 
+        return self.build_profile()
+
+    async def get_data_async(self) -> MojangData:
+        """Async version of get_data using the shared client"""
+        if self.uuid is not None:
+            if not check_valid_uuid(self.uuid):
+                raise exceptions.InvalidUserUUID()
+
+        if self.uuid is None:
+            await self.get_uuid_async()
+
+        await self.get_skin_data_async()
+        await self.get_skin_images_async()
+
+        return self.build_profile()
+
+    def build_profile(self) -> MojangData:
+        if self.skin_showcase_b64 is None:
+            raise exceptions.ServiceError()
         try:
             player_profile = MojangData(
                 source="mojang_api",
@@ -113,11 +152,13 @@ class GetMojangAPIData:
         """
         receives uuid based on username
         """
+        limiters["mojang"].acquire()
         try:
             uuid_response_raw = self.session.get(
                 f"https://api.minecraftservices.com/minecraft/profile/lookup/name/{self.username}",
                 timeout=10,
             )
+            limiters["mojang"].update(uuid_response_raw)
             uuid_response_raw.raise_for_status()
 
             uuid_response: dict = uuid_response_raw.json()
@@ -141,6 +182,37 @@ class GetMojangAPIData:
         self.username = uuid_response["name"]
         return self.uuid
 
+    async def get_uuid_async(self) -> str:
+        """Async version of get_uuid"""
+        await limiters["mojang"].acquire_async()
+        try:
+            uuid_response_raw = await get_async_client().get(
+                f"https://api.minecraftservices.com/minecraft/profile/lookup/name/{self.username}",
+            )
+            limiters["mojang"].update(uuid_response_raw)
+            uuid_response_raw.raise_for_status()
+
+            uuid_response: dict = uuid_response_raw.json()
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                raise exceptions.NotFound()
+            logger.error(f"HTTP error occurred: {e}")
+            raise exceptions.UpstreamError()
+        except httpx.TimeoutException as e:
+            logger.error(f"Request timed out: {e}")
+            raise exceptions.UpstreamTimeoutError()
+        except httpx.RequestError as e:
+            logger.error(f"Request exception occurred: {e}")
+            raise exceptions.UpstreamError()
+        except Exception as e:
+            logger.warning(f"something went wrong while getting Minecraft UUID: {e}")
+            raise exceptions.ServiceError()
+
+        self.uuid = uuid_response["id"]
+        self.username = uuid_response["name"]
+        return self.uuid
+
     def get_skin_data(self) -> None:
         """
         This function receives data about the skin and cape, requires UUID
@@ -149,11 +221,13 @@ class GetMojangAPIData:
         that is where skin and cape data are (another json)
         """
 
+        limiters["mojang"].acquire()
         try:
             player_profile_raw = self.session.get(
                 f"https://sessionserver.mojang.com/session/minecraft/profile/{self.uuid}",
                 timeout=10,
             )
+            limiters["mojang"].update(player_profile_raw)
             player_profile_raw.raise_for_status()
             
         except requests.exceptions.HTTPError as e:
@@ -175,7 +249,41 @@ class GetMojangAPIData:
         if not player_profile_raw.text:
                 raise exceptions.NotFound()
         
-        player_profile: dict = player_profile_raw.json()
+        self._parse_profile(player_profile_raw.json())
+
+    async def get_skin_data_async(self) -> None:
+        """Async version of get_skin_data"""
+        await limiters["mojang"].acquire_async()
+        try:
+            player_profile_raw = await get_async_client().get(
+                f"https://sessionserver.mojang.com/session/minecraft/profile/{self.uuid}",
+            )
+            limiters["mojang"].update(player_profile_raw)
+            player_profile_raw.raise_for_status()
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                raise exceptions.NotFound()
+            logger.error(f"HTTP error occurred: {e}")
+            raise exceptions.UpstreamError()
+        except httpx.TimeoutException as e:
+            logger.error(f"Request timed out: {e}")
+            raise exceptions.UpstreamTimeoutError()
+        except httpx.RequestError as e:
+            logger.error(f"Request exception occurred: {e}")
+            raise exceptions.UpstreamError()
+        except Exception as e:
+            logger.warning(
+                f"something went wrong while getting Minecraft skin data: {e}"
+            )
+            raise exceptions.ServiceError()
+        if not player_profile_raw.text:
+            raise exceptions.NotFound()
+
+        self._parse_profile(player_profile_raw.json())
+
+    def _parse_profile(self, player_profile: dict) -> None:
+        """Reads the skin and cape urls out of a sessionserver profile"""
         logger.info("request success for getting skin and cape data!")
 
         # gets a list which contains a dictionary
@@ -201,64 +309,73 @@ class GetMojangAPIData:
 
     def get_skin_images(self):
         """
-        This downloads the images from skin url and optionally cape url(if it exists)
+        Renders the skin and the cape (if it exists), textures rendered before are
+        taken from the texture cache without downloading them again
         """
-        try:
-            response_skin = self.session.get(self.skin_url)  # skin image request
-            skin_bytes = io.BytesIO(response_skin.content)
+        for kind, (url, content) in self.download_textures().items():
+            self.rendered[kind] = render_texture(kind, url, content)
 
-            full_skin_image = Image.open(skin_bytes)
-            logger.debug("skin image opened successfully")
+        return self.apply_renders()
 
-            try:  # we overlap base face with outer layer here
-                crop_area = (8, 8, 16, 16)
-                self.skin_showcase = full_skin_image.crop(crop_area)  # base skin face
-
-                crop_area = (40, 8, 48, 16)
-                skin_showcase_overlay = full_skin_image.crop(
-                    crop_area
-                )  # skin face overlay
-                _, _, _, alpha_mask = skin_showcase_overlay.split()
-
-                paste_area = (0, 0)
-                self.skin_showcase.paste(
-                    skin_showcase_overlay, paste_area, mask=alpha_mask
-                )
-
-                self.skin_showcase_b64 = pillow_to_b64(self.skin_showcase)
-
-            except Exception as e:
-                logger.error(f"something went wrong while cropping skin image: {e}")
-
-        except Exception as e:
-            logger.error(f"something went wrong in get_skin_images: {e}")
-
-        # cape section
+    def download_textures(self) -> dict:
+        """
+        Takes what is already rendered from the texture cache and downloads the rest,
+        returns {kind: (url, content)} of the textures that still need rendering
+        """
+        urls = self._texture_urls()
+        renders = get_renders(urls.values())
+        self.rendered = {kind: renders.get(texture_hash(url)) for kind, url in urls.items()}
+
+        missing = {}
+        for kind, url in urls.items():
+            if self.rendered[kind] is None:
+                try:
+                    missing[kind] = (url, self.session.get(url).content)
+                except Exception as e:
+                    logger.error(f"something went wrong while fetching {kind} image: {e}")
+        return missing
+
+    async def get_skin_images_async(self):
+        """Async version of get_skin_images, missing textures are downloaded concurrently"""
+        urls = self._texture_urls()
+        renders = await get_renders_async(urls.values())
+        self.rendered = {kind: renders.get(texture_hash(url)) for kind, url in urls.items()}
+        missing = {kind: url for kind, url in urls.items() if self.rendered[kind] is None}
+
+        client = get_async_client()
+        responses = await asyncio.gather(
+            *[client.get(url) for url in missing.values()], return_exceptions=True
+        )
+        for (kind, url), response in zip(missing.items(), responses):
+            if isinstance(response, Exception):
+                logger.error(f"something went wrong while fetching {kind} image: {response}")
+                continue
+            self.rendered[kind] = await render_texture_async(kind, url, response.content)
+
+        return self.apply_renders()
+
+    def _texture_urls(self) -> dict:
+        urls = {}
+        if self.skin_url is not None:
+            urls["skin"] = self.skin_url
         if self.has_cape:  # only gets image if url exists
-            try:
-                response_cape = self.session.get(self.cape_url)
-                cape_bytes = io.BytesIO(response_cape.content)
-
-                full_cape_image = Image.open(cape_bytes)  # uncropped cape image
-                logger.info("cape image opened successfully")
-            except Exception as e:
-                logger.error(f"something went wrong while fetching cape image: {e}")
-
-            try:
-                crop_area = (1, 1, 11, 17)
-                self.cape_showcase = full_cape_image.crop(crop_area)
-
-            except Exception as e:
-                logger.error(f"something went wrong while cropping cape image: {e}")
-
-            try:
-                crop_area = (12, 1, 22, 17)
-                self.cape_back = full_cape_image.crop(crop_area)
-            except Exception as e:
-                logger.error(f"something went wrong while cropping back of cape: {e}")
+            urls["cape"] = self.cape_url
+        return urls
+
+    def apply_renders(self):
+        """Sets the showcase images and the cape name from self.rendered"""
+        rendered_skin = self.rendered.get("skin")
+        rendered_cape = self.rendered.get("cape")
+        if rendered_skin is not None:
+            self.skin_showcase_b64 = rendered_skin["face"]
+        else:
+            logger.error(f"no skin image could be rendered for {self.username}")
 
-            self.cape_showcase_b64 = pillow_to_b64(self.cape_showcase)
-            self.cape_back_b64 = pillow_to_b64(self.cape_back)
+        # cape section
+        if self.has_cape:
+            if rendered_cape is not None:
+                self.cape_showcase_b64 = rendered_cape["front"]
+                self.cape_back_b64 = rendered_cape["back"]
 
             raw_cape_data = self.cape_url[-32:]
             try:
@@ -1,13 +1,64 @@
 from minecraft_api import GetMojangAPIData, MojangData
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import text, bindparam
 from typing import Tuple, List, Dict
 import exceptions
 import time
+from singleflight import flights, flight_key
+from background_refresh import schedule_refresh, schedule_refresh_async
+from db import SessionLocal, AsyncSessionLocal
+from negative_cache import negative_cache
+from cache import get_cache
+from tracing import traced, with_context
+from texture_cache import render_many
+from concurrent.futures import ThreadPoolExecutor
+from cache_tracking import record_cache, source_outcome, miss_outcome, MISS, NEGATIVE
 
+# in seconds, rows younger than MINECRAFT_TTL are served as is, rows up to
+# MINECRAFT_HARD_TTL are served as stale_cache while they get refreshed in the background
 MINECRAFT_TTL = 180
+MINECRAFT_HARD_TTL = 3600
 
+# in-process copies of fresh rows, keyed by uuid and by lowercased username
+minecraft_memory_cache = get_cache("minecraft", MojangData)
 
+# shared by the sync and async paths, typed so asyncpg decodes the JSONB column
+# newest row first in case a name change hasn't been seen for the old owner yet
+CACHE_BY_USERNAME_QUERY = text(
+    """
+    SELECT data, extract(epoch from timestamp) as timestamp FROM minecraft_cache
+    WHERE username_lower = :username_lower
+    ORDER BY timestamp DESC
+    LIMIT 1"""
+).columns(data=JSONB)
+CACHE_BY_UUID_QUERY = text(
+    """
+    SELECT data, extract(epoch from timestamp) as timestamp FROM minecraft_cache
+    WHERE uuid = :uuid"""
+).columns(data=JSONB)
+# if the name changed owners, the previous owner's row must stop answering for it
+RELEASE_USERNAME_QUERY = text(
+    """
+    UPDATE minecraft_cache SET username_lower = NULL
+    WHERE username_lower = :username_lower AND uuid <> :uuid
+    """
+)
+UPSERT_QUERY = text(
+    """
+    INSERT INTO minecraft_cache (uuid, data, timestamp, username_lower) 
+    VALUES (:uuid, :data, NOW(), :username_lower)
+    ON CONFLICT (uuid)
+    DO UPDATE SET 
+        data = EXCLUDED.data,
+        timestamp = NOW(),
+        username_lower = EXCLUDED.username_lower
+    """
+)
+
+
+@traced()
 def get_minecraft_data(search_term: str, session: Session) -> MojangData:
     data = None
     try:
@@ -16,92 +67,341 @@ def get_minecraft_data(search_term: str, session: Session) -> MojangData:
         pass
 
     if data is None:
-        if len(search_term) <= 20:
-            mojang_instance = GetMojangAPIData(search_term)
-        else:
-            mojang_instance = GetMojangAPIData(None, search_term)
-        data = mojang_instance.get_data()
+        record_cache("minecraft", miss_outcome("mojang", search_term))
+        data = flights.do(
+            flight_key("mojang", search_term), fetch_minecraft_data, search_term
+        )
+    else:
+        record_cache("minecraft", source_outcome(data.source))
+    if data.source == "stale_cache":
+        schedule_refresh(
+            flight_key("mojang", data.uuid), refresh_minecraft_cache, data.uuid
+        )
 
     add_to_minecraft_cache(data.uuid, data, session)
 
     return data
 
 
-def get_minecraft_cache(search_term: str, session: Session) -> MojangData:
-    """Gets cache from either uuid or username"""
-    if search_term is None:
-        raise exceptions.InvalidCache()
+@traced()
+async def get_minecraft_data_async(
+    search_term: str, session: AsyncSession
+) -> MojangData:
+    """
+    Async version of get_minecraft_data, both the upstream fetch and the database
+    calls are awaited on the event loop
+    """
+    data = None
+    try:
+        data = await get_minecraft_cache_async(search_term, session)
+    except exceptions.InvalidCache:
+        pass
+
+    if data is None:
+        record_cache("minecraft", miss_outcome("mojang", search_term))
+        data = await flights.do_async(
+            flight_key("mojang", search_term), fetch_minecraft_data_async, search_term
+        )
+    else:
+        record_cache("minecraft", source_outcome(data.source))
+    if data.source == "stale_cache":
+        schedule_refresh_async(
+            flight_key("mojang", data.uuid), refresh_minecraft_cache_async, data.uuid
+        )
+
+    await add_to_minecraft_cache_async(data.uuid, data, session)
+
+    return data
+
+
+def fetch_minecraft_data(search_term: str) -> MojangData:
+    """
+    Gets live data from Mojang by either uuid or username,
+    recently not found search terms are answered from the negative cache
+    """
+    if negative_cache.contains("mojang", search_term):
+        raise exceptions.NotFound()
 
     if len(search_term) <= 20:
-        cache_data = session.execute(
-            text(
-                """
-                SELECT data, extract(epoch from timestamp) as timestamp FROM minecraft_cache
-                WHERE LOWER(data->>'username') = LOWER(:search_term)"""
-            ),
-            {"search_term": search_term},
-        ).fetchone()
+        mojang_instance = GetMojangAPIData(search_term)
     else:
-        cache_data = session.execute(
-            text(
-                """
-                SELECT data, extract(epoch from timestamp) as timestamp FROM minecraft_cache
-                WHERE uuid = :uuid"""
-            ),
-            {"uuid": search_term},
-        ).fetchone()
+        mojang_instance = GetMojangAPIData(None, search_term)
+    try:
+        return mojang_instance.get_data()
+    except exceptions.NotFound:
+        negative_cache.add("mojang", search_term)
+        raise
+
+
+async def fetch_minecraft_data_async(search_term: str) -> MojangData:
+    if negative_cache.contains("mojang", search_term):
+        raise exceptions.NotFound()
+
+    if len(search_term) <= 20:
+        mojang_instance = GetMojangAPIData(search_term)
+    else:
+        mojang_instance = GetMojangAPIData(None, search_term)
+    try:
+        return await mojang_instance.get_data_async()
+    except exceptions.NotFound:
+        negative_cache.add("mojang", search_term)
+        raise
+
+
+# profiles and textures of a batch are downloaded on this many threads
+BATCH_FETCH_WORKERS = 8
+
+
+@traced()
+def fetch_minecraft_data_many(uuids: List[str]) -> Dict[str, MojangData]:
+    """
+    Gets live data for many uuids at once. Profiles and textures are downloaded on
+    threads, then every new texture is rendered in one batch on the render process
+    pool. Uuids that couldn't be fetched are left out of the result.
+    """
+    instances = {}
+    for uuid in uuids:
+        if negative_cache.contains("mojang", uuid):
+            record_cache("minecraft", NEGATIVE)
+        else:
+            record_cache("minecraft", MISS)
+            instances[uuid] = GetMojangAPIData(None, uuid)
+
+    def download(instance: GetMojangAPIData) -> dict:
+        instance.get_skin_data()
+        return instance.download_textures()
+
+    missing_textures = {}
+    with ThreadPoolExecutor(max_workers=BATCH_FETCH_WORKERS) as executor:
+        futures = {
+            uuid: executor.submit(with_context(download), instance)
+            for uuid, instance in instances.items()
+        }
+        for uuid, future in futures.items():
+            try:
+                missing_textures[uuid] = future.result()
+            except exceptions.NotFound:
+                negative_cache.add("mojang", uuid)
+            except Exception as e:
+                print(f"Couldn't fetch minecraft data for {uuid}: {e}")
+
+    for kind in ("skin", "cape"):
+        textures = [
+            missing[kind] for missing in missing_textures.values() if kind in missing
+        ]
+        if not textures:
+            continue
+        renders = render_many(kind, textures)
+        for uuid, missing in missing_textures.items():
+            if kind in missing:
+                instances[uuid].rendered[kind] = renders[missing[kind][0]]
+
+    results = {}
+    for uuid in missing_textures:
+        instance = instances[uuid]
+        instance.apply_renders()
+        try:
+            results[uuid] = instance.build_profile()
+        except exceptions.ServiceError:
+            print(f"Couldn't build minecraft data for {uuid}")
+    return results
+
+
+def refresh_minecraft_cache(uuid: str) -> None:
+    """Fetches live data for a stale cache row and writes it back"""
+    data = flights.do(flight_key("mojang", uuid), fetch_minecraft_data, uuid)
+    with SessionLocal() as session:
+        add_to_minecraft_cache(data.uuid, data, session)
+
+
+async def refresh_minecraft_cache_async(uuid: str) -> None:
+    data = await flights.do_async(
+        flight_key("mojang", uuid), fetch_minecraft_data_async, uuid
+    )
+    async with AsyncSessionLocal() as session:
+        await add_to_minecraft_cache_async(data.uuid, data, session)
+
+
+def _memory_cache_key(search_term: str) -> str:
+    if len(search_term) <= 20:
+        return f"name:{search_term.lower()}"
+    # dashed and upper case uuids share the entry, like singleflight.flight_key
+    return search_term.replace("-", "").lower()
 
+
+def get_minecraft_memory_cache(search_term: str) -> MojangData | None:
+    if search_term is None:
+        return None
+    return minecraft_memory_cache.get(_memory_cache_key(search_term))
+
+
+def set_minecraft_memory_cache(data: MojangData, ttl: float = MINECRAFT_TTL) -> None:
+    cached_data = data.model_copy(update={"source": "cache"})
+    minecraft_memory_cache.set(_memory_cache_key(data.uuid), cached_data, ttl)
+    minecraft_memory_cache.set(_memory_cache_key(data.username), cached_data, ttl)
+
+
+def _cache_lookup(search_term: str):
+    if len(search_term) <= 20:
+        return CACHE_BY_USERNAME_QUERY, {"username_lower": search_term.lower()}
+    return CACHE_BY_UUID_QUERY, {"uuid": search_term}
+
+
+def _parse_cache_row(cache_data) -> MojangData:
     if cache_data is None:
         raise exceptions.InvalidCache()
 
-    current_time = time.time()
-    epoch_cache_time = int(cache_data.timestamp)
-    if current_time - epoch_cache_time < MINECRAFT_TTL:
+    cache_age = time.time() - int(cache_data.timestamp)
+    if cache_age < MINECRAFT_HARD_TTL:
+        source = "cache" if cache_age < MINECRAFT_TTL else "stale_cache"
         try:
-            return MojangData(source="cache", **cache_data.data)
+            data = MojangData(source=source, **cache_data.data)
+            if source == "cache":
+                set_minecraft_memory_cache(data, MINECRAFT_TTL - cache_age)
+            return data
         except Exception as e:
             print(f"Coudn't validate MojangData from cache: {e}")
 
     raise exceptions.InvalidCache()
 
 
+def get_minecraft_cache(search_term: str, session: Session) -> MojangData:
+    """Gets cache from either uuid or username, checking memory before Postgres"""
+    if search_term is None:
+        raise exceptions.InvalidCache()
+
+    data = get_minecraft_memory_cache(search_term)
+    if data is not None:
+        return data
+
+    query, params = _cache_lookup(search_term)
+    return _parse_cache_row(session.execute(query, params).fetchone())
+
+
+async def get_minecraft_cache_async(
+    search_term: str, session: AsyncSession
+) -> MojangData:
+    if search_term is None:
+        raise exceptions.InvalidCache()
+
+    data = get_minecraft_memory_cache(search_term)
+    if data is not None:
+        return data
+
+    query, params = _cache_lookup(search_term)
+    return _parse_cache_row((await session.execute(query, params)).fetchone())
+
+
+def _upsert_params(uuid: str, data: MojangData) -> dict:
+    return {
+        "uuid": uuid,
+        "data": data.model_dump_json(exclude={"source"}),
+        "username_lower": data.username.lower(),
+    }
+
+
+def _release_params(upsert_params: dict) -> dict:
+    return {
+        "uuid": upsert_params["uuid"],
+        "username_lower": upsert_params["username_lower"],
+    }
+
+
+def _after_cache_write(uuid: str, data: MojangData) -> None:
+    set_minecraft_memory_cache(data)  # write through
+    # the player exists now, so earlier not found answers for it are wrong
+    negative_cache.invalidate("mojang", uuid)
+    negative_cache.invalidate("mojang", data.username)
+
+
 def add_to_minecraft_cache(uuid: str, data: MojangData, session: Session):
     if data.source == "mojang_api":
-        session.execute(
-            text(
-                """
-                INSERT INTO minecraft_cache (uuid, data, timestamp) 
-                VALUES (:uuid, :data, NOW())
-                ON CONFLICT (uuid)
-                DO UPDATE SET 
-                    data = EXCLUDED.data,
-                    timestamp = NOW()
-                """
-            ),
-            {"uuid": uuid, "data": data.model_dump_json(exclude={"source"})},
-        )
+        params = _upsert_params(uuid, data)
+        session.execute(RELEASE_USERNAME_QUERY, _release_params(params))
+        session.execute(UPSERT_QUERY, params)
         session.commit()
+        _after_cache_write(uuid, data)
+
+
+async def add_to_minecraft_cache_async(
+    uuid: str, data: MojangData, session: AsyncSession
+):
+    if data.source == "mojang_api":
+        params = _upsert_params(uuid, data)
+        await session.execute(RELEASE_USERNAME_QUERY, _release_params(params))
+        await session.execute(UPSERT_QUERY, params)
+        await session.commit()
+        _after_cache_write(uuid, data)
 
 
+@traced()
 def bulk_get_usernames_cache(
-    uuids: list[str], session: Session
-) -> Tuple[List[Dict[str, str]], List[str]]:
+    uuids: List[str], session: Session
+) -> Tuple[Dict[str, Dict[str, str]], List[str]]:
+    """
+    Cached usernames and faces of uuids, returns the rows by uuid and the uuids
+    that aren't cached, in the order they were given
+    """
+    if not uuids:
+        return {}, []
     cache_data = session.execute(
         text(
             "SELECT uuid, data->>'username' as username, data->>'skin_showcase_b64' as skin_showcase_b64 FROM minecraft_cache WHERE uuid IN :uuids;"
         ).bindparams(bindparam("uuids", expanding=True)),
         {"uuids": uuids},
     ).fetchall()
-    resolved_results = []
-    unsolved_uuids = uuids.copy()
+    resolved_results = {}
     for row in cache_data:
         uuid = str(row.uuid).replace("-", "")
-        resolved_results.append(
-            {
-                "uuid": uuid,
-                "username": row.username,
-                "skin_showcase_b64": row.skin_showcase_b64,
-            }
-        )
-        unsolved_uuids.remove(uuid)
+        resolved_results[uuid] = {
+            "uuid": uuid,
+            "username": row.username,
+            "skin_showcase_b64": row.skin_showcase_b64,
+        }
+    unsolved_uuids = [uuid for uuid in uuids if uuid not in resolved_results]
     return resolved_results, unsolved_uuids
+
+
+def init_minecraft_cache() -> None:
+    """
+    Adds the indexed username_lower column to minecraft_cache. Existing rows are
+    backfilled only when the column is added, later NULLs are usernames released
+    by RELEASE_USERNAME_QUERY and must stay NULL.
+    """
+    with SessionLocal() as session:
+        column_exists = session.execute(
+            text(
+                """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'minecraft_cache' AND column_name = 'username_lower'
+                """
+            )
+        ).first()
+        if column_exists is None:
+            session.execute(
+                text(
+                    "ALTER TABLE minecraft_cache ADD COLUMN IF NOT EXISTS username_lower TEXT;"
+                )
+            )
+            session.execute(
+                text(
+                    """
+                    UPDATE minecraft_cache SET username_lower = LOWER(data->>'username')
+                    WHERE data->>'username' IS NOT NULL;
+                    """
+                )
+            )
+        session.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS minecraft_cache_username_lower_idx
+                ON minecraft_cache (username_lower);
+                """
+            )
+        )
+        session.commit()
+    print("minecraft_cache username index initialized.")
+
+
+if __name__ == "__main__":
+    init_minecraft_cache()
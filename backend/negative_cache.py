@@ -0,0 +1,39 @@
+from memory_cache import LRUCache
+
+# in seconds, how long a "not found" answer is remembered per provider
+NEGATIVE_TTLS = {
+    "mojang": 300,
+    "hypixel": 120,
+    "hypixel_guild": 120,
+    "wynncraft": 120,
+    "donutsmp": 120,
+    "mcci": 120,
+}
+DEFAULT_NEGATIVE_TTL = 60
+MAX_ENTRIES = 50000
+
+
+class NegativeCache:
+    """
+    Remembers lookups that came back as not found so repeats (typos, bots) don't hit
+    the upstream again until the entry expires or a positive result invalidates it
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self._entries = LRUCache("negative", max_entries, DEFAULT_NEGATIVE_TTL)
+
+    def contains(self, provider: str, key: str) -> bool:
+        return self._entries.get((provider, key.lower())) is not None
+
+    def add(self, provider: str, key: str) -> None:
+        ttl = NEGATIVE_TTLS.get(provider, DEFAULT_NEGATIVE_TTL)
+        self._entries.set((provider, key.lower()), True, ttl)
+
+    def invalidate(self, provider: str, key: str) -> None:
+        self._entries.delete((provider, key.lower()))
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+negative_cache = NegativeCache()
@@ -1,21 +1,23 @@
 import asyncio
-import aiohttp
+import httpx
 import logging
 from dotenv import load_dotenv
 from utils import dashify_uuid
+from http_client import get_async_client
+from rate_limiter import limiters
 
 load_dotenv()
 
 logger = logging.Logger(__name__)
 
 async def get_online_status(uuid: str, hypixel_api_key: str):
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            get_wynncraft_status(session, uuid),
-            get_hypixel_status(session, uuid, hypixel_api_key)
-        ]
+    client = get_async_client()
+    tasks = [
+        get_wynncraft_status(client, uuid),
+        get_hypixel_status(client, uuid, hypixel_api_key)
+    ]
 
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
 
     wynncraft_status = False
     hypixel_status = False
@@ -46,24 +48,28 @@ async def get_online_status(uuid: str, hypixel_api_key: str):
     else:
         return {"status": "Offline"}
     
-async def get_wynncraft_status(session: aiohttp.ClientSession, uuid: str):
+async def get_wynncraft_status(client: httpx.AsyncClient, uuid: str):
     dashed_uuid = dashify_uuid(uuid)
     try:
-        async with session.get(f"https://api.wynncraft.com/v3/player/{dashed_uuid}") as response:
-            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-            return await response.json()
+        await limiters["wynncraft"].acquire_async()
+        response = await client.get(f"https://api.wynncraft.com/v3/player/{dashed_uuid}")
+        limiters["wynncraft"].update(response)
+        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+        return response.json()
     except Exception as e:
         logger.error(f"Wynncraft API request failed for {dashed_uuid}: {e}")
         # Re-raise the exception so asyncio.gather can catch it
         raise
 
-async def get_hypixel_status(session: aiohttp.ClientSession, uuid: str, api_key: str):
+async def get_hypixel_status(client: httpx.AsyncClient, uuid: str, api_key: str):
     try:
         headers = {"API-Key": api_key}
         params = {"uuid": uuid}
-        async with session.get("https://api.hypixel.net/v2/status", params=params, headers=headers) as response:
-            response.raise_for_status()
-            return await response.json()
+        await limiters["hypixel"].acquire_async()
+        response = await client.get("https://api.hypixel.net/v2/status", params=params, headers=headers)
+        limiters["hypixel"].update(response)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         logger.error(f"Hypixel status API request failed for {uuid}: {e}")
         raise
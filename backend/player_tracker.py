@@ -1,12 +1,13 @@
 import asyncio
 from typing import Dict, Set, Optional
 from pydantic import BaseModel
-import aiohttp
 import os
 from dotenv import load_dotenv
 from utils import dashify_uuid
 import exceptions
 from fastapi import HTTPException
+from http_client import get_async_client
+from rate_limiter import limiters
 
 load_dotenv()
 
@@ -123,12 +124,12 @@ def unsubscribe(uuid: str, queue: asyncio.Queue):
 
 async def get_status(uuid) -> PlayerStatus:
     print(f"ignored sources: {ignored_sources[uuid]}")
-    async with aiohttp.ClientSession() as session:
-        results = await asyncio.gather(
-            get_wynncraft_status(session, uuid),
-            get_hypixel_status(session, uuid),
-            return_exceptions=True,
-        )
+    client = get_async_client()
+    results = await asyncio.gather(
+        get_wynncraft_status(client, uuid),
+        get_hypixel_status(client, uuid),
+        return_exceptions=True,
+    )
     wynncraft_response = results[0]
     hypixel_response = results[1]
 
@@ -199,38 +200,42 @@ async def get_status(uuid) -> PlayerStatus:
     return player_status
 
 
-async def get_wynncraft_status(session, uuid):
+async def get_wynncraft_status(client, uuid):
     if "wynncraft" in ignored_sources[uuid]:
         print("wynncraft is ignored, passing")
         return None
     dashed_uuid = dashify_uuid(uuid)
-    async with session.get(
+    await limiters["wynncraft"].acquire_async()
+    response = await client.get(
         f"https://api.wynncraft.com/v3/player/{dashed_uuid}",
         headers={"Authorization": f"Bearer {wynn_token}"},
-    ) as response:
-        if response.status == 404:
-            raise exceptions.NotFound()
-        response.raise_for_status()
-        response: dict = await response.json()
-        return response
+    )
+    limiters["wynncraft"].update(response)
+    if response.status_code == 404:
+        raise exceptions.NotFound()
+    response.raise_for_status()
+    response_data: dict = response.json()
+    return response_data
 
 
-async def get_hypixel_status(session, uuid):
+async def get_hypixel_status(client, uuid):
     if "hypixel" in ignored_sources[uuid]:
         return None
     headers = {"API-Key": hypixel_api_key}
     params = {"uuid": uuid}
-    async with session.get(
+    await limiters["hypixel"].acquire_async()
+    response = await client.get(
         "https://api.hypixel.net/v2/status", params=params, headers=headers
-    ) as response:
-        if (
-            response.status == 404
-        ):  # this doesn't ever return 404, TODO implement returning it manually
-            raise exceptions.NotFound()
-        if response.status == 429:
-            raise exceptions.UpstreamError()
-        response.raise_for_status()
-        return await response.json()
+    )
+    limiters["hypixel"].update(response)
+    if (
+        response.status_code == 404
+    ):  # this doesn't ever return 404, TODO implement returning it manually
+        raise exceptions.NotFound()
+    if response.status_code == 429:
+        raise exceptions.UpstreamError()
+    response.raise_for_status()
+    return response.json()
 
 
 if __name__ == "__main__":
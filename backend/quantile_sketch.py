@@ -0,0 +1,127 @@
+import math
+from typing import Dict, Optional
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class DDSketch:
+    """
+    Mergeable quantile sketch with a bounded relative error (DDSketch)
+
+    Values are counted in logarithmic buckets, each bucket covers values within
+    relative_accuracy of each other, so any quantile returned is within that relative
+    error of the exact one. Unlike t-digest or KLL, counts can be removed again,
+    which lets metric upserts replace a player's previous value.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.ln_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}  # keyed by the index of abs(value)
+        self.zero_count = 0
+        self.count = 0
+
+    def key(self, value: float) -> int:
+        """Bucket index of abs(value), must match the index computed in SQL"""
+        return math.ceil(math.log(abs(value)) / self.ln_gamma)
+
+    def bucket_value(self, key: int) -> float:
+        """Representative value of a bucket, within relative_accuracy of all its values"""
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value == 0:
+            self.zero_count += count
+        else:
+            store = self.positive if value > 0 else self.negative
+            key = self.key(value)
+            store[key] = store.get(key, 0) + count
+        self.count += count
+
+    def remove(self, value: float) -> None:
+        if value == 0:
+            if self.zero_count == 0:
+                return
+            self.zero_count -= 1
+        else:
+            store = self.positive if value > 0 else self.negative
+            key = self.key(value)
+            if store.get(key, 0) == 0:
+                return  # never counted, e.g. added by another process
+            store[key] -= 1
+            if store[key] == 0:
+                del store[key]
+        self.count -= 1
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("can only merge sketches with the same relative accuracy")
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def rank(self, value: float) -> float:
+        """Approximate fraction of values at or below value"""
+        if self.count == 0:
+            return 0.0
+
+        if value < 0:
+            key = self.key(value)
+            below = sum(c for k, c in self.negative.items() if k >= key)
+        else:
+            below = sum(self.negative.values()) + self.zero_count
+            if value > 0:
+                key = self.key(value)
+                below += sum(c for k, c in self.positive.items() if k <= key)
+        return below / self.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate value at quantile q (0 to 1), None if the sketch is empty"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self.bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self.bucket_value(key)
+        return self.bucket_value(max(self.positive))
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "positive": self.positive,
+            "negative": self.negative,
+            "zero_count": self.zero_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DDSketch":
+        sketch = cls(data["relative_accuracy"])
+        # json turns the integer bucket keys into strings
+        for key, count in data["positive"].items():
+            sketch.add_bucket(int(key), count, positive=True)
+        for key, count in data["negative"].items():
+            sketch.add_bucket(int(key), count, positive=False)
+        sketch.zero_count = data["zero_count"]
+        sketch.count += sketch.zero_count
+        return sketch
+
+    def add_bucket(self, key: int, count: int, positive: bool = True) -> None:
+        """Adds count values to a bucket by index, used when loading aggregated counts"""
+        store = self.positive if positive else self.negative
+        store[key] = store.get(key, 0) + count
+        self.count += count
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict
+import exceptions
+
+logger = logging.getLogger(__name__)
+
+# if a request would have to wait longer than this we fail it instead of holding the worker
+MAX_WAIT = 5  # in seconds
+
+
+class TokenBucket:
+    """
+    Client side limiter for a single upstream provider
+
+    The bucket refills at `rate` tokens per second up to `capacity`. When the upstream
+    sends RateLimit-Remaining / RateLimit-Reset headers the refill rate is lowered so the
+    remaining quota is spread over the rest of the window, and a 429 with Retry-After
+    blocks the bucket until the upstream is ready again.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: int):
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.rejected = 0
+        self.paced = 0  # requests that had to wait for a token
+        self.paced_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self) -> float:
+        """Takes a token and returns how many seconds the caller has to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            wait = max(0.0, self.blocked_until - now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+
+            if wait > MAX_WAIT:
+                self.rejected += 1
+                logger.warning(
+                    f"{self.name} rate limit reached, rejecting request (wait {wait:.1f}s)"
+                )
+                raise exceptions.UpstreamRateLimitError()
+
+            self.tokens -= 1
+            if wait > 0:
+                self.paced += 1
+                self.paced_seconds += wait
+            return wait
+
+    def acquire(self) -> None:
+        """Blocks the current thread until a request can be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Waits on the event loop until a request can be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def update(self, response) -> None:
+        """
+        Reads the quota headers of a response, works with both requests and httpx responses
+        """
+        headers = response.headers
+        now = time.monotonic()
+        with self._lock:
+            self._refill(now)
+
+            remaining = _parse_number(headers.get("RateLimit-Remaining"))
+            reset = _parse_number(headers.get("RateLimit-Reset"))
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if reset is not None and reset > 0:
+                    # spread what's left of the window evenly instead of bursting through it
+                    self.rate = min(self.base_rate, max(remaining, 1) / reset)
+                else:
+                    self.rate = self.base_rate
+
+            retry_after = _parse_number(headers.get("Retry-After"))
+            if response.status_code == 429:
+                if retry_after is None:
+                    retry_after = reset if reset is not None else 1
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.tokens = min(self.tokens, 0)
+                logger.warning(f"{self.name} returned 429, pausing for {retry_after}s")
+
+    def stats(self) -> dict:
+        return {
+            "tokens": round(self.tokens, 2),
+            "rate": round(self.rate, 3),
+            "capacity": self.capacity,
+            "rejected": self.rejected,
+            "paced": self.paced,
+            "paced_seconds": round(self.paced_seconds, 3),
+        }
+
+
+def _parse_number(value) -> float | None:
+    if not isinstance(value, (str, int, float)):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# rate is in requests per second, capacity is the allowed burst
+limiters: Dict[str, TokenBucket] = {
+    "hypixel": TokenBucket("hypixel", rate=1, capacity=30),  # 300 per 5 minutes per key
+    "wynncraft": TokenBucket("wynncraft", rate=2.5, capacity=50),
+    "mojang": TokenBucket("mojang", rate=10, capacity=60),
+    "mcci": TokenBucket("mcci", rate=1, capacity=20),
+    "donutsmp": TokenBucket("donutsmp", rate=4, capacity=40),
+    "capes_me": TokenBucket("capes_me", rate=2, capacity=20),
+}
+
+
+def get_limiter_stats() -> Dict[str, dict]:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
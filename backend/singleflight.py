@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+def flight_key(provider: str, id: str) -> tuple:
+    """
+    Canonical key for an id, dashed and undashed uuids and usernames in any case
+    share one flight
+    """
+    return (provider, str(id).replace("-", "").lower())
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Makes concurrent callers asking for the same key share one upstream fetch
+
+    Keys are tuples of (provider, canonical id). The first caller for a key does the
+    fetch, everyone arriving while it's in flight waits and gets the same result, or
+    the same exception. Sync callers (threads) and async callers (event loop) are
+    tracked separately since they can't wait on each other.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, key: Hashable, coalesced: bool) -> None:
+        provider = key[0] if isinstance(key, tuple) else str(key)
+        stats = self._stats.setdefault(provider, {"calls": 0, "coalesced": 0})
+        stats["calls"] += 1
+        if coalesced:
+            stats["coalesced"] += 1
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        """Runs fn(*args) unless a call for key is already running in another thread"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            self._count(key, coalesced=not leader)
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        """
+        Awaits fn(*args) unless a call for key is already in flight
+
+        The fetch runs in its own task so a caller disconnecting doesn't cancel it
+        for everyone else waiting on it
+        """
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        with self._lock:
+            self._count(key, coalesced=not leader)
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved even if every waiter went away
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {provider: dict(counts) for provider, counts in self._stats.items()}
+
+
+# shared by every manager so the counters end up in one place
+flights = SingleFlight()
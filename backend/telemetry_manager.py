@@ -1,6 +1,32 @@
-from metrics_manager import get_engine, text
-from sqlalchemy.orm import Session
-from db import SessionLocal
+import json
+import os
+import random
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from db import get_engine
+
+# events are written once FLUSH_ROWS are buffered or FLUSH_INTERVAL seconds passed
+FLUSH_ROWS = 500
+FLUSH_INTERVAL = 2.0
+BUFFER_SIZE = 50000
+
+
+def parse_sample_rates(value: Optional[str]) -> Dict[str, float]:
+    """Parses "/v1/players=0.5,/v1/metrics=0.1" into a path prefix -> rate dict"""
+    rates = {}
+    for entry in (value or "").split(","):
+        if "=" not in entry:
+            continue
+        prefix, rate = entry.split("=", 1)
+        rates[prefix.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+# share of requests recorded per path prefix, the longest matching prefix wins
+SAMPLE_RATES: Dict[str, float] = parse_sample_rates(os.getenv("TELEMETRY_SAMPLE_RATES"))
+DEFAULT_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", 1.0))
 
 
 def init_telemetry_manager() -> None:
@@ -24,33 +50,187 @@ def init_telemetry_manager() -> None:
     print("Telemetry manager initialized.")
 
 
-async def add_telemetry_event(
-    path: str,
-    provider: str,
-    latency_ms: int,
-    status_code: int | None = None,
-    cache_hit: bool | None = None,
-    properties: dict | None = None,
+class TelemetryExporter:
+    """
+    Buffers telemetry events in memory and writes them from a background thread
 
-) -> None:
-    with SessionLocal() as session:
-        session.execute(
-            text(
-                """
-                INSERT INTO telemetry_events (path, provider, status_code, latency_ms, cache_hit, properties)
-                VALUES (:path, :provider, :status_code, :latency_ms, :cache_hit, :properties);
-                """
-            ),
+    Requests only append to a bounded deque, which is atomic and never blocks. When
+    the buffer is full the oldest event is overwritten and counted as dropped. The
+    flusher thread drains the buffer in multi-row inserts.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = BUFFER_SIZE,
+        flush_rows: int = FLUSH_ROWS,
+        flush_interval: float = FLUSH_INTERVAL,
+        sample_rates: Optional[Dict[str, float]] = None,
+        default_sample_rate: float = DEFAULT_SAMPLE_RATE,
+    ):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.sample_rates = SAMPLE_RATES if sample_rates is None else sample_rates
+        self.default_sample_rate = default_sample_rate
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()  # one batch is written at a time
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.recorded = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.failed = 0
+        self.written = 0
+        self.batches = 0
+
+    def sample_rate(self, path: str) -> float:
+        match = None
+        for prefix in self.sample_rates:
+            if path.startswith(prefix) and (match is None or len(prefix) > len(match)):
+                match = prefix
+        return self.default_sample_rate if match is None else self.sample_rates[match]
+
+    def record(
+        self,
+        path: str,
+        provider: str,
+        latency_ms: int,
+        status_code: int | None = None,
+        cache_hit: bool | None = None,
+        properties: dict | None = None,
+    ) -> bool:
+        """Queues an event, returns False if it was sampled out"""
+        rate = self.sample_rate(path)
+        # server errors are always kept, they are rare and the ones worth looking at
+        if (status_code is None or status_code < 500) and rate < 1.0:
+            if random.random() >= rate:
+                self.sampled_out += 1
+                return False
+            # lets queries weight sampled rows back up to the real request count
+            properties = {**(properties or {}), "sample_rate": rate}
+
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1  # the append below overwrites the oldest event
+        self._buffer.append(
             {
                 "path": path,
                 "provider": provider,
                 "status_code": status_code,
                 "latency_ms": latency_ms,
                 "cache_hit": cache_hit,
-                "properties": properties,
-            },
+                "properties": json.dumps(properties or {}),
+            }
         )
-        session.commit()
+        self.recorded += 1
+        self._ensure_started()
+        if len(self._buffer) >= self.flush_rows:
+            self._wakeup.set()
+        return True
+
+    def flush(self) -> int:
+        """Writes everything buffered, returns the number of events written"""
+        written = 0
+        with self._flush_lock:
+            while self._buffer:
+                batch = self._take(self.flush_rows)
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # telemetry is best effort, a failed batch is not retried
+                    print(f"telemetry exporter failed to write {len(batch)} events: {e}")
+                    self.failed += len(batch)
+                    break
+                written += len(batch)
+                self.written += len(batch)
+                self.batches += 1
+        return written
+
+    def close(self) -> None:
+        """Stops the background thread and writes what is still buffered"""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "written": self.written,
+            "batches": self.batches,
+        }
+
+    def _take(self, limit: int) -> List[dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._buffer.popleft())
+            except IndexError:
+                break
+        return batch
+
+    def _ensure_started(self) -> None:
+        if self._thread is None and not self._closed:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="telemetry-exporter", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            self.flush()
+
+    def _write(self, batch: List[dict]) -> None:
+        params = {}
+        rows = []
+        for i, event in enumerate(batch):
+            for column, value in event.items():
+                params[f"{column}{i}"] = value
+            rows.append(
+                f"(:path{i}, :provider{i}, :status_code{i}, :latency_ms{i}, "
+                f":cache_hit{i}, CAST(:properties{i} AS JSONB))"
+            )
+
+        engine = get_engine()
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"""
+                    INSERT INTO telemetry_events (path, provider, status_code, latency_ms, cache_hit, properties)
+                    VALUES {", ".join(rows)}
+                    """
+                ),
+                params,
+            )
+
+
+telemetry_exporter = TelemetryExporter()
+
+
+def add_telemetry_event(
+    path: str,
+    provider: str,
+    latency_ms: int,
+    status_code: int | None = None,
+    cache_hit: bool | None = None,
+    properties: dict | None = None,
+) -> bool:
+    """Queues an event for the background exporter, never blocks the caller"""
+    return telemetry_exporter.record(
+        path, provider, latency_ms, status_code, cache_hit, properties
+    )
+
 
 if __name__ == "__main__":
     init_telemetry_manager()
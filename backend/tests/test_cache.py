@@ -0,0 +1,68 @@
+from unittest.mock import patch
+
+from pydantic import BaseModel
+
+import cache
+from cache import CacheNamespace, NamespaceConfig, SQLiteBackend
+
+
+class Item(BaseModel):
+    name: str
+    count: int
+
+
+def test_memory_namespace_get_set_invalidate():
+    items = CacheNamespace("test_memory_ns", NamespaceConfig(ttl=60), Item)
+    items.set("a", Item(name="a", count=1))
+
+    assert items.get("a") == Item(name="a", count=1)
+    assert items.get_many(["a", "b"]) == {"a": Item(name="a", count=1)}
+
+    items.invalidate("a")
+    assert items.get("a") is None
+
+
+def test_sqlite_namespace_falls_through_to_backend(tmp_path, monkeypatch):
+    monkeypatch.setitem(cache.backends, "sqlite", SQLiteBackend(tmp_path / "cache.db"))
+    config = NamespaceConfig(ttl=60, backend="sqlite", memory_ttl=10)
+    items = CacheNamespace("test_sqlite_ns", config, list[Item])
+    items.set("a", [Item(name="a", count=1)])
+    items.set("b", [Item(name="b", count=2)])
+
+    items.memory.clear()  # simulates another process or a restart
+    assert items.get_many(["a", "b", "c"]) == {
+        "a": [Item(name="a", count=1)],
+        "b": [Item(name="b", count=2)],
+    }
+    assert len(items.memory) == 2
+
+    items.invalidate("a")
+    items.memory.clear()
+    assert items.get("a") is None
+    assert items.get("b") == [Item(name="b", count=2)]
+
+
+def test_sqlite_backend_sweeps_expired_rows(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.db")
+    backend.set("ns", "old", "1", ttl=-1)
+    backend.set("ns", "live", "2", ttl=60)  # swept rows stay until the next sweep
+    backend._next_sweep = 0.0
+    backend.set("ns", "new", "3", ttl=60)
+
+    keys = [row[0] for row in backend.conn.execute("SELECT key FROM cache_entries")]
+    assert sorted(keys) == ["live", "new"]
+
+
+def test_backend_values_dont_outlive_their_ttl_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setitem(cache.backends, "sqlite", SQLiteBackend(tmp_path / "cache.db"))
+    config = NamespaceConfig(ttl=600, backend="sqlite", memory_ttl=300)
+    items = CacheNamespace("test_remaining_ttl_ns", config, Item)
+    items.set("soon", Item(name="soon", count=1), ttl=5)
+    items.set("later", Item(name="later", count=2))
+    items.memory.clear()
+
+    with patch("memory_cache.time.monotonic", return_value=1000.0):
+        assert len(items.get_many(["soon", "later"])) == 2
+    with patch("memory_cache.time.monotonic", return_value=1010.0):
+        assert items.memory.get("soon") is None
+        assert items.memory.get("later") == Item(name="later", count=2)
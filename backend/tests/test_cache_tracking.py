@@ -0,0 +1,36 @@
+from cache import CacheNamespace, NamespaceConfig
+from cache_tracking import (
+    HIT,
+    MISS,
+    NEGATIVE,
+    STALE,
+    end_request,
+    record_cache,
+    start_request,
+    summarize,
+)
+
+
+def test_request_collects_namespace_lookups():
+    items = CacheNamespace("test_tracked_ns", NamespaceConfig(ttl=60), int)
+    items.set("a", 1)
+
+    token = start_request()
+    items.get_many(["a", "b"])
+    record_cache("minecraft", STALE)
+    lookups = end_request(token)
+
+    assert lookups == [("test_tracked_ns", HIT), ("test_tracked_ns", MISS), ("minecraft", STALE)]
+    record_cache("minecraft", HIT)  # outside of a request nothing is collected
+    assert lookups[-1] == ("minecraft", STALE)
+
+
+def test_summarize_counts_upstream_calls_as_misses():
+    assert summarize([]) == (None, {})
+    assert summarize([("hypixel", STALE), ("hypixel_guild", NEGATIVE)]) == (
+        True,
+        {"hypixel": {STALE: 1}, "hypixel_guild": {NEGATIVE: 1}},
+    )
+    cache_hit, summary = summarize([("minecraft", HIT), ("minecraft", MISS)])
+    assert cache_hit is False
+    assert summary == {"minecraft": {HIT: 1, MISS: 1}}
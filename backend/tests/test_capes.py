@@ -0,0 +1,61 @@
+import io
+import asyncio
+
+from PIL import Image
+
+import capes
+import texture_cache
+from cache import CacheNamespace, NamespaceConfig
+from capes import GenericCapeData, get_cape_index, get_cape_images_many, texture_hash
+
+
+def _cape_png() -> bytes:
+    cape = Image.new("RGBA", (64, 32), (0, 255, 0, 255))
+    buffer = io.BytesIO()
+    cape.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _catalog() -> list:
+    return [
+        GenericCapeData(type="migrator", name="Migrator", url="https://example.com/m", removed=False),
+        GenericCapeData(type="vanilla", name="Vanilla", url="https://example.com/v", removed=False),
+    ]
+
+
+def test_cape_index_is_kept_until_the_catalog_changes():
+    catalog = _catalog()
+    index = get_cape_index(catalog)
+    assert index["vanilla"].name == "Vanilla"
+    assert get_cape_index(catalog) is index
+    assert get_cape_index(_catalog()) is not index
+
+
+def test_cape_images_are_fetched_in_one_batch(monkeypatch):
+    renders = CacheNamespace("test_cape_renders", NamespaceConfig(ttl=60), dict)
+    monkeypatch.setattr(texture_cache, "texture_renders", renders)
+    cached_url = "https://example.com/cached"
+    renders.set(texture_hash(cached_url), {"front": "f", "back": "b"})
+
+    downloaded = []
+
+    def download(url):
+        downloaded.append(url)
+        return _cape_png()
+
+    async def download_async(url):
+        return download(url)
+
+    monkeypatch.setattr(capes, "_download_cape", download)
+    monkeypatch.setattr(capes, "_download_cape_async", download_async)
+    urls = [cached_url, "https://example.com/a", "https://example.com/b", "https://example.com/a"]
+
+    images = get_cape_images_many(urls)
+    assert images[cached_url].front_b64 == "f"
+    assert images["https://example.com/a"].front_b64 is not None
+    assert sorted(downloaded) == ["https://example.com/a", "https://example.com/b"]
+
+    # the downloaded capes are cached now
+    downloaded.clear()
+    assert asyncio.run(capes.get_cape_images_many_async(urls)) == images
+    assert downloaded == []
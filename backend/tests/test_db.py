@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from db import TimedQueuePool
+
+
+def test_timed_pool_records_checkouts():
+    engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1)
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    stats = engine.pool.wait_stats.stats()
+    assert stats["checkouts"] == 3
+    assert stats["timeouts"] == 0
+    assert stats["max_wait_ms"] >= stats["avg_wait_ms"] >= 0
+
+
+def test_timed_pool_counts_only_checkout_timeouts():
+    engine = create_engine(
+        "sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.01
+    )
+    with engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+    assert engine.pool.wait_stats.stats()["timeouts"] == 1
+
+    def refuse():
+        raise sqlite3.OperationalError("connection refused")
+
+    broken = create_engine("sqlite://", poolclass=TimedQueuePool, creator=refuse)
+    with pytest.raises(exc.OperationalError):
+        broken.connect()
+    assert broken.pool.wait_stats.stats() == {
+        "checkouts": 0,
+        "timeouts": 0,
+        "avg_wait_ms": 0.0,
+        "max_wait_ms": 0.0,
+    }
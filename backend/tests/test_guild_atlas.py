@@ -0,0 +1,44 @@
+import base64
+import io
+
+from PIL import Image
+
+import guild_atlas
+import image_store
+from cache import CacheNamespace, NamespaceConfig
+from guild_atlas import TILE_SIZE, faces_digest, get_guild_atlas
+from hypixel_api import HypixelGuildMemberFull
+
+
+def _face(color) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (TILE_SIZE, TILE_SIZE), color).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _member(i, face) -> HypixelGuildMemberFull:
+    return HypixelGuildMemberFull(
+        username=f"player{i}", uuid=f"{i:032d}", rank="Member", joined="0", skin_showcase_b64=face
+    )
+
+
+def test_atlas_packs_faces_in_member_order(monkeypatch):
+    images = CacheNamespace("test_atlas_images", NamespaceConfig(ttl=60), str)
+    atlases = CacheNamespace("test_atlases", NamespaceConfig(ttl=60), guild_atlas.GuildAtlas)
+    monkeypatch.setattr(image_store, "image_store", images)
+    monkeypatch.setattr(guild_atlas, "guild_atlas_cache", atlases)
+    members = [_member(i, _face((i, 0, 0, 255))) for i in range(12)]
+    members[11] = _member(11, None)
+
+    atlas = get_guild_atlas("guild", members, 0, 20)
+    assert (atlas.columns, atlas.width, atlas.height) == (10, 80, 16)
+    assert [(m.x, m.y) for m in atlas.members][9:] == [(72, 0), (0, 8), (8, 8)]
+
+    digest = atlas.image_url.split("/")[-1].removesuffix(".png")
+    image = Image.open(io.BytesIO(base64.b64decode(images.get(digest))))
+    assert image.getpixel((8 * 3, 0)) == (3, 0, 0, 255)
+    assert image.getpixel((8, 8)) == (0, 0, 0, 0)  # member without a face
+
+    assert get_guild_atlas("guild", members, 0, 20) is atlas
+    changed = members[:1] + [_member(1, _face((9, 9, 9, 255)))] + members[2:]
+    assert faces_digest(changed) != faces_digest(members)
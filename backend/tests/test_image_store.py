@@ -0,0 +1,31 @@
+import asyncio
+import base64
+
+import image_store
+from cache import CacheNamespace, NamespaceConfig
+from capes import CAPE_IMAGE_FIELDS, CapeImageData
+from image_store import IMAGE_URL, image_hash, with_image_urls, with_image_urls_async
+
+
+def test_images_are_stored_by_content_hash(monkeypatch):
+    images = CacheNamespace("test_images", NamespaceConfig(ttl=60), str)
+    monkeypatch.setattr(image_store, "image_store", images)
+    front = base64.b64encode(b"front png").decode()
+    cape = CapeImageData(front_b64=front, back_b64=front)
+
+    base_url = "https://api.example.com/"
+    with_urls = with_image_urls(cape, CAPE_IMAGE_FIELDS, base_url)
+    assert with_urls.front_b64 is None and with_urls.back_b64 is None
+    assert with_urls.front_url == with_urls.back_url == (
+        "https://api.example.com" + IMAGE_URL.format(image_hash(b"front png"))
+    )
+    assert cape.front_b64 == front  # the cached model is left alone
+    assert len(images.memory) == 1
+
+    assert asyncio.run(image_store.get_image_async(image_hash(b"front png"))) == b"front png"
+    no_back = asyncio.run(
+        with_image_urls_async(
+            CapeImageData(front_b64=front, back_b64=None), CAPE_IMAGE_FIELDS, base_url
+        )
+    )
+    assert no_back.back_url is None
@@ -0,0 +1,31 @@
+from latency_metrics import LatencyMetric, LatencySummary, render_stats
+
+
+def test_summary_quantiles_follow_recent_window(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("latency_metrics.time.monotonic", lambda: now[0])
+    summary = LatencySummary(window=60)
+    for ms in range(1, 101):
+        summary.observe(ms / 1000)
+
+    count, total, quantiles = summary.snapshot()
+    assert count == 100
+    assert abs(total - 5.05) < 1e-9
+    assert abs(quantiles[0.5] - 0.050) < 0.050 * 0.02
+    assert abs(quantiles[0.99] - 0.099) < 0.099 * 0.02
+
+    now[0] = 200  # two idle windows later only the totals remain
+    count, _, quantiles = summary.snapshot()
+    assert count == 100
+    assert quantiles[0.5] is None
+
+
+def test_metric_renders_prometheus_text():
+    metric = LatencyMetric("test_seconds", "Test latency", ("route", "status"))
+    metric.observe(0.25, route='/v1/"x"', status=200)
+    lines = metric.render()
+
+    assert lines[:2] == ["# HELP test_seconds Test latency", "# TYPE test_seconds summary"]
+    assert 'test_seconds_count{route="/v1/\\"x\\"",status="200"} 1' in lines
+    assert any(line.startswith('test_seconds{route="/v1/\\"x\\"",status="200",quantile="0.5"}') for line in lines)
+    assert render_stats("test_stats", "Stats", {"dropped": 3})[-1] == 'test_stats{kind="dropped"} 3.0'
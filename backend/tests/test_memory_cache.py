@@ -0,0 +1,33 @@
+from unittest.mock import patch
+
+from memory_cache import LRUCache, get_cache_stats
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache("test_lru_evict", max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a is now the most recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_entries_expire():
+    cache = LRUCache("test_lru_expire", max_size=10, ttl=60)
+    with patch("memory_cache.time.monotonic", return_value=1000.0):
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=5)
+        cache.set("c", 3, ttl=0)  # non positive ttls aren't stored
+    with patch("memory_cache.time.monotonic", return_value=1010.0):
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") is None
+
+    stats = get_cache_stats()["test_lru_expire"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["expirations"] == 1
@@ -0,0 +1,38 @@
+from metric_writer import MetricWriter
+
+
+def test_writer_coalesces_and_bounds_queue(monkeypatch):
+    writer = MetricWriter(flush_rows=100, flush_interval=60, max_pending=2)
+    monkeypatch.setattr(writer, "_ensure_started", lambda: None)
+
+    assert writer.add("uuid-a", 1, 5)
+    assert writer.add("UUIDA", 1, 6)  # same player and metric, replaces the pending value
+    assert writer.add("uuid-b", 1, 7)
+    assert not writer.add("uuid-c", 1, 8)  # queue is full
+    assert not writer.add("uuid-d", 1, None)
+
+    stats = writer.stats()
+    assert stats["pending"] == 2
+    assert stats["dropped"] == 1
+
+
+def test_writer_flushes_batches_and_drops_unchanged(monkeypatch):
+    writer = MetricWriter(flush_rows=2, flush_interval=60)
+    monkeypatch.setattr(writer, "_ensure_started", lambda: None)
+    batches = []
+
+    def fake_write(batch):
+        batches.append(dict(batch))
+        for key, (_, value) in batch.items():
+            writer._last_written.set(key, value)
+        return len(batch)
+
+    monkeypatch.setattr(writer, "_write", fake_write)
+    writer.add_many("uuid", {1: 10, 2: 20, 3: 30})
+    assert writer.flush() == 3
+    assert [len(batch) for batch in batches] == [2, 1]
+
+    writer.add("uuid", 1, 10)  # same as the last written value
+    assert writer.stats()["unchanged"] == 1
+    writer.close()
+    assert len(batches) == 2
@@ -0,0 +1,82 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import metrics_manager
+from metrics_manager import log_bucket_edges
+
+
+def test_log_bucket_edges_span_bounds():
+    edges = log_bucket_edges(0, 999)
+    assert len(edges) == 7
+    assert edges[0] == 0
+    assert abs(edges[-1] - 999) < 1e-9
+    assert abs(edges[3] - (10**1.5 - 1)) < 1e-9
+
+
+
+@pytest.fixture
+def metrics_db(monkeypatch):
+    """
+    Empty metrics tables in a schema of their own, the snapshot and sketch
+    queries only run on postgres so this needs TEST_DATABASE_URL
+    """
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    schema = f"test_metrics_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    engine = create_engine(url, connect_args={"options": f"-csearch_path={schema}"})
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                CREATE TABLE metrics (
+                    id SERIAL PRIMARY KEY, key TEXT UNIQUE, unit TEXT,
+                    higher_is_better BOOLEAN, sketch JSONB
+                );
+                CREATE TABLE metric_values (
+                    player_uuid TEXT, metric_id INT, value DOUBLE PRECISION,
+                    PRIMARY KEY (player_uuid, metric_id)
+                );
+                """
+            )
+        )
+    monkeypatch.setattr(metrics_manager, "get_engine", lambda: engine)
+    monkeypatch.setattr(metrics_manager, "snapshots", {})
+    monkeypatch.setattr(metrics_manager, "sketches", {})
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin.dispose()
+
+
+def test_snapshot_query_counts_and_percentiles(metrics_db):
+    with metrics_db.begin() as conn:
+        metric_id = conn.execute(
+            text(
+                "INSERT INTO metrics (key, unit, higher_is_better) "
+                "VALUES ('hours', 'h', true) RETURNING id"
+            )
+        ).scalar()
+        conn.execute(
+            text("INSERT INTO metric_values VALUES (:u, :m, :v)"),
+            [{"u": f"player{v}", "m": metric_id, "v": v} for v in range(100)],
+        )
+
+    snapshot = metrics_manager.build_snapshot("hours")
+    assert (snapshot.metric_id, snapshot.unit, snapshot.higher_is_better) == (metric_id, "h", True)
+    assert (snapshot.sample_size, snapshot.min_value, snapshot.max_value) == (100, 0.0, 99.0)
+    # buckets are even on log10(value + 1), value 9 sits on an edge and goes down
+    assert snapshot.counts == [2, 2, 6, 11, 25, 54]
+    assert metrics_manager.build_snapshot("missing") is None
+
+    assert 49 <= metrics_manager.sketch_percentile(metric_id, 49) <= 51
+    assert metrics_manager.sketch_percentile(metric_id, 99) == 100.0
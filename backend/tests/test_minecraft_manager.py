@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import minecraft_manager
+from cache import CacheNamespace, NamespaceConfig
+from minecraft_api import MojangData
+from minecraft_manager import bulk_get_usernames_cache
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queried = []
+
+    def execute(self, query, params):
+        self.queried.append(params["uuids"])
+        return SimpleNamespace(fetchall=lambda: self.rows)
+
+
+def test_bulk_usernames_are_indexed_by_uuid_and_keep_the_order():
+    rows = [
+        SimpleNamespace(uuid="cccc-0003", username="c", skin_showcase_b64="face-c"),
+        SimpleNamespace(uuid="aaaa-0001", username="a", skin_showcase_b64="face-a"),
+    ]
+    session = FakeSession(rows)
+    uuids = ["aaaa0001", "bbbb0002", "cccc0003", "dddd0004"]
+
+    resolved, unsolved = bulk_get_usernames_cache(uuids, session)
+
+    assert resolved["cccc0003"] == {"uuid": "cccc0003", "username": "c", "skin_showcase_b64": "face-c"}
+    assert list(resolved) == ["cccc0003", "aaaa0001"]
+    assert unsolved == ["bbbb0002", "dddd0004"]
+    assert bulk_get_usernames_cache([], session) == ({}, [])
+    assert session.queried == [uuids]
+
+
+def test_memory_cache_matches_any_uuid_form(monkeypatch):
+    memory = CacheNamespace("test_minecraft_memory", NamespaceConfig(ttl=60), MojangData)
+    monkeypatch.setattr(minecraft_manager, "minecraft_memory_cache", memory)
+    data = MojangData(
+        username="GoSkyHigh",
+        uuid="3ff2e63ad63045e0b96f57cd0eae708d",
+        has_cape=False,
+        cape_name=None,
+        skin_url="http://textures.minecraft.net/texture/abc",
+        cape_url=None,
+        skin_showcase_b64="face",
+        cape_front_b64=None,
+        cape_back_b64=None,
+        source="mojang_api",
+    )
+    minecraft_manager.set_minecraft_memory_cache(data)
+
+    dashed = minecraft_manager.get_minecraft_memory_cache("3FF2E63A-D630-45E0-B96F-57CD0EAE708D")
+    assert dashed is not None and dashed.source == "cache"
+    assert minecraft_manager.get_minecraft_memory_cache("goskyhigh") == dashed
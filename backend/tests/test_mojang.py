@@ -1,13 +1,51 @@
 from unittest.mock import patch, MagicMock
 from fastapi import HTTPException
+import asyncio
+import httpx
+import pytest
+import requests
+import exceptions
+import texture_cache
+from cache import CacheNamespace, NamespaceConfig
 from minecraft_api import GetMojangAPIData, MojangData
+from rate_limiter import TokenBucket, limiters
 from pathlib import Path
 
 current_directory = Path(__file__).parent
 
 
-@patch("minecraft_api.requests.get")
-def test_mojang_data(mock_get):
+@pytest.fixture(autouse=True)
+def fresh_mojang_limiter(monkeypatch):
+    """A 429 pauses the mojang limiter, so every test gets its own"""
+    original = limiters["mojang"]
+    monkeypatch.setitem(
+        limiters,
+        "mojang",
+        TokenBucket("mojang", rate=original.base_rate, capacity=original.capacity),
+    )
+
+
+@pytest.fixture(autouse=True)
+def memory_texture_renders(monkeypatch):
+    """Keeps the renders out of the real sqlite cache"""
+    renders = CacheNamespace("test_mojang_renders", NamespaceConfig(ttl=60), dict)
+    monkeypatch.setattr(texture_cache, "texture_renders", renders)
+
+
+def _error_response(status_code: int, body: dict) -> MagicMock:
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {}
+    response.json.return_value = body
+    response.raise_for_status.side_effect = requests.HTTPError(
+        f"{status_code} error", response=response
+    )
+    return response
+
+
+@patch("minecraft_api.get_sync_session")
+def test_mojang_data(mock_session):
+    mock_get = mock_session.return_value.get
     fake_response_uuid = MagicMock()
     fake_response_uuid.json.return_value = {
         "id": "3ff2e63ad63045e0b96f57cd0eae708d",
@@ -59,8 +97,9 @@ def test_mojang_data(mock_get):
     )
 
 
-@patch("minecraft_api.requests.get")
-def test_mojang_no_cape(mock_get):
+@patch("minecraft_api.get_sync_session")
+def test_mojang_no_cape(mock_session):
+    mock_get = mock_session.return_value.get
     fake_response_uuid = MagicMock()
     fake_response_uuid.json.return_value = {
         "id": "3ff2e63ad63045e0b96f57cd0eae708d",
@@ -104,27 +143,57 @@ def test_mojang_no_cape(mock_get):
     assert mojang_data.cape_url == None
 
 
-@patch("minecraft_api.requests.get")
-def test_mojang_404(mock_get):
-    fake_response_uuid = MagicMock()
-    fake_response_uuid.status_code = 404
-    fake_response_uuid.json.return_value = {
-        "path": "/minecraft/profile/lookup/name/goskyhigh_",
-        "errorMessage": "Couldn't find any profile with name goskyhigh_",
-    }
-
-    mock_get.return_value = fake_response_uuid
+@patch("minecraft_api.get_sync_session")
+def test_mojang_404(mock_session):
+    mock_session.return_value.get.return_value = _error_response(
+        404,
+        {
+            "path": "/minecraft/profile/lookup/name/goskyhigh_",
+            "errorMessage": "Couldn't find any profile with name goskyhigh_",
+        },
+    )
     instance = GetMojangAPIData("goskyhigh_")
-    mojang_data = instance.get_data()
-    assert mojang_data is None
+    with pytest.raises(exceptions.NotFound):
+        instance.get_data()
 
-@patch("minecraft_api.requests.get")
-def test_mojang_429(mock_get):
-    fake_response_uuid = MagicMock()
-    fake_response_uuid.status_code = 429
-    fake_response_uuid.json.return_value = {'path': '/session/minecraft/profile/0000566aa28347c4940654afc438008b'}
 
-    mock_get.return_value = fake_response_uuid
+@patch("minecraft_api.get_sync_session")
+def test_mojang_429(mock_session):
+    mock_session.return_value.get.return_value = _error_response(
+        429, {"path": "/session/minecraft/profile/0000566aa28347c4940654afc438008b"}
+    )
     instance = GetMojangAPIData("goskyhigh")
-    mojang_data = instance.get_data()
-    assert mojang_data is None
+    with pytest.raises(exceptions.UpstreamError):
+        instance.get_data()
+
+
+@patch("minecraft_api.get_async_client")
+def test_mojang_data_async(mock_client):
+    with open(current_directory / "samples" / "mc_goskyhigh_skin_raw", "rb") as file:
+        skin_bytes = file.read()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "sessionserver.mojang.com":
+            return httpx.Response(
+                200,
+                json={
+                    "id": "3ff2e63ad63045e0b96f57cd0eae708d",
+                    "name": "GoSkyHigh",
+                    "properties": [
+                        {
+                            "name": "textures",
+                            "value": "ewogICJ0aW1lc3RhbXAiIDogMTc1NTI4MDY3NTIyNiwKICAicHJvZmlsZUlkIiA6ICIzZmYyZTYzYWQ2MzA0NWUwYjk2ZjU3Y2QwZWFlNzA4ZCIsCiAgInByb2ZpbGVOYW1lIiA6ICJHb1NreUhpZ2giLAogICJ0ZXh0dXJlcyIgOiB7CiAgICAiU0tJTiIgOiB7CiAgICAgICJ1cmwiIDogImh0dHA6Ly90ZXh0dXJlcy5taW5lY3JhZnQubmV0L3RleHR1cmUvZWY3NzM4MWEzYmY2ZjY5YzBjYWE0NWRkZDA3OTljODA1YjkyZDkwNDY0OTY2ZDk3MzU1ZGJmNjBkYzQ2ZTVjMyIKICAgIH0KICB9Cn0=",
+                        }
+                    ],
+                },
+            )
+        return httpx.Response(200, content=skin_bytes)
+
+    mock_client.return_value = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    instance = GetMojangAPIData(None, "3ff2e63ad63045e0b96f57cd0eae708d")
+    mojang_data = asyncio.run(instance.get_data_async())
+    assert isinstance(mojang_data, MojangData)
+    assert mojang_data.has_cape == False
+    assert mojang_data.username == "GoSkyHigh"
+    assert mojang_data.skin_showcase_b64 is not None
@@ -0,0 +1,52 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import wynncraft_api
+from cache import CacheNamespace, NamespaceConfig
+from exceptions import NotFound
+from negative_cache import NegativeCache
+
+
+def test_not_found_is_remembered():
+    cache = NegativeCache()
+    assert not cache.contains("mojang", "GoSkyHigh_")
+    cache.add("mojang", "GoSkyHigh_")
+    assert cache.contains("mojang", "goskyhigh_")  # keys are case insensitive
+    assert not cache.contains("hypixel", "goskyhigh_")
+
+
+def test_entries_expire():
+    cache = NegativeCache()
+    with patch("memory_cache.time.monotonic", return_value=1000):
+        cache.add("wynncraft", "abc")
+    with patch("memory_cache.time.monotonic", return_value=1000 + 121):
+        assert not cache.contains("wynncraft", "abc")
+
+
+def test_invalidate_and_size_bound():
+    cache = NegativeCache(max_entries=2)
+    cache.add("mcci", "a")
+    cache.add("mcci", "b")
+    cache.add("mcci", "c")
+    assert not cache.contains("mcci", "a")
+    cache.invalidate("mcci", "b")
+    assert not cache.contains("mcci", "b")
+    assert cache.contains("mcci", "c")
+
+
+def test_wynncraft_not_found_matches_any_uuid_form(monkeypatch):
+    cache = NegativeCache()
+    monkeypatch.setattr(wynncraft_api, "negative_cache", cache)
+    players = CacheNamespace("test_wynncraft_players", NamespaceConfig(ttl=60), dict)
+    monkeypatch.setattr(wynncraft_api, "player_cache", players)
+    response = MagicMock(status_code=404, headers={})
+    session = MagicMock()
+    session.get.return_value = response
+    monkeypatch.setattr(wynncraft_api, "get_sync_session", lambda: session)
+
+    with pytest.raises(NotFound):
+        wynncraft_api.GetWynncraftData().get_player_data("3ff2e63ad63045e0b96f57cd0eae708d")
+    with pytest.raises(NotFound):
+        wynncraft_api.GetWynncraftData().get_player_data("3FF2E63A-D630-45E0-B96F-57CD0EAE708D")
+    assert session.get.call_count == 1
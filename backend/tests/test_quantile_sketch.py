@@ -0,0 +1,45 @@
+import json
+import random
+
+from quantile_sketch import DDSketch
+
+
+def test_sketch_quantiles_within_relative_error():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(3, 2) for _ in range(10000)]
+    sketch = DDSketch(0.01)
+    for value in values:
+        sketch.add(value)
+
+    values.sort()
+    for q in (0.1, 0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact
+    assert abs(sketch.rank(values[5000]) - 0.5) < 0.02
+
+
+def test_sketch_remove_replaces_value():
+    sketch = DDSketch()
+    for value in (0, 1, 10, 100):
+        sketch.add(value)
+    sketch.remove(100)
+    sketch.add(5)
+
+    assert sketch.count == 4
+    assert sketch.rank(10) == 1.0
+    assert sketch.rank(0) == 0.25
+    sketch.remove(12345)  # values that were never added are ignored
+    assert sketch.count == 4
+
+
+def test_sketch_merge_and_roundtrip():
+    a, b = DDSketch(), DDSketch()
+    for value in range(1, 51):
+        a.add(value)
+        b.add(-value)
+    a.merge(b)
+
+    restored = DDSketch.from_dict(json.loads(json.dumps(a.to_dict())))
+    assert restored.count == 100
+    assert restored.rank(0) == 0.5
+    assert restored.quantile(0) < 0 < restored.quantile(1)
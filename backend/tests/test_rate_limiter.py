@@ -0,0 +1,50 @@
+from unittest.mock import MagicMock
+import pytest
+from rate_limiter import TokenBucket
+import exceptions
+
+
+def make_response(status_code=200, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def test_bucket_allows_burst():
+    bucket = TokenBucket("test", rate=1, capacity=3)
+    for _ in range(3):
+        assert bucket._reserve() == 0
+
+
+def test_bucket_paces_after_burst():
+    bucket = TokenBucket("test", rate=10, capacity=1)
+    assert bucket._reserve() == 0
+    wait = bucket._reserve()
+    assert 0 < wait <= 0.1
+
+
+def test_remaining_header_slows_rate():
+    bucket = TokenBucket("test", rate=5, capacity=50)
+    bucket.update(
+        make_response(headers={"RateLimit-Remaining": "10", "RateLimit-Reset": "100"})
+    )
+    assert bucket.tokens <= 10
+    assert bucket.rate == pytest.approx(0.1)
+
+
+def test_retry_after_rejects_requests():
+    bucket = TokenBucket("test", rate=5, capacity=50)
+    bucket.update(make_response(429, headers={"Retry-After": "300"}))
+    with pytest.raises(exceptions.UpstreamRateLimitError):
+        bucket._reserve()
+    assert bucket.rejected == 1
+
+
+def test_paced_requests_are_counted():
+    bucket = TokenBucket("test", rate=10, capacity=1)
+    bucket._reserve()
+    wait = bucket._reserve()
+    stats = bucket.stats()
+    assert stats["paced"] == 1
+    assert abs(stats["paced_seconds"] - round(wait, 3)) < 1e-9
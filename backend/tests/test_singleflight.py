@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+from singleflight import SingleFlight, flight_key
+import exceptions
+
+
+def test_sync_callers_share_one_fetch():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch(uuid):
+        calls.append(uuid)
+        time.sleep(0.1)
+        return uuid.upper()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(flight.do(("mojang", "abc"), fetch, "abc"))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["abc"]
+    assert results == ["ABC"] * 5
+    assert flight.stats()["mojang"] == {"calls": 5, "coalesced": 4}
+
+
+def test_async_callers_share_error():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch(uuid):
+        calls.append(uuid)
+        await asyncio.sleep(0.05)
+        raise exceptions.NotFound()
+
+    async def run():
+        return await asyncio.gather(
+            *[flight.do_async(("hypixel", "abc"), fetch, "abc") for _ in range(3)],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert calls == ["abc"]
+    assert all(isinstance(result, exceptions.NotFound) for result in results)
+    assert flight.stats()["hypixel"]["coalesced"] == 2
+
+
+def test_key_is_released_after_call():
+    flight = SingleFlight()
+    assert flight.do(("mojang", "a"), lambda: 1) == 1
+    assert flight.do(("mojang", "a"), lambda: 2) == 2
+
+
+def test_flight_key_matches_dashed_and_undashed_uuids():
+    dashed = flight_key("mojang", "3FF2E63A-D630-45E0-B96F-57CD0EAE708D")
+    assert dashed == flight_key("mojang", "3ff2e63ad63045e0b96f57cd0eae708d")
+    assert flight_key("mojang", "GoSkyHigh") == ("mojang", "goskyhigh")
@@ -0,0 +1,43 @@
+from telemetry_manager import TelemetryExporter, parse_sample_rates
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("/v1/players=0.5, /v1/metrics=2,bad") == {
+        "/v1/players": 0.5,
+        "/v1/metrics": 1.0,
+    }
+    assert parse_sample_rates(None) == {}
+
+
+def test_exporter_samples_by_longest_prefix():
+    exporter = TelemetryExporter(
+        sample_rates={"/v1": 0.0, "/v1/players": 1.0}, default_sample_rate=1.0
+    )
+    exporter._ensure_started = lambda: None
+
+    assert exporter.record("/v1/players/mojang/x", "x", 5, 200)
+    assert not exporter.record("/v1/metrics/1", "1", 5, 200)
+    assert exporter.record("/v1/metrics/1", "1", 5, 503)  # errors are always kept
+    assert exporter.record("/", "", 5, 200)
+
+    stats = exporter.stats()
+    assert stats["buffered"] == 3
+    assert stats["sampled_out"] == 1
+
+
+def test_exporter_overwrites_oldest_and_flushes_in_batches(monkeypatch):
+    exporter = TelemetryExporter(buffer_size=3, flush_rows=2, sample_rates={})
+    exporter._ensure_started = lambda: None
+    batches = []
+    monkeypatch.setattr(exporter, "_write", lambda batch: batches.append(batch))
+
+    for i in range(5):
+        exporter.record(f"/{i}", str(i), i, 200)
+    assert exporter.stats()["dropped"] == 2
+
+    assert exporter.flush() == 3
+    assert [[event["path"] for event in batch] for batch in batches] == [
+        ["/2", "/3"],
+        ["/4"],
+    ]
+    assert exporter.stats()["buffered"] == 0
@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import io
+import threading
+
+from PIL import Image
+
+import texture_cache
+from cache import CacheNamespace, NamespaceConfig
+from texture_cache import get_renders, render_texture, texture_hash
+
+
+def _skin_png() -> bytes:
+    skin = Image.new("RGBA", (64, 64), (255, 0, 0, 255))
+    skin.paste((0, 0, 255, 255), (40, 8, 44, 16))  # left half of the face overlay
+    buffer = io.BytesIO()
+    skin.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_texture_hash():
+    assert texture_hash("http://textures.minecraft.net/texture/abc123") == "abc123"
+    other = texture_hash("https://example.com/cape.png")
+    assert other == texture_hash("https://example.com/cape.png")
+    assert other != texture_hash("https://example.com/other/cape.png")
+
+
+def test_rendered_texture_is_shared_by_hash(monkeypatch):
+    renders = CacheNamespace("test_texture_renders", NamespaceConfig(ttl=60), dict)
+    monkeypatch.setattr(texture_cache, "texture_renders", renders)
+    url = "http://textures.minecraft.net/texture/test-skin-hash"
+    rendered = render_texture("skin", url, _skin_png())
+
+    face = Image.open(io.BytesIO(base64.b64decode(rendered["face"])))
+    assert face.size == (8, 8)
+    assert face.getpixel((0, 0))[:3] == (0, 0, 255)  # overlay pasted on top
+    assert face.getpixel((7, 0))[:3] == (255, 0, 0)
+
+    same_texture = "https://textures.minecraft.net/texture/test-skin-hash"
+    assert get_renders([same_texture, None]) == {"test-skin-hash": rendered}
+    assert render_texture("skin", url, b"not a png") is None
+
+
+def test_render_many_dedupes_and_uses_the_pool(monkeypatch):
+    renders = CacheNamespace("test_texture_batch", NamespaceConfig(ttl=60), dict)
+    monkeypatch.setattr(texture_cache, "texture_renders", renders)
+    monkeypatch.setattr(texture_cache, "MIN_POOL_BATCH", 2)
+    base = "http://textures.minecraft.net/texture/"
+    textures = [
+        (base + "a", _skin_png()),
+        (base + "b", _skin_png()),
+        (base + "a", _skin_png()),  # same texture as the first one
+        (base + "broken", b"not a png"),
+    ]
+
+    try:
+        rendered = texture_cache.render_many("skin", textures)
+    finally:
+        texture_cache.close_render_pool()
+
+    assert rendered[base + "a"] == rendered[base + "b"] == render_texture("skin", base + "a", _skin_png())
+    assert rendered[base + "broken"] is None
+    assert set(renders.get_many(["a", "b", "broken"])) == {"a", "b"}
+
+
+def test_async_render_runs_off_the_event_loop(monkeypatch):
+    renders = CacheNamespace("test_texture_async", NamespaceConfig(ttl=60), dict)
+    monkeypatch.setattr(texture_cache, "texture_renders", renders)
+    threads = []
+
+    def render(content):
+        threads.append(threading.get_ident())
+        return {"face": "f"}
+
+    monkeypatch.setitem(texture_cache.RENDERERS, "skin", render)
+    url = "http://textures.minecraft.net/texture/async-skin"
+    rendered = asyncio.run(texture_cache.render_texture_async("skin", url, b"png"))
+
+    assert rendered == {"face": "f"}
+    assert threads and threads[0] != threading.get_ident()
+    assert renders.get("async-skin") == rendered
@@ -0,0 +1,48 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import end_trace, record_span, span, start_trace, traced, with_context
+
+
+@traced(kind="upstream")
+def fetch(value):
+    return value
+
+
+@traced()
+async def fetch_async(value):
+    with span("decode", "image"):
+        return value
+
+
+def test_spans_nest_across_threads_and_tasks():
+    token = start_trace("GET /test")
+    with span("guild", "app"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(lambda f: f(), [with_context(lambda: fetch(1))]))
+        assert asyncio.run(fetch_async(2)) == 2
+    trace = end_trace(token)
+
+    assert results == [1]
+    names = {s.name: s for s in trace.spans}
+    assert names["fetch"].parent is names["guild"]
+    assert names["decode"].parent is names["fetch_async"]
+    assert names["fetch_async"].parent is names["guild"]
+
+    record_span("late", "db", 0.0)  # outside of the trace nothing is recorded
+    assert "late" not in {s.name for s in trace.spans}
+
+
+def test_server_timing_skips_nested_spans_of_the_same_kind():
+    token = start_trace("GET /test")
+    with span("outer", "db") as outer:
+        with span("inner", "db"):
+            pass
+    record_span("query", "upstream", outer.start, outer.start + 0.25)
+    trace = end_trace(token)
+
+    timing = trace.server_timing()
+    assert f"db;dur={outer.duration_ms:.1f}" in timing
+    assert "upstream;dur=250.0" in timing
+    assert "image" not in timing
+    assert timing.split(", ")[-1].startswith("total;dur=")
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import warmup
+
+
+def test_warmup_runs_tasks_and_stops_waiting_at_timeout(monkeypatch):
+    calls = []
+
+    def quick(refresh):
+        calls.append(("quick", refresh))
+        return 1
+
+    def broken(refresh):
+        raise RuntimeError("upstream down")
+
+    def slow(refresh):
+        time.sleep(0.5)
+        calls.append(("slow", refresh))
+        return 1
+
+    monkeypatch.setattr(warmup, "WARMUP_TASKS", {"quick": quick, "broken": broken, "slow": slow})
+    monkeypatch.setattr(warmup, "WARMUP_TIMEOUT", 0.1)
+    monkeypatch.setattr(warmup, "REFRESH_INTERVAL", 3600)
+
+    async def start_and_stop():
+        await warmup.warmup()
+        done_at_startup = list(calls)
+        await asyncio.sleep(0.6)  # the slow task finishes in the background
+        warmup.stop_refreshing()
+        return done_at_startup
+
+    assert asyncio.run(start_and_stop()) == [("quick", False)]
+    assert calls == [("quick", False), ("slow", False)]
+
+    asyncio.run(warmup.run_warmup(refresh=True))
+    assert calls[-2:] == [("quick", True), ("slow", True)]
+
+
+def test_warm_capes_batches_and_logs_failures_one_by_one(monkeypatch, capsys):
+    catalog = [
+        SimpleNamespace(name="Good", url="https://example.com/good"),
+        SimpleNamespace(name="Broken", url="https://example.com/broken"),
+    ]
+    batches = []
+
+    def images_many(urls):
+        batches.append(urls)
+        if "https://example.com/broken" in urls:
+            raise RuntimeError("download failed")
+        return {url: object() for url in urls}
+
+    def images(url):
+        return images_many([url])[url]
+
+    monkeypatch.setattr(warmup, "get_generic_cape_data", lambda refresh: catalog)
+    monkeypatch.setattr(warmup, "get_cape_images_many", images_many)
+    monkeypatch.setattr(warmup, "get_cape_images", images)
+
+    assert warmup.warm_capes() == 1
+    assert batches[0] == ["https://example.com/good", "https://example.com/broken"]
+    assert "Couldn't warm cape Broken" in capsys.readouterr().out
+
+    catalog.pop()
+    batches.clear()
+    assert warmup.warm_capes() == 1
+    assert batches == [["https://example.com/good"]]
@@ -0,0 +1,158 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+from cache import get_cache
+from tracing import span, traced
+from utils import pillow_to_b64
+
+logger = logging.getLogger(__name__)
+
+# rendered images of a texture by name, "face" for skins, "front" and "back" for capes
+RenderedTexture = Dict[str, str]
+
+# textures.minecraft.net urls end in a hash of the texture, the same hash always
+# means the same image, so renders are keyed by it and shared between players
+texture_renders = get_cache("texture_renders", RenderedTexture)
+
+
+def texture_hash(url: str) -> str:
+    """Hash in a textures.minecraft.net url, other urls are keyed by a hash of the url"""
+    parts = urlsplit(url)
+    if parts.hostname == "textures.minecraft.net":
+        return parts.path.rstrip("/").rsplit("/", 1)[-1]
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+@traced("render skin face", kind="image")
+def render_skin_face(skin_content: bytes) -> RenderedTexture:
+    """Crops the face out of a skin and overlays the outer layer on it"""
+    full_skin_image = Image.open(io.BytesIO(skin_content))
+
+    face = full_skin_image.crop((8, 8, 16, 16))  # base skin face
+    face_overlay = full_skin_image.crop((40, 8, 48, 16))
+    _, _, _, alpha_mask = face_overlay.split()
+    face.paste(face_overlay, (0, 0), mask=alpha_mask)
+
+    return {"face": pillow_to_b64(face)}
+
+
+@traced("render cape", kind="image")
+def render_cape(cape_content: bytes) -> RenderedTexture:
+    """Crops the front and back of a cape texture"""
+    full_cape_image = Image.open(io.BytesIO(cape_content))
+    return {
+        "front": pillow_to_b64(full_cape_image.crop((1, 1, 11, 17))),
+        "back": pillow_to_b64(full_cape_image.crop((12, 1, 22, 17))),
+    }
+
+
+RENDERERS = {"skin": render_skin_face, "cape": render_cape}
+
+# Pillow holds the GIL while decoding and encoding, so batches are rendered in
+# worker processes, smaller batches aren't worth sending to another process
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+MIN_POOL_BATCH = 4
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_renders(urls: Iterable[Optional[str]]) -> Dict[str, RenderedTexture]:
+    """Cached renders by texture hash, urls without a render are left out"""
+    hashes = [texture_hash(url) for url in urls if url is not None]
+    return texture_renders.get_many(hashes) if hashes else {}
+
+
+async def get_renders_async(urls: Iterable[Optional[str]]) -> Dict[str, RenderedTexture]:
+    hashes = [texture_hash(url) for url in urls if url is not None]
+    return await texture_renders.get_many_async(hashes) if hashes else {}
+
+
+def render_texture(kind: str, url: str, content: Optional[bytes]) -> Optional[RenderedTexture]:
+    """Renders a downloaded texture and caches it, None if it couldn't be rendered"""
+    rendered = _render(kind, url, content)
+    if rendered is not None:
+        texture_renders.set(texture_hash(url), rendered)
+    return rendered
+
+
+async def render_texture_async(
+    kind: str, url: str, content: Optional[bytes]
+) -> Optional[RenderedTexture]:
+    # Pillow decoding and encoding would block the event loop
+    rendered = await run_in_threadpool(_render, kind, url, content)
+    if rendered is not None:
+        await texture_renders.set_async(texture_hash(url), rendered)
+    return rendered
+
+
+def _render(kind: str, url: str, content: Optional[bytes]) -> Optional[RenderedTexture]:
+    if content is None:
+        return None
+    try:
+        return RENDERERS[kind](content)
+    except Exception as e:
+        logger.error(f"something went wrong while rendering {kind} texture {url}: {e}")
+        return None
+
+
+def _render_batch(kind: str, contents: List[bytes]) -> List[Optional[RenderedTexture]]:
+    """Runs in a worker process, returns None for textures that couldn't be rendered"""
+    return [_render(kind, "", content) for content in contents]
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        # spawned rather than forked, forking a process with running threads can deadlock
+        _render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _render_pool
+
+
+def close_render_pool() -> None:
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+        _render_pool = None
+
+
+def render_many(
+    kind: str, textures: List[Tuple[str, bytes]]
+) -> Dict[str, Optional[RenderedTexture]]:
+    """
+    Renders many downloaded textures of one kind and caches them, returns the
+    renders by url. Textures sharing a hash are rendered once, and batches of
+    MIN_POOL_BATCH or more are split across the render process pool.
+    """
+    contents: Dict[str, bytes] = {}
+    for url, content in textures:
+        if content is not None:
+            contents.setdefault(texture_hash(url), content)
+    hashes = list(contents)
+
+    with span(f"render {kind} batch", "image", textures=len(hashes)):
+        if len(hashes) < MIN_POOL_BATCH:
+            results = _render_batch(kind, [contents[h] for h in hashes])
+        else:
+            chunk_size = -(-len(hashes) // RENDER_WORKERS)  # one chunk per worker
+            chunks = [hashes[i : i + chunk_size] for i in range(0, len(hashes), chunk_size)]
+            pool = get_render_pool()
+            futures = [
+                pool.submit(_render_batch, kind, [contents[h] for h in chunk])
+                for chunk in chunks
+            ]
+            results = [render for future in futures for render in future.result()]
+
+    renders = dict(zip(hashes, results))
+    for digest, rendered in renders.items():
+        if rendered is not None:
+            texture_renders.set(digest, rendered)
+    return {url: renders.get(texture_hash(url)) for url, _ in textures}
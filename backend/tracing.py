@@ -0,0 +1,237 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# span kinds summarised in the Server-Timing header, everything else is "app"
+SERVER_TIMING_KINDS = ("upstream", "db", "image")
+RECENT_TRACES = 200  # finished traces kept in memory
+# finished traces are also appended here as JSON lines when set
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+
+class Span:
+    def __init__(
+        self,
+        trace: "Trace",
+        name: str,
+        kind: str,
+        parent: Optional["Span"],
+        attributes: Optional[dict] = None,
+        start: Optional[float] = None,
+    ):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes or {}
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = time.perf_counter() if self.end is None else self.end
+        return 1000 * (end - self.start)
+
+    def finish(self, end: Optional[float] = None) -> None:
+        self.end = time.perf_counter() if end is None else end
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            "kind": self.kind,
+            "offset_ms": round(1000 * (self.start - self.trace.root.start), 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """
+    All spans of one request
+
+    Spans from the thread pool and child tasks are added to the same trace, so
+    adding is locked. Spans that end after the trace finished (background refreshes
+    started by the request) are ignored.
+    """
+
+    def __init__(self, name: str, attributes: Optional[dict] = None):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self.finished = False
+        self._lock = threading.Lock()
+        self.root = Span(self, name, "app", None, attributes)
+        self.spans.append(self.root)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            if not self.finished:
+                self.spans.append(span)
+
+    def finish(self) -> None:
+        with self._lock:
+            self.root.finish()
+            self.finished = True
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing header value with the time spent per span kind. Spans nested in
+        a span of the same kind are skipped so time isn't counted twice, concurrent
+        spans still add up and can exceed the total.
+        """
+        totals = {kind: 0.0 for kind in SERVER_TIMING_KINDS}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            if span.kind not in totals or span.end is None:
+                continue
+            parent = span.parent
+            while parent is not None and parent.kind != span.kind:
+                parent = parent.parent
+            if parent is None:
+                totals[span.kind] += span.duration_ms
+        entries = [f"{kind};dur={ms:.1f}" for kind, ms in totals.items() if ms > 0]
+        entries.append(f"total;dur={self.root.duration_ms:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "name": self.root.name,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "spans": [span.to_dict() for span in spans],
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+recent_traces: deque = deque(maxlen=RECENT_TRACES)
+_file_lock = threading.Lock()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_trace(name: str, **attributes) -> contextvars.Token:
+    """Starts the trace of a request, the token is passed to end_trace"""
+    trace = Trace(name, attributes)
+    return _current_span.set(trace.root)
+
+
+def end_trace(token: contextvars.Token) -> Optional[Trace]:
+    """Finishes the trace started with token and hands it to the exporters"""
+    root = _current_span.get()
+    _current_span.reset(token)
+    if root is None:
+        return None
+    trace = root.trace
+    trace.finish()
+    export_trace(trace)
+    return trace
+
+
+def export_trace(trace: Trace) -> None:
+    recent_traces.append(trace)
+    if TRACE_FILE:
+        try:
+            line = json.dumps(trace.to_dict())
+            with _file_lock, open(TRACE_FILE, "a") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            print(f"Couldn't write trace {trace.trace_id}: {e}")
+
+
+@contextmanager
+def span(name: str, kind: str = "app", **attributes):
+    """
+    Times the block as a child of the current span. Outside of a trace this does
+    nothing and yields None.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, kind, parent, attributes)
+    parent.trace.add(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def record_span(
+    name: str, kind: str, start: float, end: Optional[float] = None, **attributes
+) -> Optional[Span]:
+    """Adds an already finished leaf span, start and end are time.perf_counter() values"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    child = Span(parent.trace, name, kind, parent, attributes, start)
+    child.finish(end)
+    parent.trace.add(child)
+    return child
+
+
+def traced(name: Optional[str] = None, kind: str = "app"):
+    """Decorator that runs a sync or async function in a span"""
+
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, kind):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, kind):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def with_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Binds fn to a copy of the current context, so work submitted to a
+    ThreadPoolExecutor keeps the caller's span as its parent
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def get_recent_traces(limit: int = 50) -> List[Dict[str, Any]]:
+    return [trace.to_dict() for trace in list(recent_traces)[-limit:]][::-1]
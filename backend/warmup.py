@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Set
+from fastapi.concurrency import run_in_threadpool
+from capes import get_generic_cape_data, get_cape_images, get_cape_images_many
+from metrics_manager import warm_metrics
+from wynn_data_manager import WynnDataManager
+
+# startup waits this long for the warmup before serving, slow tasks keep running
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 30))
+# seconds between refreshes, shorter than the catalog and guild list cache ttls
+REFRESH_INTERVAL = float(os.getenv("WARMUP_REFRESH_INTERVAL", 1800))
+
+_tasks: Set[asyncio.Task] = set()  # keeps a reference so tasks aren't garbage collected
+
+
+def warm_capes(refresh: bool = False) -> int:
+    """
+    Loads the capes.me catalog and renders every cape in it, which includes the
+    official capes in CAPE_MAP. Cached renders are read in one lookup and the
+    rest are downloaded concurrently. If the batch fails, capes are retried one
+    by one so the failing ones get logged.
+    """
+    catalog = get_generic_cape_data(refresh=refresh)
+    try:
+        return len(get_cape_images_many([cape.url for cape in catalog]))
+    except Exception as e:
+        print(f"Couldn't warm capes in one batch, retrying one by one: {e}")
+
+    rendered = 0
+    for cape in catalog:
+        try:
+            get_cape_images(cape.url)
+            rendered += 1
+        except Exception as e:
+            print(f"Couldn't warm cape {cape.name}: {e}")
+    return rendered
+
+
+def warm_guild_list(refresh: bool = False) -> int:
+    return len(WynnDataManager().get_guild_list(refresh=refresh))
+
+
+def warm_metric_registry(refresh: bool = False) -> int:
+    return warm_metrics()
+
+
+WARMUP_TASKS: Dict[str, Callable[[bool], int]] = {
+    "capes": warm_capes,
+    "wynncraft guild list": warm_guild_list,
+    "metrics": warm_metric_registry,
+}
+
+
+async def run_warmup(refresh: bool = False) -> None:
+    """Runs every warmup task concurrently on the threadpool, failures are only logged"""
+
+    async def run(name: str, task: Callable[[bool], int]) -> None:
+        start = time.time()
+        try:
+            count = await run_in_threadpool(task, refresh)
+            print(f"warmup: {name} done ({count} items, {time.time() - start:.1f}s)")
+        except Exception as e:
+            print(f"warmup: {name} failed: {e}")
+
+    await asyncio.gather(*[run(name, task) for name, task in WARMUP_TASKS.items()])
+
+
+async def warmup() -> None:
+    """
+    Called on startup, waits for the warmup at most WARMUP_TIMEOUT seconds and
+    then keeps refreshing in the background until stop_refreshing is called
+    """
+    task = asyncio.create_task(run_warmup())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    _tasks.add(asyncio.create_task(refresh_periodically()))
+    try:
+        await asyncio.wait_for(asyncio.shield(task), WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"warmup: not done after {WARMUP_TIMEOUT}s, serving anyway")
+
+
+async def refresh_periodically() -> None:
+    """Replaces the warmed data every REFRESH_INTERVAL seconds until cancelled"""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        await run_warmup(refresh=True)
+
+
+def stop_refreshing() -> None:
+    for task in _tasks:
+        task.cancel()
@@ -1,29 +1,23 @@
 # wynn_data_manager.py
-import time
-from wynn_cache import WynnCacheManager
+from cache import get_cache
 from wynncraft_api import GetWynncraftData
 
+guild_list_cache = get_cache("wynncraft_guild_list", dict)
+
 class WynnDataManager:
     def __init__(self):
-        # It's more efficient to create these instances once
-        self.cache_manager = WynnCacheManager()
         self.api_client = GetWynncraftData()
     
-    def get_guild_list(self, cache_duration: int = 3600):
+    def get_guild_list(self, cache_duration: int = 3600, refresh: bool = False):
         """
         Retrieve the list of guilds, using the cache if it's valid.
         This is a more efficient, combined version of your two original methods.
+        refresh skips the cache read so the cached list is replaced.
         """
-        cached_data = self.cache_manager.get_guild_list()
-        
-        # Check if cache exists and is valid
-        if cached_data:
-            data, timestamp = cached_data
-            current_time = int(time.time())
-            if (current_time - timestamp) < cache_duration:
-                print("Returning guild list from CACHE.")
-                guild_list = self._process_guild_list(data)
-                return guild_list  # Return the processed guild list directly
+        cached_data = None if refresh else guild_list_cache.get("all")
+        if cached_data is not None:
+            print("Returning guild list from CACHE.")
+            return self._process_guild_list(cached_data)
 
         # If cache is invalid or doesn't exist, fetch from API
         print("Cache invalid or not found. Fetching guild list from API.")
@@ -31,7 +25,7 @@ class WynnDataManager:
 
         # Save the new data to the cache
         if expanded_guild_list: # Only save if the API call was successful
-            self.cache_manager.save_guild_list(expanded_guild_list)
+            guild_list_cache.set("all", expanded_guild_list, cache_duration)
         
         guild_list = self._process_guild_list(expanded_guild_list)
 
@@ -1,9 +1,13 @@
-import requests
 from utils import dashify_uuid
+from http_client import get_async_client, get_sync_session
+from rate_limiter import limiters
+from negative_cache import negative_cache
+from cache_tracking import record_cache, NEGATIVE
+from cache import get_cache
 from pydantic import BaseModel
 from typing import Optional
 from fastapi import HTTPException
-from metrics_manager import add_value, get_engine
+from metric_writer import metric_writer
 from dotenv import load_dotenv
 import os
 from exceptions import NotFound
@@ -103,19 +107,66 @@ class GuildInfo(BaseModel):
     members: list[GuildMember]
 
 
+player_cache = get_cache("wynncraft_player", PlayerSummary)
+guild_cache = get_cache("wynncraft_guild", GuildInfo)
+
+
 class GetWynncraftData:
     def __init__(self):
         pass
 
     def get_player_data(self, uuid) -> PlayerSummary:
         """Gets basic data about the player"""
+        cache_key = uuid.replace("-", "").lower()
+        if negative_cache.contains("wynncraft", cache_key):
+            record_cache(player_cache.name, NEGATIVE)
+            raise NotFound()
+        player_data = player_cache.get(cache_key)
+        if player_data is not None:
+            return player_data
+
+        dashed_uuid = dashify_uuid(uuid)
+        limiters["wynncraft"].acquire()
+        raw_wynn_response = get_sync_session().get(
+            f"https://api.wynncraft.com/v3/player/{dashed_uuid}?fullResult",
+            headers={"Authorization": f"Bearer {wynn_token}"},
+        )
+        limiters["wynncraft"].update(raw_wynn_response)
+        if raw_wynn_response.status_code == 404:
+            negative_cache.add("wynncraft", cache_key)
+            raise NotFound()
+        player_data = self._process_player_response(raw_wynn_response, dashed_uuid)
+        negative_cache.invalidate("wynncraft", cache_key)
+        player_cache.set(cache_key, player_data)
+        return player_data
+
+    async def get_player_data_async(self, uuid) -> PlayerSummary:
+        """Async version of get_player_data using the shared client"""
+        cache_key = uuid.replace("-", "").lower()
+        if negative_cache.contains("wynncraft", cache_key):
+            record_cache(player_cache.name, NEGATIVE)
+            raise NotFound()
+        player_data = await player_cache.get_async(cache_key)
+        if player_data is not None:
+            return player_data
+
         dashed_uuid = dashify_uuid(uuid)
-        raw_wynn_response = requests.get(
+        await limiters["wynncraft"].acquire_async()
+        raw_wynn_response = await get_async_client().get(
             f"https://api.wynncraft.com/v3/player/{dashed_uuid}?fullResult",
             headers={"Authorization": f"Bearer {wynn_token}"},
         )
+        limiters["wynncraft"].update(raw_wynn_response)
         if raw_wynn_response.status_code == 404:
+            negative_cache.add("wynncraft", cache_key)
             raise NotFound()
+        player_data = self._process_player_response(raw_wynn_response, dashed_uuid)
+        negative_cache.invalidate("wynncraft", cache_key)
+        await player_cache.set_async(cache_key, player_data)
+        return player_data
+
+    def _process_player_response(self, raw_wynn_response, dashed_uuid) -> PlayerSummary:
+        """Builds a PlayerSummary, works with both requests and httpx responses"""
         try:
 
             raw_wynn_response.raise_for_status()
@@ -254,12 +305,37 @@ class GetWynncraftData:
 
     def get_guild_data(self, guild_prefix: str) -> GuildInfo:
         """Gets the guild response, player_guild is req"""
-        raw_guild_response = requests.get(
+        guild_data = guild_cache.get(guild_prefix)
+        if guild_data is not None:
+            return guild_data
+
+        limiters["wynncraft"].acquire()
+        raw_guild_response = get_sync_session().get(
             f"https://api.wynncraft.com/v3/guild/prefix/{guild_prefix}?identifier=username",
             headers={"Authorization": f"Bearer {wynn_token}"},
         )
-        guild_response = raw_guild_response.json()
+        limiters["wynncraft"].update(raw_guild_response)
+        guild_data = self._process_guild_response(raw_guild_response.json())
+        guild_cache.set(guild_prefix, guild_data)
+        return guild_data
+
+    async def get_guild_data_async(self, guild_prefix: str) -> GuildInfo:
+        """Async version of get_guild_data using the shared client"""
+        guild_data = await guild_cache.get_async(guild_prefix)
+        if guild_data is not None:
+            return guild_data
+
+        await limiters["wynncraft"].acquire_async()
+        raw_guild_response = await get_async_client().get(
+            f"https://api.wynncraft.com/v3/guild/prefix/{guild_prefix}?identifier=username",
+            headers={"Authorization": f"Bearer {wynn_token}"},
+        )
+        limiters["wynncraft"].update(raw_guild_response)
+        guild_data = self._process_guild_response(raw_guild_response.json())
+        await guild_cache.set_async(guild_prefix, guild_data)
+        return guild_data
 
+    def _process_guild_response(self, guild_response: dict) -> GuildInfo:
         guild_members = []
         for rank in guild_response["members"]:
             if rank == "total":
@@ -297,7 +373,7 @@ class GetWynncraftData:
 
     def _get_total_quests(self):
         """This is the total number of quests, which changes very rarely"""
-        quests_response = requests.get(
+        quests_response = get_sync_session().get(
             f"https://api.wynncraft.com/v3/map/quests",
             headers={"Authorization": f"Bearer {wynn_token}"},
         )
@@ -306,10 +382,28 @@ class GetWynncraftData:
 
     def get_guild_list(self):
         try:
-            guilds_reponse = requests.get(
+            limiters["wynncraft"].acquire()
+            guilds_reponse = get_sync_session().get(
+                "https://api.wynncraft.com/v3/guild/list/guild",
+                headers={"Authorization": f"Bearer {wynn_token}"},
+            )
+            limiters["wynncraft"].update(guilds_reponse)
+            guilds_reponse.raise_for_status()
+
+            return guilds_reponse.json()
+        except Exception as e:
+            print(f"Error fetching guild list: {e}")
+            return []
+
+    async def get_guild_list_async(self):
+        """Async version of get_guild_list"""
+        try:
+            await limiters["wynncraft"].acquire_async()
+            guilds_reponse = await get_async_client().get(
                 "https://api.wynncraft.com/v3/guild/list/guild",
                 headers={"Authorization": f"Bearer {wynn_token}"},
             )
+            limiters["wynncraft"].update(guilds_reponse)
             guilds_reponse.raise_for_status()
 
             return guilds_reponse.json()
@@ -330,11 +424,7 @@ def add_wynncraft_stats_to_db(data: PlayerSummary) -> None:
         11: data.player_stats.raids_completed,
         6: data.player_stats.playtime_hours,
     }
-    engine = get_engine()
-    with engine.begin() as conn:
-        for stat in stats_to_add:
-            if stats_to_add.get(stat, None) is not None:
-                add_value(conn, data.uuid, stat, stats_to_add[stat])
+    metric_writer.add_many(data.uuid, stats_to_add)
 
 
 if __name__ == "__main__":